@@ -0,0 +1,219 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+from typing import *
+
+GITHUB = 'https://github.com/'
+# attempts per repository, waiting BACKOFF * 2 ** attempt seconds in between
+RETRIES = 3
+BACKOFF = 2.0
+# checkouts are cloned into this hidden directory of the output first and moved once
+# complete, so an interrupted run never leaves a half cloned repository that looks finished
+PARTIAL = '.partial'
+
+
+class GitError(Exception):
+    pass
+
+
+def _git(*args: str, cwd: Optional[str] = None) -> str:
+    result = subprocess.run(['git', *args], cwd = cwd, capture_output = True, text = True,
+                            env = {**os.environ, 'GIT_TERMINAL_PROMPT': '0'})
+    if result.returncode != 0:
+        # the fatal line says what went wrong, hints follow it
+        lines = result.stderr.strip().splitlines()
+        fatal = [l for l in lines if l.startswith(('fatal:', 'error:'))]
+        raise GitError((fatal or lines or [f'git {args[0]} failed'])[0])
+    return result.stdout.strip()
+
+
+def read_repos(path: str) -> List[Tuple[str, Optional[str]]]:
+    # one owner/name per line, optionally followed by the commit to pin
+    repos = []
+    with open(path) as f:
+        for line in f:
+            parts = line.split('#')[0].split()
+            if parts:
+                repos.append((parts[0], parts[1] if len(parts) > 1 else None))
+    return repos
+
+
+def check_names(repos: Iterable[str]) -> None:
+    # checkouts are named after the repository without its owner, so two repositories
+    # with the same name would be cloned into the same directory
+    names : Dict[str, str] = {}
+    for repo in repos:
+        name = repo.split('/')[-1]
+        # case insensitive file systems see Foo and foo as one directory
+        if name.lower() in names:
+            raise Exception(f'{names[name.lower()]} and {repo} would both be cloned to {name}, '
+                            f'list every repository once and rename or drop one of them')
+        names[name.lower()] = repo
+
+
+def remote_head(url: str) -> str:
+    return _git('ls-remote', url, 'HEAD').split()[0]
+
+
+def local_head(dest: str) -> Optional[str]:
+    if not os.path.isdir(os.path.join(dest, '.git')):
+        return None
+    try:
+        return _git('rev-parse', 'HEAD', cwd = dest)
+    except GitError:
+        return None
+
+
+def _fetch_commit(url: str, dest: str, sha: Optional[str]) -> str:
+    # a single commit without history, blobs come with the checkout
+    if not os.path.isdir(os.path.join(dest, '.git')):
+        _git('init', '-q', dest)
+        _git('remote', 'add', 'origin', url, cwd = dest)
+    _git('fetch', '-q', '--depth', '1', '--filter=blob:none', '--no-tags', 'origin', sha or 'HEAD', cwd = dest)
+    _git('checkout', '-q', '--detach', '--force', 'FETCH_HEAD', cwd = dest)
+    return _git('rev-parse', 'HEAD', cwd = dest)
+
+
+def acquire(repo: str, url: str, dest: str, sha: Optional[str] = None, update: bool = False) -> Tuple[str, str]:
+    # returns (status, commit), status is one of cloned, updated or up-to-date
+    # an existing checkout is kept if it is at the pinned commit, or at any commit unless update is set
+    current = local_head(dest)
+    if current:
+        if sha and current.startswith(sha):
+            return 'up-to-date', current
+        if not sha and not update:
+            return 'up-to-date', current
+        target = sha or remote_head(url)
+        if current == target:
+            return 'up-to-date', current
+        _git('remote', 'set-url', 'origin', url, cwd = dest)
+        return 'updated', _fetch_commit(url, dest, target)
+
+    partial = os.path.join(os.path.dirname(dest), PARTIAL, os.path.basename(dest))
+    if os.path.exists(partial):
+        shutil.rmtree(partial)
+    if os.path.exists(dest):
+        raise GitError(f'{dest} exists and is not a git checkout')
+    if sha:
+        commit = _fetch_commit(url, partial, sha)
+    else:
+        _git('clone', '-q', '--depth', '1', '--filter=blob:none', '--single-branch', '--no-tags', url, partial)
+        commit = _git('rev-parse', 'HEAD', cwd = partial)
+    os.rename(partial, dest)
+    return 'cloned', commit
+
+
+class Manifest:
+    # repo -> {url, commit, status, error, seconds}, rewritten after every repository
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._lock = threading.Lock()
+        self.entries : Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def pinned(self, repo: str) -> Optional[str]:
+        entry = self.entries.get(repo)
+        return entry.get('commit') if entry else None
+
+    def record(self, repo: str, **entry: Any) -> None:
+        with self._lock:
+            self.entries[repo] = {**self.entries.get(repo, {}), **entry}
+            with open(f'{self._path}.tmp', 'w') as f:
+                json.dump(self.entries, f, indent = 2, sort_keys = True)
+            os.replace(f'{self._path}.tmp', self._path)
+
+
+def acquire_all(repos: Sequence[Tuple[str, Optional[str]]],
+                out: str,
+                manifest: Manifest,
+                base_url: str = GITHUB,
+                workers: int = 8,
+                retries: int = RETRIES,
+                backoff: float = BACKOFF,
+                update: bool = False,
+                log: Callable[[str], None] = print,
+                ) -> Dict[str, int]:
+    # clone or refresh every repository with at most workers git processes at a time
+    # commits in the list win over the manifest, the manifest pins everything else
+    if retries < 1:
+        raise Exception(f'retries must be at least 1, got {retries}')
+    check_names(repo for repo, _ in repos)
+    os.makedirs(out, exist_ok = True)
+
+    def run(repo: str, sha: Optional[str]) -> str:
+        url = base_url + repo
+        dest = os.path.join(out, repo.split('/')[-1])
+        pin = sha or (None if update else manifest.pinned(repo))
+        start = time.perf_counter()
+        for attempt in range(retries):
+            try:
+                status, commit = acquire(repo, url, dest, pin, update)
+                manifest.record(repo, url = url, commit = commit, status = status, error = None,
+                                seconds = round(time.perf_counter() - start, 3))
+                log(f'{repo}: {status} {commit[:12]}')
+                return status
+            except Exception as e:
+                # git failures and anything else, e.g. a full disk, fail only this repository
+                error = str(e) if isinstance(e, GitError) else f'{type(e).__name__}: {e}'
+                if attempt + 1 < retries:
+                    time.sleep(backoff * 2 ** attempt)
+        manifest.record(repo, url = url, status = 'failed', error = error,
+                        seconds = round(time.perf_counter() - start, 3))
+        log(f'{repo}: failed after {retries} attempts: {error}')
+        return 'failed'
+
+    counts : Dict[str, int] = {}
+    with ThreadPoolExecutor(workers) as pool:
+        futures = [pool.submit(run, repo, sha) for repo, sha in repos]
+        for future in as_completed(futures):
+            status = future.result()
+            counts[status] = counts.get(status, 0) + 1
+    return counts
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("repos", metavar = "Repos", type = str, help = "File with one owner/name per line, optionally followed by a commit to pin")
+    arg_parser.add_argument("--out", metavar = "Directory", type = str, default = "../repos/", help = "Directory to clone into")
+    arg_parser.add_argument("--manifest", metavar = "Manifest", type = str, help = "JSON manifest of pinned commits, defaults to <out>/manifest.json")
+    arg_parser.add_argument("--base-url", metavar = "URL", type = str, default = GITHUB, help = "Prefix of every repository url, e.g. file:///srv/mirrors/")
+    arg_parser.add_argument("--workers", metavar = "Workers", type = int, default = 8, help = "Number of concurrent clones")
+    arg_parser.add_argument("--retries", metavar = "Retries", type = int, default = RETRIES, help = "Attempts per repository")
+    arg_parser.add_argument("--backoff", metavar = "Seconds", type = float, default = BACKOFF, help = "Wait before the first retry, doubled after every attempt")
+    arg_parser.add_argument("--update", action = "store_true", help = "Move unpinned checkouts to the latest remote commit instead of the manifest commit")
+    args = arg_parser.parse_args()
+
+    if args.retries < 1:
+        arg_parser.error("--retries must be at least 1")
+    repos = read_repos(args.repos)
+    try:
+        check_names(repo for repo, _ in repos)
+    except Exception as e:
+        arg_parser.error(str(e))
+
+    manifest = Manifest(args.manifest or os.path.join(args.out, 'manifest.json'))
+    start = time.perf_counter()
+    counts = acquire_all(
+        repos,
+        args.out,
+        manifest,
+        base_url = args.base_url,
+        workers = args.workers,
+        retries = args.retries,
+        backoff = args.backoff,
+        update = args.update,
+    )
+    print(f'{sum(counts.values())} repositories in {time.perf_counter() - start:.1f}s: ' + ', '.join(f'{n} {s}' for s, n in sorted(counts.items())))
+    if counts.get('failed'):
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import argparse
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import glob
+from itertools import islice
+import time
+from typing import *
+
+import numpy as np
+from tree_sitter import Parser, Tree
+
+from codebase_parser import PYTHON
+from embedders import EMBEDDERS, get_embedder
+from file_parser import embed_nodes
+from single_file import ASTSingleFileParser
+from source import SourceBuffer, decode_source
+
+# files read ahead of the parser, and parsed snippets waiting for their features
+PREFETCH = 4
+QUEUE_SIZE = 2
+
+
+class ASTSnippetParser(ASTSingleFileParser):
+    # one snippet held in memory, name stands in for the file path
+    def __init__(self, name: str, data: bytes, dim: Optional[int] = None, parser: Optional[Parser] = None, embedder: str = 'fasttext') -> None:
+        self._data = data
+        super().__init__(name, dim, parser, embedder)
+
+    def _get_syntax_tree(self, filepath: str, source: Optional[SourceBuffer] = None) -> Tree:
+        self._source = decode_source(self._data)
+        return self._parser.parse(self._source.data, keep_text = False)
+
+
+def read_files(paths: Sequence[str], prefetch: int = PREFETCH) -> Iterator[Tuple[str, bytes]]:
+    # (path, source) in order, keeping prefetch reads in flight on threads
+    # so the files are read while the ones before them are parsed
+    def read(path: str) -> bytes:
+        with open(path, 'rb') as f:
+            return f.read()
+
+    with ThreadPoolExecutor(max(prefetch, 1)) as pool:
+        pending = iter(paths)
+        window = deque((p, pool.submit(read, p)) for p in islice(pending, max(prefetch, 1)))
+        while window:
+            path, future = window.popleft()
+            following = next(pending, None)
+            if following is not None:
+                window.append((following, pool.submit(read, following)))
+            yield path, future.result()
+
+
+def parse_snippets(snippets: Iterable[Tuple[str, bytes]],
+                   dim: Optional[int] = None,
+                   embedder: str = 'fasttext',
+                   queue_size: int = QUEUE_SIZE,
+                   ) -> Dict[str, Any]:
+    # parse a batch of (name, source) pairs into one disconnected graph
+    # nodes of snippet i are rows offsets[i]:offsets[i + 1] of every array
+    # the stages overlap: snippets can come from a lazy reader such as read_files, they are
+    # parsed one after another with a single tree-sitter parser, and their features are
+    # computed on a worker thread while the next ones parse. at most queue_size parsed
+    # snippets wait for features before parsing waits for the worker
+    from scipy import sparse
+
+    parser = Parser()
+    parser.set_language(PYTHON)
+    model = get_embedder(embedder, dim) if dim is not None else None
+
+    names, nodes, features = [], [], []
+    from_, to_, rel = [], [], []
+    offsets = [0]
+    skipped : List[Tuple[str, str]] = []
+    embedding : Deque[Future] = deque()
+    with ThreadPoolExecutor(1) as embed_pool:
+        for name, data in snippets:
+            ast = ASTSnippetParser(name, data, dim, parser, embedder)
+            ast.parse_dir()
+            skipped.extend(ast.skipped_files)
+            arrays = ast.arrays()
+
+            names.append(name)
+            nodes.extend(arrays['nodes'])
+            from_.append(arrays['from'] + offsets[-1])
+            to_.append(arrays['to'] + offsets[-1])
+            rel.append(arrays['rel'])
+            if model is not None:
+                if len(embedding) >= max(queue_size, 1):
+                    features.append(embedding.popleft().result())
+                embedding.append(embed_pool.submit(embed_nodes, arrays['nodes'], arrays['start'], arrays['end'], model, dim))
+            offsets.append(offsets[-1] + len(arrays['nodes']))
+        features.extend(future.result() for future in embedding)
+
+    n = offsets[-1]
+    from_ = np.concatenate(from_) if from_ else np.zeros(0, dtype = np.int64)
+    to_ = np.concatenate(to_) if to_ else np.zeros(0, dtype = np.int64)
+    batch = {
+        'names': names,
+        'nodes': nodes,
+        'offsets': np.array(offsets, dtype = np.int64),
+        'from': from_,
+        'to': to_,
+        'rel': np.concatenate(rel) if rel else np.zeros(0, dtype = np.int64),
+        # edges never cross snippets, so the adjacency is block diagonal
+        'adjacency': sparse.csr_matrix((np.ones(len(from_), dtype = np.float32), (from_, to_)), shape = (n, n)),
+        'skipped': skipped,
+    }
+    if dim is not None:
+        batch['features'] = np.concatenate(features) if features else np.zeros((0, dim))
+    return batch
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--files", metavar = "Files", type = str, nargs = "+", required = True, help = "Files or glob patterns read into memory and parsed as one batch")
+    arg_parser.add_argument("--dim", metavar = "Dimension", type = int, help = "Also compute node features of this dimension")
+    arg_parser.add_argument("--embedder", choices = list(EMBEDDERS), default = "fasttext", help = "Embedding of node types and text")
+    args = arg_parser.parse_args()
+
+    paths = [file for pattern in args.files for file in sorted(glob.glob(pattern, recursive = True))]
+
+    start = time.perf_counter()
+    batch = parse_snippets(read_files(paths), args.dim, args.embedder)
+    print(f'{len(batch["names"])} snippets, {len(batch["nodes"])} nodes, {batch["adjacency"].nnz} edges in {(time.perf_counter() - start) * 1000:.1f}ms')
+    for name, reason in batch['skipped']:
+        print(f'Skipped {name}: {reason}')
+
+
+if __name__ == "__main__":
+    main()
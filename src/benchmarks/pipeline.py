@@ -0,0 +1,179 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import *
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from codebase_parser import ASTCodebaseParser
+from embedders import EMBEDDERS
+from instrumentation import peak_rss
+from reorder import METHODS
+from synthetic import DEFAULTS, HELP, generate
+
+STAGES = ['discovery', 'order', 'parse', 'delayed_edges', 'condense', 'reorder', 'export', 'featurize', 'spmm']
+# a stage is a regression if it is this much slower than the baseline
+TOLERANCE = 0.2
+# products of the adjacency matrix with random node features, the fastest one is reported
+SPMM_REPEAT = 5
+
+
+def spmm(ast: ASTCodebaseParser, dim: int) -> float:
+    # what a graph layer does with the exported matrix, sensitive to the node order
+    import scipy.sparse
+    from_, to_, _ = ast.AST.edges.unique()
+    n = ast.AST.num_vertices
+    adjacency = scipy.sparse.csr_array((np.ones(len(from_), dtype = np.float32), (from_, to_)), shape = (n, n))
+    features = np.random.default_rng(0).random((n, dim), dtype = np.float32)
+    times = []
+    for _ in range(SPMM_REPEAT):
+        start = time.perf_counter()
+        adjacency @ features
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run(dir: str, dim: int, featurize: bool = False, condense: bool = False, embedder: str = 'fasttext', reorder: Optional[str] = None) -> Dict[str, Any]:
+    # time every stage of the pipeline once
+    seconds : Dict[str, float] = {}
+    with tempfile.TemporaryDirectory() as out:
+        nf, adj = os.path.join(out, 'nf'), os.path.join(out, 'adj')
+
+        start = time.perf_counter()
+        ast = ASTCodebaseParser(dir, dim, embedder = embedder)
+        seconds['discovery'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        components = ast._order_files()
+        seconds['order'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ast._parse_files(components)
+        seconds['parse'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ast._resolve_delayed_edges()
+        seconds['delayed_edges'] = time.perf_counter() - start
+        nodes, edges = ast.AST.num_vertices, len(ast.AST.edges)
+
+        if condense:
+            start = time.perf_counter()
+            ast.condense()
+            seconds['condense'] = time.perf_counter() - start
+
+        if reorder:
+            start = time.perf_counter()
+            ast.reorder(reorder)
+            seconds['reorder'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ast.to_csv(nf, adj)
+        seconds['export'] = time.perf_counter() - start
+
+        if featurize:
+            start = time.perf_counter()
+            ast.csv_features_to_vectors(nf)
+            seconds['featurize'] = time.perf_counter() - start
+
+        seconds['spmm'] = spmm(ast, dim)
+
+    graph_seconds = seconds['parse'] + seconds['delayed_edges']
+    return {
+        'files': len(ast._relative_files),
+        'nodes': nodes,
+        'edges': edges,
+        'condensed_nodes': ast.AST.num_vertices if condense else None,
+        'seconds': seconds,
+        'nodes_per_sec': nodes / graph_seconds if graph_seconds else 0.,
+        'edges_per_sec': edges / graph_seconds if graph_seconds else 0.,
+        'peak_rss_kb': peak_rss(),
+    }
+
+
+def best_of(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # fastest time per stage over all runs, counts are the same for every run
+    result = dict(runs[-1])
+    result['seconds'] = {stage: min(r['seconds'][stage] for r in runs) for stage in runs[0]['seconds']}
+    graph_seconds = result['seconds']['parse'] + result['seconds']['delayed_edges']
+    result['nodes_per_sec'] = result['nodes'] / graph_seconds if graph_seconds else 0.
+    result['edges_per_sec'] = result['edges'] / graph_seconds if graph_seconds else 0.
+    result['peak_rss_kb'] = max(r['peak_rss_kb'] for r in runs)
+    return result
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = TOLERANCE) -> List[str]:
+    # one line per stage, throughput or memory figure that got worse than the tolerance allows
+    regressions = []
+    for stage, seconds in result['seconds'].items():
+        before = baseline['seconds'].get(stage)
+        if before and seconds > before * (1 + tolerance):
+            regressions.append(f'{stage}: {before:.3f}s -> {seconds:.3f}s')
+    for key in ['nodes_per_sec', 'edges_per_sec']:
+        before = baseline.get(key)
+        if before and result[key] < before / (1 + tolerance):
+            regressions.append(f'{key}: {before:,.0f} -> {result[key]:,.0f}')
+    before = baseline.get('peak_rss_kb')
+    if before and result['peak_rss_kb'] > before * (1 + tolerance):
+        regressions.append(f'peak_rss_kb: {before} -> {result["peak_rss_kb"]}')
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--dir", metavar = "Directory", type = str, help = "Codebase to benchmark, a synthetic one is generated if not given")
+    arg_parser.add_argument("--dim", metavar = "Dimension", type = int, default = 64, help = "Dimension of the node features")
+    arg_parser.add_argument("--featurize", action = "store_true", help = "Also time the node features")
+    arg_parser.add_argument("--embedder", choices = list(EMBEDDERS), default = "fasttext", help = "Embedding used with --featurize, hashing needs no model")
+    arg_parser.add_argument("--condense", action = "store_true", help = "Condense the graph before the export")
+    arg_parser.add_argument("--reorder", choices = METHODS, help = "Reorder the nodes before the export, the spmm stage shows the effect")
+    arg_parser.add_argument("--repeat", metavar = "Repeat", type = int, default = 3, help = "Number of runs, the fastest time per stage is reported")
+    arg_parser.add_argument("--out", metavar = "Results", type = str, help = "Write the results to this JSON file")
+    arg_parser.add_argument("--baseline", metavar = "Baseline", type = str, help = "JSON results to compare against, exits with 1 on a regression")
+    arg_parser.add_argument("--tolerance", metavar = "Tolerance", type = float, default = TOLERANCE, help = "Allowed slowdown as a fraction of the baseline")
+    for key, value in DEFAULTS.items():
+        arg_parser.add_argument(f"--{key.replace('_', '-')}", metavar = key.capitalize(), type = int, default = value, help = HELP[key])
+    args = arg_parser.parse_args()
+
+    config = None
+    with tempfile.TemporaryDirectory() as synthetic:
+        dir = args.dir
+        if not dir:
+            config = generate(synthetic, **{key: getattr(args, key) for key in DEFAULTS})
+            dir = synthetic
+        runs = [run(dir, args.dim, args.featurize, args.condense, args.embedder, args.reorder) for _ in range(args.repeat)]
+
+    result = best_of(runs)
+    result['codebase'] = args.dir or 'synthetic'
+    result['config'] = config
+    result['python'] = platform.python_version()
+
+    print(f'{result["files"]} files, {result["nodes"]} nodes, {result["edges"]} edges')
+    if result['condensed_nodes'] is not None:
+        print(f'condensed to {result["condensed_nodes"]} nodes ({1 - result["condensed_nodes"] / result["nodes"]:.1%} fewer)')
+    for stage in STAGES:
+        if stage in result['seconds']:
+            print(f'{stage:>14}: {result["seconds"][stage]:.3f}s')
+    print(f'{result["nodes_per_sec"]:,.0f} nodes/sec, {result["edges_per_sec"]:,.0f} edges/sec, peak RSS {result["peak_rss_kb"] / 1024:.1f}MB')
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent = 2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'regression {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import argparse
+import os
+import sys
+import time
+from typing import *
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from codebase_parser import ASTCodebaseParser
+
+
+def pass_one(dir: str, use_queries: bool) -> Tuple[int, float]:
+    ast = ASTCodebaseParser(dir, 4)
+    ast.USE_QUERIES = use_queries
+    # parse the syntax trees up front so only the visitor is timed
+    # each tree keeps the source buffer it was parsed from
+    trees = []
+    for file in ast._relative_files:
+        tree = ast._get_syntax_tree(file)
+        trees.append((file, tree, ast._source))
+
+    start = time.perf_counter()
+    for file, tree, source in trees:
+        ast._filepath = file
+        ast._root = tree.root_node
+        ast._source = source
+        ast.parse()
+    return ast.AST.num_vertices, time.perf_counter() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--dir", metavar = "Directory", type = str, required = True, help = "Path to directory to parse")
+    arg_parser.add_argument("--repeat", metavar = "Repeat", type = int, default = 5, help = "Number of runs, the fastest is reported")
+    args = arg_parser.parse_args()
+
+    results = {}
+    for name, use_queries in [('visitor', False), ('query', True)]:
+        runs = [pass_one(args.dir, use_queries) for _ in range(args.repeat)]
+        nodes, seconds = min(runs, key = lambda x: x[1])
+        results[name] = nodes / seconds
+        print(f'{name:>8}: {nodes} nodes in {seconds:.3f}s ({results[name]:,.0f} nodes/sec)')
+
+    print(f'speedup: {results["query"] / results["visitor"]:.2f}x')
+
+
+if __name__ == "__main__":
+    main()
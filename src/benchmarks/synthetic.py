@@ -0,0 +1,136 @@
+import argparse
+import os
+import random
+from typing import *
+
+# default shape of a generated codebase
+DEFAULTS = {
+    'files': 50,
+    'functions': 10,
+    'classes': 2,
+    'fan_out': 3,
+    'depth': 2,
+    'hierarchy': 3,
+    'nesting': 3,
+    'seed': 0,
+}
+
+HELP = {
+    'files': 'Number of modules',
+    'functions': 'Functions per module',
+    'classes': 'Classes per module',
+    'fan_out': 'Modules imported by every module',
+    'depth': 'Package depth, imports from ancestor packages are relative',
+    'hierarchy': 'Classes of a module that extend each other',
+    'nesting': 'Nested loops and branches in every function',
+    'seed': 'Random seed',
+}
+
+
+def _package(level: int) -> List[str]:
+    # packages form a chain pkg/sub1/sub2/... so every level can reach the ones above it
+    return ['pkg'] + [f'sub{i}' for i in range(1, level + 1)]
+
+
+def _import_line(module: int, level: int, target: int, target_level: int, names: List[str]) -> str:
+    names = ', '.join(names)
+    if target_level <= level:
+        # ancestors are imported relatively, one dot per level up
+        return f'from {"." * (level - target_level + 1)}mod{target} import {names}'
+    return f'from {".".join(_package(target_level))}.mod{target} import {names}'
+
+
+def _body(rng: random.Random, depth: int, nesting: int, calls: List[str], indent: str) -> List[str]:
+    lines = [
+        f'{indent}x{depth} = {calls[rng.randrange(len(calls))]}(n + {depth})' if calls else f'{indent}x{depth} = n + {depth}',
+        f'{indent}total = total + x{depth} * {rng.randint(1, 9)}',
+    ]
+    if depth < nesting:
+        if depth % 2 == 0:
+            lines.append(f'{indent}for i{depth} in range(n):')
+        else:
+            lines.append(f'{indent}if total > {rng.randint(0, 100)}:')
+        lines.extend(_body(rng, depth + 1, nesting, calls, indent + '    '))
+    return lines
+
+
+def _module(rng: random.Random, config: Dict[str, int], module: int, level: int,
+            levels: List[int], bases: Dict[int, str]) -> str:
+    lines = ['import os', 'import math', '']
+    imported : List[str] = []
+    base = 'object'
+    # only earlier modules are imported so the class hierarchy has no cycles
+    targets = rng.sample(range(module), min(config['fan_out'], module))
+    for target in targets:
+        names = [f'func{rng.randrange(config["functions"])}'] if config['functions'] else []
+        if target in bases:
+            names.append(bases[target])
+        if not names:
+            continue
+        lines.append(_import_line(module, level, target, levels[target], names))
+        imported.extend(n for n in names if n.startswith('func'))
+        if target in bases and base == 'object':
+            base = bases[target]
+    lines.append('')
+
+    calls = imported + ['math.sqrt', 'len']
+    for i in range(config['functions']):
+        lines.append(f'def func{i}(n):')
+        lines.append('    total = 0')
+        lines.extend(_body(rng, 0, config['nesting'], calls, '    '))
+        lines.append('    return total')
+        lines.append('')
+        calls.append(f'func{i}')
+
+    for i in range(config['classes']):
+        name = f'Class{module}_{i}'
+        lines.append(f'class {name}({base}):')
+        lines.append(f'    scale = {i + 1}')
+        lines.append('')
+        lines.append('    def __init__(self, n):')
+        lines.append('        self.n = n')
+        lines.append(f'        self.value{i} = {calls[rng.randrange(len(calls))]}(n)')
+        lines.append('')
+        lines.append(f'    def method{i}(self):')
+        lines.append(f'        return self.value{i} * self.scale + len(os.sep)')
+        lines.append('')
+        # each class extends the previous one until the hierarchy is deep enough
+        if i + 1 < config['hierarchy']:
+            base = name
+    if config['classes']:
+        bases[module] = f'Class{module}_{config["classes"] - 1}'
+    return '\n'.join(lines) + '\n'
+
+
+def generate(dir: str, **config: int) -> Dict[str, int]:
+    # write a synthetic codebase to dir and return the configuration used
+    config = {**DEFAULTS, **config}
+    rng = random.Random(config['seed'])
+    levels = [i % (config['depth'] + 1) for i in range(config['files'])]
+    bases : Dict[int, str] = {}
+
+    for level in range(config['depth'] + 1):
+        package = os.path.join(dir, *_package(level))
+        os.makedirs(package, exist_ok = True)
+        open(os.path.join(package, '__init__.py'), 'w').close()
+
+    for module, level in enumerate(levels):
+        path = os.path.join(dir, *_package(level), f'mod{module}.py')
+        with open(path, 'w') as f:
+            f.write(_module(rng, config, module, level, levels, bases))
+    return config
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--dir", metavar = "Directory", type = str, required = True, help = "Directory to write the codebase to")
+    for key, value in DEFAULTS.items():
+        arg_parser.add_argument(f"--{key.replace('_', '-')}", metavar = key.capitalize(), type = int, default = value, help = HELP[key])
+    args = arg_parser.parse_args()
+
+    config = generate(args.dir, **{key: getattr(args, key) for key in DEFAULTS})
+    print(f'Generated {config["files"]} files in {args.dir}')
+
+
+if __name__ == "__main__":
+    main()
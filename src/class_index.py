@@ -0,0 +1,83 @@
+from typing import *
+
+
+class ClassInfo:
+    def __init__(self, name: str, id: str, file: str) -> None:
+        self.name = name
+        # node id of the class definition
+        self.id = id
+        self.file = file
+        # base class names as written in the class definition
+        self.bases : List[str] = []
+        # member name -> node id of the method, class assignment or self attribute
+        self.members : Dict[str, str] = {}
+
+
+class ClassIndex:
+    def __init__(self, resolve: Optional[Callable[[str, str], Optional[Tuple[str, str]]]] = None) -> None:
+        # resolve(file, base name) -> (file, class name) of the base class definition
+        self._resolve = resolve
+        # key: file name
+        # value: dict of (class name, class info)
+        self._classes : Dict[str, Dict[str, ClassInfo]] = {}
+        # (file, class name) -> members including inherited ones
+        self._flat : Dict[Tuple[str, str], Dict[str, str]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, file: str) -> bool:
+        return file in self._classes
+
+    def add_class(self, file: str, name: str, id: str, bases: Sequence[str] = ()) -> ClassInfo:
+        info = ClassInfo(name, id, file)
+        info.bases.extend(bases)
+        if file not in self._classes:
+            self._classes[file] = {}
+        self._classes[file][name] = info
+        self._flat = {}
+        return info
+
+    def add_member(self, file: str, class_name: str, name: str, id: str, overwrite: bool = True) -> None:
+        info = self.get(file, class_name)
+        if not info:
+            return
+        if overwrite or name not in info.members:
+            info.members[name] = id
+        self._flat = {}
+
+    def get(self, file: str, class_name: str) -> Optional[ClassInfo]:
+        if file not in self._classes:
+            return None
+        return self._classes[file].get(class_name)
+
+    def classes(self, file: str) -> Dict[str, ClassInfo]:
+        return self._classes.get(file, {})
+
+    def members(self, file: str, class_name: str) -> Dict[str, str]:
+        # members of the class and its bases, resolved once and cached
+        key = (file, class_name)
+        if key not in self._flat:
+            self.misses += 1
+            self._flat[key] = self._flatten(file, class_name, set())
+        else:
+            self.hits += 1
+        return self._flat[key]
+
+    def lookup(self, file: str, class_name: str, attribute: str) -> Optional[str]:
+        return self.members(file, class_name).get(attribute)
+
+    def _flatten(self, file: str, class_name: str, seen: Set[Tuple[str, str]]) -> Dict[str, str]:
+        info = self.get(file, class_name)
+        if not info or (file, class_name) in seen:
+            return {}
+        seen.add((file, class_name))
+        members : Dict[str, str] = {}
+        # walk the bases right to left so earlier bases and the class itself win
+        for base in reversed(info.bases):
+            target = self._resolve(file, base) if self._resolve else None
+            if target is None and self.get(file, base):
+                target = (file, base)
+            if target:
+                members.update(self._flatten(target[0], target[1], seen))
+        members.update(info.members)
+        return members
@@ -1,13 +1,27 @@
 import argparse
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
 import os
+import time
 from typing import *
 import re
 
+import numpy as np
+
 from tree_sitter import Language, Node, Parser, Tree, TreeCursor
 
 from file_parser import ASTFileParser
+from discovery import MAX_FILE_SIZE, discover_files
+from embedders import EMBEDDERS
+from import_graph import build_import_graph, dependency_order
+from edges import ASSIGNMENT, ATTRIBUTE, CALL, IMPORT, RELATIONS
+from feature_store import PRECISIONS
 from graph import Graph as G
 from graph import Node as N
+from instrumentation import STAGES, Stats
+from reorder import METHODS
+from source import MAX_LINE_LENGTH, SourceBuffer, SourceSkipped, load_source
 
 Language.build_library(
     'build/my-languages.so',
@@ -18,15 +32,48 @@ PYTHON = Language('build/my-languages.so', 'python')
 
 class ASTCodebaseParser(ASTFileParser):
 
-    BUILTINS = dir(__builtins__)
-
-    def __init__(self, dir: str, dim: int) -> None:
+    # parse files after the files they import, so references into them resolve right away
+    _dependency_order = True
+
+    # files read by background threads while imports are scanned for the dependency
+    # order, or while the current file is parsed in discovery order
+    PREFETCH = 4
+
+    # files with a longer line in their first 64KB are skipped as minified, None parses them
+    MAX_LINE_LENGTH : Optional[int] = MAX_LINE_LENGTH
+
+    def __init__(self,
+                 dir: str,
+                 dim: int,
+                 exclude: Optional[List[str]] = None,
+                 max_file_size: Optional[int] = MAX_FILE_SIZE,
+                 use_gitignore: bool = True,
+                 stats: Optional[Stats] = None,
+                 embedder: str = 'fasttext',
+                 dependency_order: bool = True,
+                 parser: Optional[Parser] = None,
+                ) -> None:
+        # parser: a tree-sitter parser to reuse, e.g. across a batch of snippets
         self._dir : str = dir
         self._dim : int = dim
-        self._relative_files = self.get_files()
-
-        self._parser = Parser()
-        self._parser.set_language(PYTHON)
+        self._embedder = embedder
+        self._dependency_order = dependency_order
+        self._exclude = exclude
+        self._max_file_size = max_file_size
+        self._use_gitignore = use_gitignore
+        # (path, reason) for every file or directory left out of the parse
+        self._skipped_files : List[Tuple[str, str]] = []
+        self._stats = stats
+        with self._stage('discovery'):
+            self._relative_files = self.get_files()
+            self._index_modules()
+        # sources read while ordering the files, handed to the parse instead of read again
+        self._loaded_sources : Dict[str, SourceBuffer] = {}
+
+        if parser is None:
+            parser = Parser()
+            parser.set_language(PYTHON)
+        self._parser = parser
 
         self._AST = G()
 
@@ -46,123 +93,258 @@ class ASTCodebaseParser(ASTFileParser):
         return str(self._AST)
     
     def get_files(self) -> List[str]:
-        files = []
-        for (dirpath, dirnames, filenames) in os.walk(self._dir):
-            files.extend(
-                [
-                    os.path.relpath(os.path.join(os.path.join(os.getcwd(), dirpath) , x))
-                    for x in filenames if x.endswith(".py")
-                ]
-            )
+        # the files to parse, subclasses that do not walk a directory override this
+        files, self._skipped_files = discover_files(
+            self._dir,
+            exclude = self._exclude,
+            max_file_size = self._max_file_size,
+            use_gitignore = self._use_gitignore,
+        )
         return files
+
+    def _index_modules(self) -> None:
+        # lookups for _resolve_module: the set of files, and for every module path a file
+        # can be imported as (the file path without .py or /__init__.py, and each of its
+        # trailing parts) the first such file in discovery order
+        self._file_set = set(self._relative_files)
+        self._module_files : Dict[str, str] = {}
+        for f in self._relative_files:
+            if f.endswith('/__init__.py'):
+                path = f[:-len('/__init__.py')]
+            elif f.endswith('.py'):
+                path = f[:-len('.py')]
+            else:
+                continue
+            parts = path.split('/')
+            for i in range(len(parts)):
+                self._module_files.setdefault('/'.join(parts[i:]), f)
+
+    @property
+    def skipped_files(self) -> List[Tuple[str, str]]:
+        return self._skipped_files
+
+    def skipped_summary(self) -> Dict[str, int]:
+        # number of skipped paths per reason, without the pattern or size details
+        summary : Dict[str, int] = {}
+        for _, reason in self._skipped_files:
+            reason = reason.split(' (')[0]
+            summary[reason] = summary.get(reason, 0) + 1
+        return summary
     
     def parse_dir(self) -> None:
-        roots = []
-        # i = 0
-        for file in self._relative_files:
-            # print(f'done {i}')
-            self._filepath = file
-            tree = self._get_syntax_tree(file)
-            self._root = tree.root_node
-            root_id = self.parse()
-            roots.append(root_id)
-            # i += 1
-        # clear assignments, definition and classes
-        self._function_definitions = {}
-        self._assignments = {}
-        self._classes = {}
-        # second loop
-        # i = 0
-        for root in roots:
-            # print(f'Second {i}')
-            filepath = root.split(' | ')[1]
-            self._second_loop(root, self._AST, filepath)
-            # i+=1
-        self._add_edges(self._AST)
+        # definitions, assignments and references are resolved while the nodes are built
+        # anything pointing into a file that has not been read yet is queued, and resolved
+        # once that file and the import cycle it belongs to are read
+        with self._stage('order'):
+            components = self._order_files()
+        with self._stage('parse'):
+            self._parse_files(components)
+        with self._stage('delayed_edges'):
+            self._resolve_delayed_edges()
+        with self._stage('symbol_index'):
+            self._build_symbol_index()
+        if self._stats:
+            self._record_counts()
+
+    def _order_files(self, files: Optional[Sequence[str]] = None) -> List[List[str]]:
+        # groups of files to parse, every group after the groups it imports from
+        # an import cycle is one group, without ordering every file is its own group
+        files = self._relative_files if files is None else files
+        if not self._dependency_order or len(files) < 2:
+            return [[f] for f in files]
+
+        # the files are read on the PREFETCH threads in scan order, so reading overlaps the
+        # import scan, and the sources are kept for the parse
+        ahead = self._prefetch(files)
+
+        def read(file: str) -> bytes:
+            _, future = next(ahead)
+            try:
+                source = future.result() if future else self._load_source(file)
+            except SourceSkipped:
+                # left for the parse to report
+                return b''
+            self._loaded_sources[file] = source
+            return source.data
+
+        try:
+            graph = build_import_graph(files, read, self._resolve_module)
+        finally:
+            ahead.close()
+        return dependency_order(files, graph)
+
+    def _prefetch(self, files: Sequence[str], loaded: Optional[Dict[str, SourceBuffer]] = None) -> Iterator[Tuple[str, Optional[Future]]]:
+        # yields every file with the future of its source in order, keeping PREFETCH reads in
+        # flight on threads. sources in loaded are handed over instead of read again
+        loaded = loaded or {}
+
+        def done(source: SourceBuffer) -> Future:
+            future : Future = Future()
+            future.set_result(source)
+            return future
+
+        if self.PREFETCH < 1 or len(files) < 2 or all(f in loaded for f in files):
+            yield from ((f, done(loaded[f]) if f in loaded else None) for f in files)
+            return
+        with ThreadPoolExecutor(self.PREFETCH) as pool:
+            def submit(file: str) -> Future:
+                return done(loaded.pop(file)) if file in loaded else pool.submit(self._load_source, file)
+
+            pending = iter(files)
+            window = deque((f, submit(f)) for f in islice(pending, self.PREFETCH))
+            while window:
+                file, future = window.popleft()
+                following = next(pending, None)
+                if following is not None:
+                    window.append((following, submit(following)))
+                yield file, future
+
+    def _load_source(self, filepath: str) -> SourceBuffer:
+        # the minified check runs on the bytes read for the parse, so no file is read twice
+        return load_source(filepath, max_line_length = self.MAX_LINE_LENGTH)
+
+    def _read_ahead(self, files: Sequence[str]) -> Iterator[Tuple[str, Optional[Future]]]:
+        # sources for the parse: with dependency order they were all read by _order_files,
+        # otherwise they are read ahead while the files before them parse
+        loaded, self._loaded_sources = self._loaded_sources, {}
+        return self._prefetch(files, loaded)
+
+    def _parse_files(self, components: Optional[List[List[str]]] = None) -> None:
+        if components is None:
+            components = [[f] for f in self._relative_files]
+        sources = self._read_ahead([f for component in components for f in component])
+        for component in components:
+            for file, future in islice(sources, len(component)):
+                start = time.perf_counter()
+                self._filepath = file
+                try:
+                    tree = self._get_syntax_tree(file, future.result() if future else None)
+                except SourceSkipped as e:
+                    self._relative_files.remove(file)
+                    self._index_modules()
+                    self._skipped_files.append((file, f'{e.reason} ({e})'))
+                    continue
+                self._root = tree.root_node
+                self.parse()
+                if self._stats:
+                    self._stats.file(file, time.perf_counter() - start)
+                    self._stats.cache('source_text', self._source.hits, self._source.misses)
+            self._read_files.update(component)
+            if self._dependency_order:
+                self._resolve_ready(self._read_files)
+
+    def _ready_queues(self) -> List[Tuple[List[tuple], Callable]]:
+        # queues of delayed edges with the method that resolves them
+        return [
+            (self._delayed_assignment_edges_to_add, self._add_delayed_assignment_edges),
+            (self._delayed_call_edges_to_add, self._add_delayed_call_edges),
+            (self._delayed_class_attributes_to_add, self._add_delayed_attribute_edges),
+        ]
+
+    def _resolve_ready(self, done: Set[str]) -> None:
+        # resolve queued edges into files that are completely read
+        # their definitions, assignments and classes will not change anymore
+        for queue, resolve in self._ready_queues():
+            if not queue:
+                continue
+            ready = [entry for entry in queue if entry[1] in done]
+            if ready:
+                resolve(self._AST, ready)
+                queue[:] = [entry for entry in queue if entry[1] not in done]
+                self._resolved_early += len(ready)
+
+    def _record_counts(self) -> None:
+        self._stats.counts('nodes', Counter(n.type for n in self._AST))
+        rel = self._AST.edges.arrays()[2]
+        self._stats.counts('edges', {name: int(c) for name, c in zip(RELATIONS, np.bincount(rel, minlength = len(RELATIONS)))})
+        self._stats.cache('class_members', self._class_index.hits, self._class_index.misses)
+
+    def _queue_attribute_edge(self, node_id: str, file: str, class_name: str, attribute_name: str) -> None:
+        # the classes of a file that is completely read can be looked up right away
+        if file in self._read_files:
+            self._add_delayed_attribute_edges(self._AST, [(node_id, file, class_name, attribute_name)])
+        else:
+            self._delayed_class_attributes_to_add.append((node_id, file, class_name, attribute_name))
+
+    def _resolve_delayed_edges(self) -> None:
+        if self._stats:
+            late = len(self._delayed_assignment_edges_to_add) + len(self._delayed_call_edges_to_add) + len(self._delayed_class_attributes_to_add)
+            self._stats.counts('delayed_edges', {'resolved_early': self._resolved_early, 'resolved_at_end': late})
         self._add_delayed_assignment_edges(self._AST)
         self._add_delayed_call_edges(self._AST)
         self._add_delayed_attribute_edges(self._AST)
+        self._add_edges(self._AST)
 
-    def _add_edges(self, parent: G) -> None:
-        # connect import edges to their calls
-        for edge_from, edge_to in self._edges_to_add:
-            parent.add_edge(edge_from, edge_to)
-
-    def _add_delayed_assignment_edges(self, parent: G) -> None:
+    def _add_delayed_assignment_edges(self, parent: G, edges: Optional[List[tuple]] = None) -> None:
         # connect import edges to their calls
-        for edge_from, edge_to_file, function_name in self._delayed_assignment_edges_to_add:
+        for edge_from, edge_to_file, function_name in self._delayed_assignment_edges_to_add if edges is None else edges:
             if edge_to_file not in self._assignments or function_name not in self._assignments[edge_to_file]:
                 continue
             edge_to = self._assignments[edge_to_file][function_name][1]
-            parent.add_edge(edge_from, edge_to)
-            parent.add_edge(edge_to, edge_from)
+            self._add_edge_later(edge_from, edge_to, ASSIGNMENT, bi = True)
     
-    def _add_delayed_call_edges(self, parent: G) -> None:
+    def _add_delayed_call_edges(self, parent: G, edges: Optional[List[tuple]] = None) -> None:
         # connect calls to their definition
-        for edge_from, edge_to_file, function_name in self._delayed_call_edges_to_add:
+        for edge_from, edge_to_file, function_name in self._delayed_call_edges_to_add if edges is None else edges:
             if edge_to_file not in self._function_definitions or function_name not in self._function_definitions[edge_to_file]:
                 continue
             edge_to = self._function_definitions[edge_to_file][function_name]
-            parent.add_edge(edge_from, edge_to)
-            parent.add_edge(edge_to, edge_from)
-    
-    def _add_delayed_attribute_edges(self, parent: G) -> None:
-        # connect calls to their definition
-        for edge_from, edge_to_file, class_name, attribute_name in self._delayed_class_attributes_to_add:
-            if edge_to_file in self._classes:
-                if class_name in self._classes[edge_to_file]:
-                    if attribute_name in self._classes[edge_to_file][class_name]:
-                        edge_to = self._classes[edge_to_file][class_name][attribute_name]
-                        parent.add_edge(edge_from, edge_to)
-                        parent.add_edge(edge_to, edge_from)
-                    # add edge to class definition
-                    else:
-                        class_definition = self._function_definitions[edge_to_file][class_name]
-                        parent.add_edge(edge_from, class_definition)
-                        parent.add_edge(class_definition, edge_from)
-
-    def _second_loop(self, node_id: str, parent: G, file: str) -> None:
-        current_vertex = parent.get_vertex(node_id)
-        parent_vertex = parent.get_parent(node_id)
-
-        ### REDO VARIABLE TRACKING ###
-        # handle function definitions
-        if current_vertex.type == 'function_definition' or current_vertex.type == 'class_definition':
-            # get function name
-            function_name = list(current_vertex.get_connections())[0].text
-            # add function definition to dict
-            if file not in self._function_definitions:
-                self._function_definitions[file] = {function_name: node_id}
-            else:
-                self._function_definitions[file][function_name] = node_id
-        ### END REDO VARIABLE TRACKING ###
+            self._add_edge_later(edge_from, edge_to, CALL, bi = True)
+
+    def _add_delayed_attribute_edges(self, parent: G, edges: Optional[List[tuple]] = None) -> None:
+        # connect attribute calls to the class member, or the class definition if there is no such member
+        for edge_from, edge_to_file, class_name, attribute_name in self._delayed_class_attributes_to_add if edges is None else edges:
+            class_info = self._class_index.get(edge_to_file, class_name)
+            if not class_info:
+                continue
+            member = self._class_index.lookup(edge_to_file, class_name, attribute_name)
+            self._add_edge_later(edge_from, member if member else class_info.id, ATTRIBUTE, bi = True)
+
+    def _handle_assignment(self, variable_name: str, type_: str, owner: Optional[str], parent: G, id: str) -> None:
+        # assignments are tracked with their scope in _enter_node, only index class members here
+        if owner:
+            self._class_index.add_member(self._filepath, owner, variable_name, id)
+
+    def _is_scope(self, node: Node) -> bool:
+        return node.type in ['function_definition', 'class_definition'] or 'comprehension' in node.type or 'lambda' == node.type
+
+    def _first_identifier(self, node: Node) -> Optional[Node]:
+        for child in node.named_children:
+            if child.type == 'identifier':
+                return child
+            identifier = self._first_identifier(child)
+            if identifier:
+                return identifier
+        return None
+
+    def _leave_node(self, node: Node, current_vertex: N, parent: G) -> None:
+        # reset the scoping dicts
+        if self._is_scope(node):
+            self._restore_scope(self._filepath, self._scopes.pop())
+
+    def _enter_node(self, node: Node, current_vertex: N, parent: G) -> None:
+        file = self._filepath
+        node_id = current_vertex.id
+        parent_vertex = current_vertex.parent
 
         ### add assignments ###
-        if current_vertex.type == 'assignment':
-            identifier_node = [n for n in current_vertex.get_descendants() if n.type == 'identifier'][0]
-            variable_node = list(current_vertex.get_connections())[1]
-            type_ = variable_node.type
-            if variable_node.type == 'call':
-                variable_node = list(variable_node.get_connections())[0]
-                type_ = variable_node.text
+        # an assignment is tracked on its first identifier, which is built after the assignment node
+        if node.id in self._pending_assignments:
+            type_ = self._pending_assignments.pop(node.id)
             if file not in self._assignments:
                 self._assignments[file] = {}
-            self._assignments[file][identifier_node.var_name] = (type_, identifier_node.id)
+            self._assignments[file][current_vertex.var_name] = (type_, node_id)
+        if node.type == 'assignment' and len(node.named_children) > 1:
+            identifier_node = self._first_identifier(node)
+            variable_node = node.named_children[1]
+            type_ = variable_node.type
+            if variable_node.type == 'call':
+                span = self._text_span(variable_node.named_children[0])
+                type_ = self._source.text(*span) if span else ""
+            if identifier_node:
+                self._pending_assignments[identifier_node.id] = type_
         ### end add assignments ###
 
-        ### add class methods ###
-        if current_vertex.type == 'class_definition':
-            # add a dictionary entry for the class name
-            class_name = list(current_vertex.get_connections())[0].text
-            if file not in self._classes:
-                self._classes[file] = {class_name: {}}
-            else:
-                self._classes[file][class_name] = {}
-
-            # traverse the rest of the class definition and add all attributes
-            self._class_attribute(file, class_name, parent, node_id)
-        ### end add class methods ###
-
         ### handle other imports (constants) from other files ###
         if file in self._imports:
             if current_vertex.type == 'identifier' and not (parent_vertex.type == 'aliased_import' or parent_vertex.type == 'dotted_name'):
@@ -171,7 +353,7 @@ class ASTCodebaseParser(ASTFileParser):
                 paths = [p for _, (_, p) in self._imports[file].items()]
                 
                 # if this is an attribute call, get the parent text instead
-                txt = parent.get_parent(node_id).text if parent.get_parent(node_id).type == 'attribute' else current_vertex.text
+                txt = parent_vertex.text if parent_vertex.type == 'attribute' else current_vertex.text
 
                 if any([re.match(r'(^' + s + r'\.|^' + s + r'$)', txt) for s in possible_imports]):
                     func, import_id, path = [
@@ -180,7 +362,7 @@ class ASTCodebaseParser(ASTFileParser):
                     ][0]
 
                     # if there is an identifier that matches an import, add an edge to the import
-                    self._edges_to_add.append((node_id, import_id))
+                    self._add_edge_later(node_id, import_id, IMPORT)
 
                     func_new = (txt if path not in txt else txt[txt.find(path)+1+len(path):]) \
                         if not import_id.startswith('aliased_import') \
@@ -212,20 +394,19 @@ class ASTCodebaseParser(ASTFileParser):
                     # imported_from = [f for f in self._relative_files if path_new.replace('.', '/') in f]
                     if imported_from:
                         imported_from = imported_from[0]
+                        self._import_targets.setdefault(import_id, set()).add(imported_from)
                         if imported_from in self._assignments:
                             if func_new in self._assignments[imported_from]:
                                 # add edge
-                                self._edges_to_add.append((node_id, self._assignments[imported_from][func_new][1]))
-                                self._edges_to_add.append((self._assignments[imported_from][func_new][1], node_id))
-                        else:
+                                self._add_edge_later(node_id, self._assignments[imported_from][func_new][1], ASSIGNMENT, bi = True)
+                        elif imported_from not in self._read_files:
                             self._delayed_assignment_edges_to_add.append((node_id, imported_from, func_new))
                         
                         if imported_from in self._function_definitions:
                             if func_new in self._function_definitions[imported_from]:
                                 # add edge
-                                self._edges_to_add.append((node_id, self._function_definitions[imported_from][func_new]))
-                                self._edges_to_add.append((self._function_definitions[imported_from][func_new], node_id))
-                        else:
+                                self._add_edge_later(node_id, self._function_definitions[imported_from][func_new], CALL, bi = True)
+                        elif imported_from not in self._read_files:
                             self._delayed_call_edges_to_add.append((node_id, imported_from, func_new))
         ### end handle other imports (constants) from other files ###
 
@@ -234,8 +415,7 @@ class ASTCodebaseParser(ASTFileParser):
             func = current_vertex.text
             if func in self._function_definitions[file]:
                 # add edge
-                self._edges_to_add.append((node_id, self._function_definitions[file][func]))
-                self._edges_to_add.append((self._function_definitions[file][func], node_id))
+                self._add_edge_later(node_id, self._function_definitions[file][func], CALL, bi = True)
         ### end check if function is defined in the current file ###
         
         ### check if the function is part of an import in the current file ###
@@ -278,18 +458,18 @@ class ASTCodebaseParser(ASTFileParser):
                 
                 if imported_from:
                     imported_from = imported_from[0]
+                    self._import_targets.setdefault(import_id, set()).add(imported_from)
                     if imported_from in self._function_definitions:
                         if func_new in self._function_definitions[imported_from]:
                             # add edge
-                            self._edges_to_add.append((node_id, self._function_definitions[imported_from][func_new]))
-                            self._edges_to_add.append((self._function_definitions[imported_from][func_new], node_id))
-                    else:
+                            self._add_edge_later(node_id, self._function_definitions[imported_from][func_new], CALL, bi = True)
+                    elif imported_from not in self._read_files:
                         self._delayed_call_edges_to_add.append((node_id, imported_from, func_new))
         ### end check if the function is part of an import in the current file ###
         
         ### check if the call is an class attribute and find its definition ### TODO
         # handle already created objects
-        grandparent = parent.get_parent(parent_vertex.id) if parent_vertex else None
+        grandparent = parent_vertex.parent if parent_vertex else None
         if parent_vertex and parent_vertex.type == 'attribute' and grandparent and grandparent.type == 'call':
             txt = current_vertex.text
             
@@ -304,24 +484,10 @@ class ASTCodebaseParser(ASTFileParser):
                 if file in self._assignments:
                     if attribute_prefix in self._assignments[file]:
                         object_type = self._assignments[file][attribute_prefix][0]
-                        object_node_id = self._assignments[file][attribute_prefix][1]
-
-                        # connect locally if available
-                        if file in self._classes:
-                            if object_type in self._classes[file]:
-                                # connect call to local attribute definition (if it exists)
-                                if attribute_call in self._classes[file][object_type]:
-                                    self._edges_to_add.append((node_id, self._classes[file][object_type][attribute_call]))
-                                    self._edges_to_add.append((self._classes[file][object_type][attribute_call], node_id))
-                                # connect call to local class definition (if it exists)
-                                elif file in self._function_definitions:
-                                    if object_type in self._function_definitions[file]:
-                                        self._edges_to_add.append((node_id, self._function_definitions[file][object_type]))
-                                        self._edges_to_add.append((self._function_definitions[file][object_type], node_id))
-                                # connect call to local assignment (if it exists)
-                                else:
-                                    self._edges_to_add.append((node_id, object_node_id))
-                                    self._edges_to_add.append((object_node_id, node_id))
+
+                        # connect call to local attribute or class definition (if it exists)
+                        # classes can still be defined further down, so resolve once every file is read
+                        self._queue_attribute_edge(node_id, file, object_type, attribute_call)
 
                         # connect to other files if necessary
                         if file in self._imports:
@@ -337,18 +503,8 @@ class ASTCodebaseParser(ASTFileParser):
                                 imported_from = [f for f in self._relative_files if imported_from in f]
                                 if imported_from:
                                     imported_from = imported_from[0]
-                                    # connect call to imported attribute definition (if it exists)
-                                    if imported_from in self._classes:
-                                        if type_ in self._classes[imported_from]:
-                                            if attribute_call in self._classes[imported_from][type_]:
-                                                self._edges_to_add.append((node_id, self._classes[imported_from][type_][attribute_call]))
-                                                self._edges_to_add.append((self._classes[imported_from][type_][attribute_call], node_id))
-                                            # connect to the class definition
-                                            else:
-                                                self._edges_to_add.append((node_id, self._function_definitions[imported_from][type_]))
-                                                self._edges_to_add.append((self._function_definitions[imported_from][type_], node_id))
-                                    else:
-                                        self._delayed_class_attributes_to_add.append((node_id, imported_from, type_, attribute_call))
+                                    # connect call to imported attribute or class definition (if it exists)
+                                    self._queue_attribute_edge(node_id, imported_from, type_, attribute_call)
 
 
                 # check if the prefix follows an import (for inline calls)
@@ -376,20 +532,8 @@ class ASTCodebaseParser(ASTFileParser):
                                 imported_from = [f for f in self._relative_files if path_new.replace('.', '/') in f]
                                 if imported_from:
                                     imported_from = imported_from[0]
-                                    # connect call to imported attribute definition (if it exists)
-                                    if imported_from in self._classes:
-                                        if txt in self._classes[imported_from]:
-                                            # connect to the class definition
-                                            if attribute_call in self._classes[imported_from][txt]:
-                                                self._edges_to_add.append((node_id, self._classes[imported_from][txt][attribute_call]))
-                                                self._edges_to_add.append((self._classes[imported_from][txt][attribute_call], node_id))
-                                            # connect to the identifier definition
-                                            else:
-                                                self._edges_to_add.append((node_id, self._function_definitions[imported_from][txt]))
-                                                self._edges_to_add.append((self._function_definitions[imported_from][txt], node_id))
-                                    # add to edges to add later
-                                    else:
-                                        self._delayed_class_attributes_to_add.append((node_id, imported_from, txt, attribute_call))
+                                    # connect call to imported attribute or class definition (if it exists)
+                                    self._queue_attribute_edge(node_id, imported_from, txt, attribute_call)
                             
                             break
                         txt = txt[:txt.rfind('.')]
@@ -402,59 +546,159 @@ class ASTCodebaseParser(ASTFileParser):
             if file in self._assignments:
                 if txt in self._assignments[file]:
                     # add edge
-                    self._edges_to_add.append((node_id, self._assignments[file][txt][1]))
-                    # self._edges_to_add.append((self._assignments[file][txt][1], node_id))
+                    self._add_edge_later(node_id, self._assignments[file][txt][1], ASSIGNMENT)
+                    # self._add_edge_later(self._assignments[file][txt][1], node_id, ASSIGNMENT)
         
-        # copy all dictionaries for scoping
-        if current_vertex.type in ['function_definition', 'class_definition'] or 'comprehension' in current_vertex.type or 'lambda' == current_vertex.type:
-            _, fd, a, c = self._copy_for_scope()
         ### end connect identifiers to their assignments ###
 
-        # recurse over neighbors/children
-        for neighbor in current_vertex.get_connections():
-            self._second_loop(neighbor.id, parent, file)
+        # copy the dictionaries of this file for scoping, restored in _leave_node
+        if self._is_scope(node):
+            self._scopes.append(self._copy_for_scope(file))
+
+    def _resolve_class(self, file: str, class_name: str) -> Optional[Tuple[str, str]]:
+        # find the file and name of a class used in file, e.g. a base class
+        if self._class_index.get(file, class_name):
+            return (file, class_name)
+        target = self._class_module(file, class_name)
+        if target and self._class_index.get(*target):
+            return target
+        return None
+
+    def _class_module(self, file: str, class_name: str) -> Optional[Tuple[str, str]]:
+        # the file an imported class name points to and the name of the class there,
+        # whether or not that file has been read
+        imports = self._imports.get(file, {})
+        module, _, name = class_name.rpartition('.')
+        if not module and class_name in imports:
+            # from module import Class (as Alias)
+            import_id, path = imports[class_name]
+            if import_id.startswith('aliased_import'):
+                module, _, name = path.rpartition('.')
+            else:
+                module = path
+        elif module in imports:
+            # import module (as alias), then module.Class
+            import_id, path = imports[module]
+            if not import_id.startswith('aliased_import'):
+                path = (path + module if path.endswith('.') else path + '.' + module) if path else module
+            module = path
+        else:
+            return None
+        target = self._resolve_module(file, module) if module else None
+        return (target, name) if target else None
+
+    def _resolve_module(self, file: str, module: str) -> Optional[str]:
+        # file for an absolute or relative module path
+        if module.startswith('.'):
+            level = len(module) - len(module.lstrip('.'))
+            base = os.path.dirname(file)
+            for _ in range(level - 1):
+                base = os.path.dirname(base)
+            rest = module[level:].replace('.', '/')
+            path = os.path.normpath(os.path.join(base, rest)) if rest else base
+            for candidate in [path + '.py', os.path.join(path, '__init__.py')]:
+                if candidate in self._file_set:
+                    return candidate
+            return None
+        return self._module_files.get(module.replace('.', '/'))
 
-        # reset the scoping dicts
-        if current_vertex.type in ['function_definition', 'class_definition'] or 'comprehension' in current_vertex.type or 'lambda' == current_vertex.type:
-            self._function_definitions = fd
-            self._assignments = a
-            self._classes = c
-
-    def _class_attribute(self, file: str, class_name: str, parent: G, class_root_node_id: str) -> None:
-        # record all class attributes
-        for child in parent.get_vertex(class_root_node_id).get_connections():
-            if child.type == 'function_definition':
-                # add a dictionary entry for the function name
-                function_name = list(parent.get_vertex(child.id).get_connections())[0].text
-                self._classes[file][class_name][function_name] = child.id
-
-            # traverse the rest of the function definition and add all attributes
-            self._class_attribute(file, class_name, parent, child.id)
-                    
 def main():
     arg_parser = argparse.ArgumentParser()
     arg_parser.add_argument("--dir", metavar = "Directory", type=str, required=True, help="Path to directory to parse")
     arg_parser.add_argument("--nf", metavar = "Node features", type = str, required = True, help = "File to save node features to")
     arg_parser.add_argument("--adj", metavar = "Adjacency matrix", type = str, required = True, help = "File to save adjacency matrix t0")
-    arg_parser.add_argument("--dim", metavar = "Dimension", type = int, required = True, help = "Dimension of the node features")
+    arg_parser.add_argument("--dim", metavar = "Dimension", type = int, help = "Dimension of the node features, required unless --precision tokens")
+    arg_parser.add_argument("--embedder", choices = list(EMBEDDERS), default = "fasttext", help = "Embedding of node types and text, hashing needs no model")
+    arg_parser.add_argument("--vocab", metavar = "Vocabulary", type = str, help = "JSON vocabularies for --precision tokens (required with it), extended and saved after every run")
+    arg_parser.add_argument("--frozen-vocab", action = "store_true", help = "With --precision tokens, map tokens missing from --vocab to <unk> instead of adding them")
+    arg_parser.add_argument("--precision", choices = PRECISIONS + ['tokens'], help = "Store node features in binary with this precision instead of csv, or as type and subtoken ids into the --vocab vocabularies with tokens")
+    arg_parser.add_argument("--condense", action = "store_true", help = "Fold wrapper nodes and merge attribute chains before saving")
+    arg_parser.add_argument("--drop-literals", action = "store_true", help = "With --condense, also remove literal subtrees")
+    arg_parser.add_argument("--reorder", choices = METHODS, help = "Renumber the nodes for locality before saving and store the permutation in <adj>_order.npy")
+    arg_parser.add_argument("--hierarchy", action = "store_true", help = "Also save definition and module level graphs with their pooling matrices next to --adj")
+    arg_parser.add_argument("--subtrees", action = "store_true", help = "Also save the tree with every repeated subtree stored once to <adj>_subtrees.npz and report the dedup ratio")
     arg_parser.add_argument("--save-gv", action = "store_true", help = "Flag to save Graphviz file format of graph")
+    arg_parser.add_argument("--gv-file", metavar = "Graphviz file", type = str, default = "tree.gv", help = "File to stream the DOT output to")
+    arg_parser.add_argument("--gv-clusters", action = "store_true", help = "Group the nodes of every file in a cluster")
+    arg_parser.add_argument("--gv-node-types", metavar = "Type", type = str, nargs = "+", help = "Only write nodes of these types")
+    arg_parser.add_argument("--gv-edge-types", choices = RELATIONS, nargs = "+", help = "Only write edges of these relations")
+    arg_parser.add_argument("--gv-files", metavar = "Glob", type = str, nargs = "+", help = "Only write nodes of files matching these globs")
+    arg_parser.add_argument("--gv-max-nodes", metavar = "Nodes", type = int, help = "Stop after this many nodes")
+    arg_parser.add_argument("--gv-sample", metavar = "Fraction", type = float, help = "Write a random sample of the nodes")
+    arg_parser.add_argument("--exclude", metavar = "Glob", type = str, action = "append", help = "Glob of files or directories to skip (replaces the default excludes, a leading / anchors it to the repository root, can be repeated)")
+    arg_parser.add_argument("--max-file-size", metavar = "Bytes", type = int, default = MAX_FILE_SIZE, help = "Skip files larger than this, 0 for no limit")
+    arg_parser.add_argument("--no-gitignore", action = "store_true", help = "Do not honour .gitignore files")
+    arg_parser.add_argument("--discovery-order", action = "store_true", help = "Parse files in discovery order instead of after the files they import")
+    arg_parser.add_argument("--show-skipped", action = "store_true", help = "Print every skipped path and the reason")
+    arg_parser.add_argument("--stats", metavar = "Stats", type = str, help = "Write stage timings, per file parse times, counts and peak memory to this JSON file")
+    arg_parser.add_argument("--profile", choices = STAGES, help = "Run cProfile on this stage (view the dump with snakeviz)")
+    arg_parser.add_argument("--profile-out", metavar = "Profile", type = str, help = "File for the cProfile dump, defaults to <stage>.prof")
     arg_parser.add_argument('--neighbors', metavar = "Neighbors", type = int, help = "Number of neighbors to show for a specific node")
     arg_parser.add_argument('--node', metavar = "Node", type = str, help = "Node to start neighbor search at")
     args = arg_parser.parse_args()
 
     if args.neighbors and not args.node:
         arg_parser.error("--neighbors requires --node")
-
-    ast = ASTCodebaseParser(args.dir, args.dim)
+    tokens = args.precision == 'tokens'
+    if not args.dim and not tokens:
+        arg_parser.error("--dim is required unless --precision tokens is given")
+    if tokens and not args.vocab:
+        arg_parser.error("--precision tokens requires --vocab")
+    if args.frozen_vocab and not args.vocab:
+        arg_parser.error("--frozen-vocab requires --vocab")
+
+    ast = ASTCodebaseParser(
+        args.dir,
+        args.dim,
+        exclude = args.exclude,
+        max_file_size = args.max_file_size or None,
+        use_gitignore = not args.no_gitignore,
+        stats = Stats(args.dir, args.profile, args.profile_out) if args.stats or args.profile else None,
+        embedder = args.embedder,
+        dependency_order = not args.discovery_order,
+    )
+    print(f'Found {len(ast._relative_files)} files, skipped {len(ast.skipped_files)} paths {ast.skipped_summary()}')
+    if args.show_skipped:
+        for path, reason in ast.skipped_files:
+            print(f'    skipped {path}: {reason}')
+    num_skipped = len(ast.skipped_files)
     ast.parse_dir()
+    for path, reason in ast.skipped_files[num_skipped:]:
+        print(f'    skipped {path}: {reason}')
+    if args.condense:
+        ast.condense(drop_literals = args.drop_literals)
+    if args.reorder:
+        ast.reorder(args.reorder)
     ast.to_csv(args.nf, args.adj)
-    ast.csv_features_to_vectors(args.nf)
+    if args.hierarchy:
+        ast.to_hierarchy(args.adj)
+    if args.subtrees:
+        ast.to_subtrees(args.adj)
+    if tokens:
+        ast.to_tokens(args.nf, args.vocab, grow = not args.frozen_vocab)
+        os.remove(f"{args.nf}.csv")
+    else:
+        ast.csv_features_to_vectors(args.nf, args.precision)
     
     if args.save_gv:
-        ast.convert_to_graphviz()
+        ast.save_dot_format(
+            args.gv_file,
+            clusters = args.gv_clusters,
+            node_types = args.gv_node_types,
+            edge_types = args.gv_edge_types,
+            files = args.gv_files,
+            max_nodes = args.gv_max_nodes,
+            sample = args.gv_sample,
+        )
 
     if args.neighbors:
         ast.view_k_neighbors(args.node, args.neighbors)
 
+    if ast.stats:
+        print(ast.stats)
+    if args.stats:
+        ast.stats.save(args.stats)
+        print(f'Saved stats to {args.stats}')
+
 if __name__ == "__main__":
     main()
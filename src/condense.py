@@ -0,0 +1,85 @@
+from typing import *
+
+import numpy as np
+
+from edges import CHILD
+from graph import Graph as G
+from graph import Node as N
+
+# wrapper nodes folded into their only child
+FOLDABLE = frozenset([
+    'expression_statement', 'argument_list', 'block', 'parenthesized_expression',
+    'expression_list', 'return_statement', 'decorator', 'type',
+])
+# literal subtrees, removed when drop_literals is set
+LITERALS = frozenset([
+    'string', 'concatenated_string', 'integer', 'float', 'true', 'false', 'none', 'ellipsis',
+])
+
+
+def _copy(node: N, parent: Optional[N]) -> N:
+    return N(node.id, node._start, node._end, node.file, text = node._text, type = node.type,
+             var_name = node._var_name, parent = parent, source = node._source, span = node.span)
+
+
+def condense(graph: G,
+             fold: Collection[str] = FOLDABLE,
+             merge_attributes: bool = True,
+             drop_literals: bool = False,
+             ) -> Tuple[G, np.ndarray]:
+    # returns the condensed graph and, for every node of the original graph,
+    # the index of the node that represents it in the condensed graph
+    n = graph.num_vertices
+    nodes = [graph.get_vertex_at(i) for i in range(n)]
+    parent = [node.parent.index if node.parent else -1 for node in nodes]
+
+    # nodes merged into an ancestor: names inside attribute chains and literal subtrees
+    literal = [False] * n
+    absorbed = [False] * n
+    for i, node in enumerate(nodes):
+        p = parent[i]
+        if p == -1:
+            continue
+        if drop_literals and (literal[p] or node.type in LITERALS):
+            literal[i] = True
+        chained = merge_attributes and nodes[p].type == 'attribute' and node.type in ['attribute', 'identifier']
+        absorbed[i] = literal[i] or chained
+
+    children : List[List[int]] = [[] for _ in range(n)]
+    for i in range(n):
+        if parent[i] != -1 and not absorbed[i]:
+            children[parent[i]].append(i)
+
+    # wrappers with a single remaining child are represented by that child
+    # children come after their parents, so walk backwards
+    rep = np.arange(n, dtype = np.int64)
+    for i in range(n - 1, -1, -1):
+        if not absorbed[i] and parent[i] != -1 and nodes[i].type in fold and len(children[i]) == 1:
+            rep[i] = rep[children[i][0]]
+    for i in range(n):
+        if absorbed[i]:
+            rep[i] = rep[parent[i]]
+
+    condensed = G()
+    new_index = np.full(n, -1, dtype = np.int64)
+    for i, node in enumerate(nodes):
+        if rep[i] != i:
+            continue
+        # the closest ancestor that is not folded into this node
+        p = parent[i]
+        while p != -1 and rep[p] == i:
+            p = parent[p]
+        new_parent = condensed.get_vertex_at(new_index[rep[p]]) if p != -1 else None
+        condensed.add_vertex(_copy(node, new_parent))
+        new_index[i] = condensed.num_vertices - 1
+        if new_parent:
+            condensed.add_edges([new_parent.index], [new_index[i]], [CHILD])
+    mapping = new_index[rep]
+
+    # semantic edges follow their endpoints, edges inside a merged node disappear
+    from_, to_, rel = graph.edges.unique()
+    from_, to_ = mapping[from_], mapping[to_]
+    keep = (rel != CHILD) & (from_ != to_)
+    condensed.add_edges(from_[keep].tolist(), to_[keep].tolist(), rel[keep].tolist())
+    return condensed, mapping
+
@@ -0,0 +1,268 @@
+import argparse
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+import json
+import os
+import queue
+import threading
+import time
+from typing import *
+
+from codebase_parser import ASTCodebaseParser
+from embedders import EMBEDDERS, get_embedder
+from feature_store import PRECISIONS, save_tokens
+from hierarchy import save_hierarchy
+from file_parser import feature_frame, node_id_text, save_adjacency, save_feature_frame, save_order
+from instrumentation import Stats
+from subtrees import dedup_ratio, save_subtrees
+from reorder import METHODS
+from vocabulary import Vocabularies
+
+# repositories parsed ahead of the feature workers, and jobs waiting for the writer
+QUEUE_SIZE = 2
+
+
+def parse_repo(dir: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    # parse pool: one repository per task, the graph comes back as plain lists
+    ast = ASTCodebaseParser(dir, options['dim'], embedder = options['embedder'], stats = Stats(dir))
+    ast.parse_dir()
+    if options['condense']:
+        ast.condense(drop_literals = options['drop_literals'])
+    if options['reorder']:
+        ast.reorder(options['reorder'])
+    nodes = list(ast.AST)
+    return {
+        'ids': [n.id for n in nodes],
+        'types': [n.type for n in nodes],
+        'starts': [n._start for n in nodes],
+        'ends': [n._end for n in nodes],
+        'files': [n.file for n in nodes],
+        'edges': ast.AST.edges,
+        'order': ast.order,
+        'hierarchy': ast.hierarchy() if options['hierarchy'] else None,
+        'subtrees': ast.subtrees() if options['subtrees'] else None,
+        'skipped': ast.skipped_files,
+        'stats': ast.stats.to_dict(),
+    }
+
+
+def _init_embedder(embedder: str, dim: int) -> None:
+    get_embedder(embedder, dim)
+
+
+def featurize_repo(nf: str, graph: Dict[str, Any], options: Dict[str, Any]) -> float:
+    # feature pool: embed and write the dense node features, returns the seconds spent
+    start = time.perf_counter()
+    feats = feature_frame(graph['ids'], graph['starts'], graph['ends'], graph['files'],
+                          get_embedder(options['embedder'], options['dim']), options['dim'])
+    save_feature_frame(nf, feats, options['precision'])
+    return time.perf_counter() - start
+
+
+class Writer(threading.Thread):
+    # runs output jobs one at a time, put blocks once QUEUE_SIZE jobs are waiting
+    def __init__(self, size: int = QUEUE_SIZE) -> None:
+        super().__init__(daemon = True)
+        self._jobs : queue.Queue = queue.Queue(size)
+        self.errors : List[Tuple[str, str]] = []
+
+    def put(self, name: str, job: Callable[[], None]) -> None:
+        self._jobs.put((name, job))
+
+    def run(self) -> None:
+        while True:
+            name, job = self._jobs.get()
+            if job is None:
+                break
+            try:
+                job()
+            except Exception as e:
+                self.errors.append((name, str(e)))
+
+    def close(self) -> None:
+        self._jobs.put(('', None))
+        self.join()
+
+
+def build_dataset(dirs: Sequence[str],
+                  nf_dir: str,
+                  adj_dir: str,
+                  stats_dir: Optional[str] = None,
+                  dim: int = 64,
+                  embedder: str = 'fasttext',
+                  precision: Optional[str] = None,
+                  vocab: Optional[str] = None,
+                  condense: bool = False,
+                  drop_literals: bool = False,
+                  reorder: Optional[str] = None,
+                  hierarchy: bool = False,
+                  subtrees: bool = False,
+                  parse_workers: int = 4,
+                  feature_workers: int = 2,
+                  queue_size: int = QUEUE_SIZE,
+                  log: Callable[[str], None] = print,
+                  ) -> Dict[str, int]:
+    # parse, featurize and write every repository, the stages overlap:
+    # parse_workers processes parse repositories (each reading its files on threads while it
+    # scans their imports for the parse order, see ASTCodebaseParser.PREFETCH),
+    # feature_workers processes embed and write dense features, and a writer thread saves
+    # adjacency matrices, token ids and stats. parsing stops getting ahead once queue_size
+    # parsed repositories wait for features, and the writer blocks both when it falls behind
+    # precision 'tokens' writes vocabulary ids instead of dense features
+    tokens = precision == 'tokens'
+    options = {'dim': dim, 'embedder': embedder, 'precision': precision, 'condense': condense, 'drop_literals': drop_literals, 'reorder': reorder, 'hierarchy': hierarchy, 'subtrees': subtrees}
+    vocabularies = Vocabularies(vocab) if tokens else None
+    counts = {'done': 0, 'failed': 0}
+    writer = Writer(queue_size)
+    writer.start()
+
+    def paths(dir: str) -> Tuple[str, str, str]:
+        name = os.path.basename(os.path.normpath(dir))
+        return name, os.path.join(nf_dir, name), os.path.join(adj_dir, name)
+
+    def write_graph(dir: str, graph: Dict[str, Any], seconds: Optional[float] = None) -> None:
+        name, nf, adj = paths(dir)
+        save_adjacency(adj, graph['edges'], len(graph['ids']))
+        if graph['order'] is not None:
+            save_order(adj, graph['order'])
+        if graph['hierarchy'] is not None:
+            save_hierarchy(adj, graph['hierarchy'])
+        if graph['subtrees'] is not None:
+            save_subtrees(f'{adj}_subtrees', graph['subtrees'])
+        if tokens:
+            start = time.perf_counter()
+            type_ids, token_ids, offsets = vocabularies.encode(graph['types'], [node_id_text(i) for i in graph['ids']])
+            save_tokens(nf, type_ids, token_ids, offsets, graph['starts'], graph['ends'], graph['files'])
+            if vocab:
+                vocabularies.save()
+            seconds = time.perf_counter() - start
+        if stats_dir:
+            stats = graph['stats']
+            if seconds is not None:
+                stats['stages']['featurize'] = seconds
+            with open(os.path.join(stats_dir, f'{name}.json'), 'w') as f:
+                json.dump(stats, f, indent = 2)
+        dedup = f', {dedup_ratio(graph["subtrees"]):.1%} repeated subtrees' if graph['subtrees'] is not None else ''
+        log(f'{name}: {len(graph["ids"])} nodes, {len(graph["edges"])} edges, {len(graph["skipped"])} paths skipped{dedup}')
+
+    with ProcessPoolExecutor(parse_workers) as parse_pool, \
+         ProcessPoolExecutor(feature_workers, initializer = _init_embedder, initargs = (embedder, dim)) as feature_pool:
+        todo = deque(enumerate(dirs))
+        parsed : Deque[Tuple[str, Dict[str, Any]]] = deque()
+        parsing : Dict[Future, Tuple[int, str]] = {}
+        featurizing : Dict[Future, Tuple[str, Dict[str, Any]]] = {}
+        # with tokens the vocabulary grows in write order, so graphs are written in the order
+        # of dirs no matter which parse finishes first: finished graphs wait here, by position
+        # in dirs, until every earlier one is written, None for a failed parse
+        finished : Dict[int, Optional[Tuple[str, Dict[str, Any]]]] = {}
+        written = 0
+        while todo or parsed or parsing or featurizing or finished:
+            while written in finished:
+                item = finished.pop(written)
+                written += 1
+                if item is not None:
+                    writer.put(item[0], lambda dir = item[0], graph = item[1]: write_graph(dir, graph))
+                    counts['done'] += 1
+            while todo and len(parsing) + len(parsed) + len(finished) < parse_workers + queue_size:
+                i, dir = todo.popleft()
+                parsing[parse_pool.submit(parse_repo, dir, options)] = (i, dir)
+            while parsed and len(featurizing) < feature_workers:
+                dir, graph = parsed.popleft()
+                future = feature_pool.submit(featurize_repo, paths(dir)[1], graph, options)
+                featurizing[future] = (dir, graph)
+            if not parsing and not featurizing:
+                continue
+
+            done, _ = wait(list(parsing) + list(featurizing), return_when = FIRST_COMPLETED)
+            for future in done:
+                if future in parsing:
+                    i, dir = parsing.pop(future)
+                    try:
+                        graph = future.result()
+                    except Exception as e:
+                        counts['failed'] += 1
+                        log(f'{paths(dir)[0]}: failed to parse: {e}')
+                        graph = None
+                    if tokens:
+                        finished[i] = (dir, graph) if graph is not None else None
+                    elif graph is not None:
+                        parsed.append((dir, graph))
+                else:
+                    dir, graph = featurizing.pop(future)
+                    try:
+                        seconds = future.result()
+                    except Exception as e:
+                        counts['failed'] += 1
+                        log(f'{paths(dir)[0]}: failed to featurize: {e}')
+                        continue
+                    writer.put(dir, lambda dir = dir, graph = graph, seconds = seconds: write_graph(dir, graph, seconds))
+                    counts['done'] += 1
+
+    writer.close()
+    for name, error in writer.errors:
+        counts['done'] -= 1
+        counts['failed'] += 1
+        log(f'{paths(name)[0]}: failed to write: {error}')
+    return counts
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--dir", metavar = "Directory", type = str, required = True, help = "Directory with one repository per subdirectory")
+    arg_parser.add_argument("--nf", metavar = "Node features", type = str, required = True, help = "Directory for the node features")
+    arg_parser.add_argument("--adj", metavar = "Adjacency matrix", type = str, required = True, help = "Directory for the adjacency matrices")
+    arg_parser.add_argument("--stats", metavar = "Stats", type = str, help = "Directory for one stats record per repository")
+    arg_parser.add_argument("--dim", metavar = "Dimension", type = int, default = 64, help = "Dimension of the node features")
+    arg_parser.add_argument("--embedder", choices = list(EMBEDDERS), default = "fasttext", help = "Embedding of node types and text")
+    arg_parser.add_argument("--precision", choices = PRECISIONS + ['tokens'], help = "Store node features in binary with this precision, or as vocabulary ids with tokens")
+    arg_parser.add_argument("--vocab", metavar = "Vocabulary", type = str, help = "JSON vocabularies for --precision tokens (required with it), extended and saved after every repository")
+    arg_parser.add_argument("--condense", action = "store_true", help = "Fold wrapper nodes and merge attribute chains before saving")
+    arg_parser.add_argument("--drop-literals", action = "store_true", help = "With --condense, also remove literal subtrees")
+    arg_parser.add_argument("--reorder", choices = METHODS, help = "Renumber the nodes for locality and store the permutation in <adj>_order.npy")
+    arg_parser.add_argument("--hierarchy", action = "store_true", help = "Also save definition and module level graphs with their pooling matrices")
+    arg_parser.add_argument("--subtrees", action = "store_true", help = "Also save every repeated subtree once and log the dedup ratio")
+    arg_parser.add_argument("--parse-workers", metavar = "Workers", type = int, default = 4, help = "Processes parsing repositories")
+    arg_parser.add_argument("--feature-workers", metavar = "Workers", type = int, default = 2, help = "Processes computing and writing dense node features")
+    arg_parser.add_argument("--queue-size", metavar = "Size", type = int, default = QUEUE_SIZE, help = "Parsed repositories and write jobs allowed to wait between stages")
+    arg_parser.add_argument("--force", action = "store_true", help = "Also process repositories that already have output")
+    args = arg_parser.parse_args()
+
+    if args.precision == 'tokens' and not args.vocab:
+        arg_parser.error("--precision tokens requires --vocab")
+
+    for path in [args.nf, args.adj, args.stats]:
+        if path:
+            os.makedirs(path, exist_ok = True)
+
+    dirs = []
+    for name in sorted(os.listdir(args.dir)):
+        dir = os.path.join(args.dir, name)
+        if not os.path.isdir(dir) or name.startswith('.'):
+            continue
+        exists = any(os.path.exists(p) for p in [os.path.join(args.adj, f'{name}.npz'), os.path.join(args.nf, f'{name}.csv'), os.path.join(args.nf, f'{name}.npz')])
+        if exists and not args.force:
+            print(f'{name}: skipping (exists)')
+            continue
+        dirs.append(dir)
+
+    start = time.perf_counter()
+    counts = build_dataset(
+        dirs, args.nf, args.adj, args.stats,
+        dim = args.dim,
+        embedder = args.embedder,
+        precision = args.precision,
+        vocab = args.vocab,
+        condense = args.condense,
+        drop_literals = args.drop_literals,
+        reorder = args.reorder,
+        hierarchy = args.hierarchy,
+        subtrees = args.subtrees,
+        parse_workers = args.parse_workers,
+        feature_workers = args.feature_workers,
+        queue_size = args.queue_size,
+    )
+    print(f'{counts["done"]} repositories done, {counts["failed"]} failed in {time.perf_counter() - start:.1f}s')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+from typing import *
+import fnmatch
+import os
+import re
+
+# directories that hold vcs data, environments, build output or vendored code
+# a leading / anchors a pattern to the repository root: names such as build or env are
+# also real packages deeper down (pip._internal.operations.build, conda.env)
+DEFAULT_EXCLUDES = [
+    '.git', '.hg', '.svn', '.tox', '.nox', '.eggs', '*.egg-info',
+    '/venv', '/.venv', '/env', 'site-packages', 'node_modules',
+    '__pycache__', '.mypy_cache', '.pytest_cache', '/build', '/dist',
+    '/vendor', '_vendor', 'third_party',
+]
+# a virtual environment at any depth, whatever its name
+ENVIRONMENT_MARKER = 'pyvenv.cfg'
+# skip files larger than this many bytes (generated tables, bundled data)
+# minified files are caught when they are read, see source.load_source
+MAX_FILE_SIZE = 1024 * 1024
+
+
+def _glob_to_regex(pattern: str) -> str:
+    # translate a gitignore glob to a regex matched against a relative path
+    i, res = 0, ''
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            res += '(?:.*/)?'
+            i += 3
+            continue
+        if pattern.startswith('/**', i) and i + 3 == len(pattern):
+            res += '/.*'
+            i += 3
+            continue
+        if c == '*':
+            res += '.*' if pattern.startswith('**', i) else '[^/]*'
+            i += 2 if pattern.startswith('**', i) else 1
+            continue
+        if c == '?':
+            res += '[^/]'
+        elif c == '[':
+            j = pattern.find(']', i + 1)
+            if j == -1:
+                res += re.escape(c)
+            else:
+                res += '[' + pattern[i + 1:j].replace('!', '^', 1) + ']'
+                i = j
+        elif c == '\\' and i + 1 < len(pattern):
+            i += 1
+            res += re.escape(pattern[i])
+        else:
+            res += re.escape(c)
+        i += 1
+    return res
+
+
+class GitIgnore:
+    def __init__(self, base: str, lines: Iterable[str]) -> None:
+        # base: directory of the .gitignore relative to the walk root ('' for the root)
+        self._base = base
+        # (regex, negated, directory only)
+        self._rules : List[Tuple[Pattern, bool, bool]] = []
+        for line in lines:
+            line = line.rstrip('\n').rstrip()
+            if not line or line.startswith('#'):
+                continue
+            negated = line.startswith('!')
+            if negated:
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            if not line:
+                continue
+            # patterns with a slash are relative to the .gitignore, others match at any depth
+            if '/' in line:
+                regex = _glob_to_regex(line.lstrip('/'))
+            else:
+                regex = '(?:.*/)?' + _glob_to_regex(line)
+            self._rules.append((re.compile(regex + '$'), negated, dir_only))
+
+    @classmethod
+    def from_file(cls, base: str, path: str) -> 'GitIgnore':
+        with open(path, 'r', encoding = 'utf-8', errors = 'replace') as f:
+            return cls(base, f.readlines())
+
+    def match(self, relpath: str, is_dir: bool) -> Optional[bool]:
+        # True if ignored, False if re-included, None if no rule applies
+        if self._base:
+            if not relpath.startswith(self._base + '/'):
+                return None
+            relpath = relpath[len(self._base) + 1:]
+        result = None
+        for regex, negated, dir_only in self._rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(relpath):
+                result = not negated
+        return result
+
+
+def _excluded_by(name: str, relpath: str, exclude: Sequence[str]) -> Optional[str]:
+    for pattern in exclude:
+        if pattern.startswith('/'):
+            if fnmatch.fnmatch(relpath, pattern[1:]):
+                return pattern
+        elif fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relpath, pattern):
+            return pattern
+    return None
+
+
+def discover_files(dir: str,
+                   exclude: Optional[Sequence[str]] = None,
+                   max_file_size: Optional[int] = MAX_FILE_SIZE,
+                   use_gitignore: bool = True,
+                   ) -> Tuple[List[str], List[Tuple[str, str]]]:
+    # returns the python files to parse and (path, reason) for everything skipped
+    # paths are relative to the working directory, in os.walk order
+    exclude = DEFAULT_EXCLUDES if exclude is None else exclude
+    root = os.path.relpath(dir)
+    files : List[str] = []
+    skipped : List[Tuple[str, str]] = []
+
+    def join(base: str, name: str) -> str:
+        return name if base == os.curdir else base + os.sep + name
+
+    def walk(path: str, rel: str, ignores: List[GitIgnore]) -> None:
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError as e:
+            skipped.append((path, f'unreadable ({e.strerror})'))
+            return
+        if use_gitignore and any(entry.name == '.gitignore' and entry.is_file() for entry in entries):
+            ignores = ignores + [GitIgnore.from_file(rel, join(path, '.gitignore'))]
+
+        subdirs = []
+        for entry in entries:
+            entry_rel = rel + '/' + entry.name if rel else entry.name
+            entry_path = join(path, entry.name)
+            is_dir = entry.is_dir(follow_symlinks = False)
+            if not is_dir and not entry.name.endswith('.py'):
+                continue
+
+            pattern = _excluded_by(entry.name, entry_rel, exclude)
+            if pattern:
+                skipped.append((entry_path, f'excluded ({pattern})'))
+                continue
+            ignored = None
+            for ignore in ignores:
+                match = ignore.match(entry_rel, is_dir)
+                if match is not None:
+                    ignored = match
+            if ignored:
+                skipped.append((entry_path, 'gitignore'))
+                continue
+
+            if is_dir:
+                if os.path.isfile(join(entry_path, ENVIRONMENT_MARKER)):
+                    skipped.append((entry_path, f'environment ({ENVIRONMENT_MARKER})'))
+                    continue
+                # os.walk visits the files of a directory before its subdirectories
+                subdirs.append((entry_path, entry_rel))
+                continue
+            if not entry.is_file():
+                continue
+            try:
+                size = entry.stat().st_size
+            except OSError as e:
+                skipped.append((entry_path, f'unreadable ({e.strerror})'))
+                continue
+            if max_file_size is not None and size > max_file_size:
+                skipped.append((entry_path, f'too large ({size} bytes)'))
+                continue
+            files.append(entry_path)
+
+        for subdir, subdir_rel in subdirs:
+            walk(subdir, subdir_rel, ignores)
+
+    walk(root, '', [])
+    return files, skipped
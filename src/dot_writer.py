@@ -0,0 +1,86 @@
+from typing import *
+import fnmatch
+import random
+
+from edges import CHILD, RELATIONS
+from graph import Graph as G
+from graph import Node as N
+
+# characters written per flush
+BUFFER_SIZE = 1024 * 1024
+
+
+def _quote(value: str) -> str:
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+
+
+def select_nodes(graph: G,
+                 node_types: Optional[Collection[str]] = None,
+                 files: Optional[Sequence[str]] = None,
+                 max_nodes: Optional[int] = None,
+                 sample: Optional[float] = None,
+                 seed: int = 0,
+                 ) -> List[int]:
+    # indices of the nodes to write, in graph order
+    rng = random.Random(seed)
+    selected = []
+    for node in graph:
+        if node_types is not None and node.type not in node_types:
+            continue
+        if files is not None and not any(fnmatch.fnmatch(node.file, pattern) for pattern in files):
+            continue
+        if sample is not None and rng.random() >= sample:
+            continue
+        selected.append(node.index)
+        if max_nodes is not None and len(selected) >= max_nodes:
+            break
+    return selected
+
+
+def write_dot(graph: G,
+              filepath: str,
+              clusters: bool = False,
+              node_types: Optional[Collection[str]] = None,
+              edge_types: Optional[Collection[str]] = None,
+              files: Optional[Sequence[str]] = None,
+              max_nodes: Optional[int] = None,
+              sample: Optional[float] = None,
+              seed: int = 0,
+              ) -> Tuple[int, int]:
+    # stream the graph to a DOT file without building a pygraphviz graph
+    # returns the number of nodes and edges written
+    selected = select_nodes(graph, node_types, files, max_nodes, sample, seed)
+    keep = set(selected)
+    relations = set(range(len(RELATIONS))) if edge_types is None else {RELATIONS.index(r) for r in edge_types}
+
+    num_edges = 0
+    with open(filepath, 'w', buffering = BUFFER_SIZE) as f:
+        f.write('strict digraph tree {\n')
+
+        if clusters:
+            # one subgraph per file, in the order the files were parsed
+            by_file : Dict[str, List[N]] = {}
+            for i in selected:
+                node = graph.get_vertex_at(i)
+                by_file.setdefault(node.file, []).append(node)
+            for c, (file, nodes) in enumerate(by_file.items()):
+                f.write(f'    subgraph cluster_{c} {{\n        label={_quote(file)};\n')
+                f.writelines(f'        {_quote(n.id)} [xlabel="{n._start}->{n._end}"];\n' for n in nodes)
+                f.write('    }\n')
+        else:
+            for i in selected:
+                n = graph.get_vertex_at(i)
+                f.write(f'    {_quote(n.id)} [xlabel="{n._start}->{n._end}"];\n')
+
+        from_, to_, rel = graph.edges.unique()
+        for a, b, r in zip(from_.tolist(), to_.tolist(), rel.tolist()):
+            if r not in relations or a not in keep or b not in keep:
+                continue
+            line = f'    {_quote(graph.get_vertex_at(a).id)} -> {_quote(graph.get_vertex_at(b).id)}'
+            if r != CHILD:
+                line += f' [label="{RELATIONS[r]}", style=dashed]'
+            f.write(line + ';\n')
+            num_edges += 1
+
+        f.write('}\n')
+    return len(selected), num_edges
@@ -0,0 +1,77 @@
+from typing import *
+from array import array
+
+import numpy as np
+
+# relation types for edges in the graph
+CHILD = 0
+CALL = 1
+IMPORT = 2
+ASSIGNMENT = 3
+ATTRIBUTE = 4
+
+RELATIONS = ['child', 'call', 'import', 'assignment', 'attribute']
+
+
+class EdgeBuffer:
+    def __init__(self) -> None:
+        # (from index, to index, relation) stored in three flat arrays
+        self._from : array = array('q')
+        self._to : array = array('q')
+        self._rel : array = array('b')
+
+    def __len__(self) -> int:
+        return len(self._rel)
+
+    def add(self, from_: int, to_: int, rel: int, bi: bool = False) -> None:
+        self._from.append(from_)
+        self._to.append(to_)
+        self._rel.append(rel)
+        if bi:
+            self._from.append(to_)
+            self._to.append(from_)
+            self._rel.append(rel)
+
+    @classmethod
+    def from_arrays(cls, from_: np.ndarray, to_: np.ndarray, rel: np.ndarray) -> 'EdgeBuffer':
+        buffer = cls()
+        buffer._from = array('q', np.asarray(from_, dtype = np.int64).tobytes())
+        buffer._to = array('q', np.asarray(to_, dtype = np.int64).tobytes())
+        buffer._rel = array('b', np.asarray(rel, dtype = np.int8).tobytes())
+        return buffer
+
+    def clear(self) -> None:
+        self._from = array('q')
+        self._to = array('q')
+        self._rel = array('b')
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return (
+            np.frombuffer(self._from, dtype = np.int64),
+            np.frombuffer(self._to, dtype = np.int64),
+            np.frombuffer(self._rel, dtype = np.int8),
+        )
+
+    def unique(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # deduplicate all triples with a single sort
+        from_, to_, rel = self.arrays()
+        if not len(rel):
+            return from_.copy(), to_.copy(), rel.copy()
+        order = np.lexsort((to_, from_, rel))
+        from_, to_, rel = from_[order], to_[order], rel[order]
+        keep = np.ones(len(rel), dtype = np.bool_)
+        keep[1:] = (from_[1:] != from_[:-1]) | (to_[1:] != to_[:-1]) | (rel[1:] != rel[:-1])
+        return from_[keep], to_[keep], rel[keep]
+
+    def to_sparse(self, num_nodes: int) -> Dict[str, 'scipy.sparse.csr_array']:
+        import scipy.sparse
+        # one boolean adjacency matrix per relation type
+        from_, to_, rel = self.unique()
+        matrices = {}
+        for i, name in enumerate(RELATIONS):
+            mask = rel == i
+            matrices[name] = scipy.sparse.csr_array(
+                (np.ones(int(mask.sum()), dtype = np.bool_), (from_[mask], to_[mask])),
+                shape = (num_nodes, num_nodes),
+            )
+        return matrices
@@ -0,0 +1,97 @@
+from abc import ABC, abstractmethod
+import functools
+import os
+from typing import *
+import zlib
+
+import numpy as np
+
+
+@functools.lru_cache(maxsize = None)
+def load_fasttext(dim: int) -> 'fasttext.FastText._FastText':
+    # fastText vectors of dim // 4, reduced from the english model on first use
+    import fasttext
+    import fasttext.util
+    fasttext.FastText.eprint = lambda x: None
+    if os.path.exists(f'cc.en.{dim // 4}.bin'):
+        return fasttext.load_model(f'cc.en.{dim // 4}.bin')
+    fasttext.util.download_model('en', if_exists='ignore')
+    ft = fasttext.load_model('cc.en.300.bin')
+    fasttext.util.reduce_model(ft, dim // 4)
+    ft.save_model(f'cc.en.{dim // 4}.bin')
+    return ft
+
+
+class Embedder(ABC):
+    # maps a batch of strings to a (len(words), dim // 4) matrix
+    def __init__(self, dim: int) -> None:
+        self._dim = dim
+        self._size = dim // 4
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @abstractmethod
+    def embed(self, words: Sequence[str]) -> np.ndarray:
+        ...
+
+
+class FastTextEmbedder(Embedder):
+    def __init__(self, dim: int) -> None:
+        super().__init__(dim)
+        self._ft = load_fasttext(dim)
+
+    def embed(self, words: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(words), self._size), dtype = np.float32)
+        for i, word in enumerate(words):
+            vectors[i] = self._ft.get_word_vector(word)
+        return vectors
+
+
+class HashingEmbedder(Embedder):
+    # the word and its character n-grams hashed into dim // 4 signed buckets, scaled to unit length
+    # needs no model, the same word always gets the same vector
+    def __init__(self, dim: int, min_n: int = 3, max_n: int = 6) -> None:
+        super().__init__(dim)
+        self._min_n = min_n
+        self._max_n = max_n
+
+    def _grams(self, word: str) -> List[bytes]:
+        if not word:
+            return []
+        marked = f'<{word}>'
+        grams = [marked]
+        for n in range(self._min_n, min(self._max_n, len(marked)) + 1):
+            grams.extend(marked[i:i + n] for i in range(len(marked) - n + 1))
+        return [g.encode('utf-8') for g in grams]
+
+    def embed(self, words: Sequence[str]) -> np.ndarray:
+        rows, hashes = [], []
+        for i, word in enumerate(words):
+            grams = self._grams(word)
+            rows.extend([i] * len(grams))
+            hashes.extend(zlib.crc32(g) for g in grams)
+        rows = np.array(rows, dtype = np.int64)
+        hashes = np.array(hashes, dtype = np.uint32)
+        # low bits pick the bucket, the top bit the sign
+        columns = (hashes % self._size).astype(np.int64)
+        signs = np.where(hashes >> 31, -1., 1.).astype(np.float32)
+
+        vectors = np.zeros((len(words), self._size), dtype = np.float32)
+        np.add.at(vectors, (rows, columns), signs)
+        norms = np.linalg.norm(vectors, axis = 1, keepdims = True)
+        return vectors / np.where(norms > 0, norms, 1)
+
+
+EMBEDDERS : Dict[str, Type[Embedder]] = {
+    'fasttext': FastTextEmbedder,
+    'hashing': HashingEmbedder,
+}
+
+
+@functools.lru_cache(maxsize = None)
+def get_embedder(name: str, dim: int) -> Embedder:
+    if name not in EMBEDDERS:
+        raise Exception(f"Unknown embedder {name}. Use one of {list(EMBEDDERS)}.")
+    return EMBEDDERS[name](dim)
@@ -0,0 +1,156 @@
+from typing import *
+import os
+import re
+
+import numpy as np
+
+# supported storage schemes for the node feature matrix
+# float64 keeps full precision, int8 stores a per-column scale/offset
+PRECISIONS = ['float64', 'float32', 'float16', 'int8']
+
+
+def quantize(feats: np.ndarray, precision: str) -> Dict[str, np.ndarray]:
+    if precision not in PRECISIONS:
+        raise Exception(f"Unknown precision {precision}. Use one of {PRECISIONS}.")
+    feats = np.asarray(feats, dtype = np.float64)
+    if precision != 'int8':
+        return {'feats': feats.astype(precision)}
+
+    # map every column onto [-128, 127] using its own range
+    offset = feats.min(axis = 0) if len(feats) else np.zeros(feats.shape[1])
+    span = (feats.max(axis = 0) - offset) if len(feats) else np.zeros(feats.shape[1])
+    scale = np.where(span > 0, span / 255., 1.)
+    q = np.rint((feats - offset) / scale) - 128
+    return {
+        'feats': q.astype(np.int8),
+        'scale': scale.astype(np.float32),
+        'offset': offset.astype(np.float32),
+    }
+
+
+def dequantize(stored: Mapping[str, np.ndarray], precision: str) -> np.ndarray:
+    if precision == 'int8':
+        q = stored['feats'].astype(np.float32) + 128
+        return q * stored['scale'] + stored['offset']
+    return stored['feats']
+
+
+def _pack_strings(strings: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    # store strings as one utf-8 blob plus offsets, much smaller than a unicode array
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype = np.int64)
+    np.cumsum([len(s) for s in encoded], out = offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype = np.uint8), offsets
+
+
+def _unpack_strings(blob: np.ndarray, offsets: np.ndarray) -> List[str]:
+    data = blob.tobytes()
+    return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+
+def _points_to_array(points: Sequence[str]) -> np.ndarray:
+    # "(row, column)" -> [row, column]
+    return np.array(
+        [[int(x) for x in re.findall(r"[0-9]+", p)] for p in points],
+        dtype = np.int32,
+    ).reshape(-1, 2)
+
+
+def _array_to_points(points: np.ndarray) -> List[str]:
+    return [f'({r}, {c})' for r, c in points.tolist()]
+
+
+def save_features(nf: str, df: 'pd.DataFrame', precision: str) -> str:
+    # df is laid out like the csv output: index of node ids, one column per
+    # feature dimension followed by the start, end and file columns
+    meta = ['start', 'end', 'file']
+    feats = df.drop(columns = meta).to_numpy()
+    stored = quantize(feats, precision)
+
+    files, file_codes = np.unique(df['file'].astype(str).to_numpy(), return_inverse = True)
+    nodes, node_offsets = _pack_strings([str(n) for n in df.index])
+    file_names, file_offsets = _pack_strings(list(files))
+
+    path = f"{nf}.npz"
+    np.savez(
+        path,
+        precision = np.array(precision),
+        nodes = nodes,
+        node_offsets = node_offsets,
+        start = _points_to_array(df['start'].astype(str)),
+        end = _points_to_array(df['end'].astype(str)),
+        files = file_names,
+        file_offsets = file_offsets,
+        file_codes = file_codes.astype(np.int32),
+        **stored,
+    )
+    return path
+
+
+def save_tokens(nf: str,
+                type_ids: np.ndarray,
+                tokens: np.ndarray,
+                token_offsets: np.ndarray,
+                start: np.ndarray,
+                end: np.ndarray,
+                files: Sequence[str],
+                ) -> str:
+    # integer ids into the dataset vocabularies instead of dense features,
+    # rows are in node order like the adjacency matrices
+    # files in order of first appearance, nodes of a file are contiguous
+    codes = {f: i for i, f in enumerate(dict.fromkeys(files))}
+    file_codes = np.array([codes[f] for f in files], dtype = np.int32)
+    packed_files, file_offsets = _pack_strings(list(codes))
+    path = f"{nf}.npz"
+    np.savez_compressed(
+        path,
+        precision = np.array('tokens'),
+        types = type_ids.astype(np.int16 if type_ids.max(initial = 0) < 2 ** 15 else np.int32),
+        tokens = tokens,
+        token_offsets = token_offsets,
+        start = np.asarray(start, dtype = np.int32).reshape(-1, 2),
+        end = np.asarray(end, dtype = np.int32).reshape(-1, 2),
+        files = packed_files,
+        file_offsets = file_offsets,
+        file_codes = file_codes,
+    )
+    return path
+
+
+def load_tokens(nf: str) -> Dict[str, Any]:
+    # the arrays written by save_tokens, with the file of every node
+    with np.load(f"{nf}.npz") as data:
+        if str(data['precision']) != 'tokens':
+            raise Exception(f'{nf}.npz holds dense features. Use load_features().')
+        files = np.array(_unpack_strings(data['files'], data['file_offsets']), dtype = object)
+        return {
+            'types': data['types'].astype(np.int32),
+            'tokens': data['tokens'],
+            'token_offsets': data['token_offsets'],
+            'start': data['start'],
+            'end': data['end'],
+            'files': files[data['file_codes']] if len(files) else np.array([], dtype = object),
+        }
+
+
+def load_features(nf: str) -> 'pd.DataFrame':
+    import pandas as pd
+    # load either storage format and return the csv layout with float features
+    if os.path.exists(f"{nf}.npz"):
+        with np.load(f"{nf}.npz") as data:
+            precision = str(data['precision'])
+            if precision == 'tokens':
+                raise Exception(f'{nf}.npz holds token ids. Use load_tokens().')
+            feats = dequantize(data, precision)
+            nodes = _unpack_strings(data['nodes'], data['node_offsets'])
+            files = np.array(_unpack_strings(data['files'], data['file_offsets']), dtype = object)
+            df = pd.DataFrame(feats, index = pd.Index(nodes, name = 'node'))
+            df['start'] = _array_to_points(data['start'])
+            df['end'] = _array_to_points(data['end'])
+            df['file'] = files[data['file_codes']] if len(files) else []
+        return df
+    if os.path.exists(f"{nf}.csv"):
+        df = pd.read_csv(f"{nf}.csv", header = 0, index_col = 0)
+        df.columns = [int(c) if c.isdigit() else c for c in df.columns]
+        return df
+    raise Exception(f'No node features found for {nf}.')
@@ -1,24 +1,31 @@
 import argparse
-import copy
+import builtins
+from contextlib import nullcontext
 import sys
 from typing import *
 import os
 import re
 
 from tree_sitter import Language, Node, Parser, Tree, TreeCursor
-import networkx as nx
 import numpy as np
-import pandas as pd
-import pygraphviz as pgv
-import fasttext
-import fasttext.util
-import scipy.sparse
 
 
 from graph import Graph as G
 from graph import Node as N
-
-fasttext.FastText.eprint = lambda x: None
+from edges import CALL, IMPORT, EdgeBuffer
+from class_index import ClassIndex
+from source import SourceBuffer, load_source
+from instrumentation import Stats
+from dot_writer import write_dot
+from condense import condense as condense_graph
+from reorder import bandwidth, ordering
+from hierarchy import build_hierarchy, save_hierarchy
+from subtrees import dedup_ratio, hash_cons, save_subtrees
+from symbol_index import SymbolIndex
+from embedders import EMBEDDERS, Embedder, get_embedder
+
+# pandas, scipy, networkx, pygraphviz and fasttext are imported where they are used
+# so parsing a single file does not pay for loading them
 
 Language.build_library(
     'build/my-languages.so',
@@ -27,15 +34,154 @@ Language.build_library(
 
 PYTHON = Language('build/my-languages.so', 'python')
 CONST = 10e-4
+# the _<count> suffix that makes node ids unique
+_ID_SUFFIX = re.compile(r"(.*)(_[0-9]+$)")
+
+# symbols tracked in pass one, matched in C by tree-sitter instead of
+# checking the type of every node in python
+SYMBOL_QUERY = PYTHON.query("""
+(call function: (_) @call)
+(aliased_import name: (dotted_name) @import.aliased)
+(import_statement name: (dotted_name) @import.dotted)
+(import_from_statement module_name: (_) @import.module)
+(import_from_statement name: (dotted_name) @import.dotted)
+(function_definition name: (identifier) @definition)
+(class_definition name: (identifier) @definition)
+(assignment left: (identifier) @assignment)
+(assignment left: (attribute object: (identifier) attribute: (identifier)) @member.attribute)
+""")
+
+
+def location_to_embed(x: int, y: int, dim: int) -> np.ndarray:
+    # sinusoidal encoding of a (row, column) point in dim values
+    res = np.zeros(dim)
+    i = np.arange(dim // 4)
+    res[2*i] = np.sin(x * CONST ** (4 * i / dim))
+    res[2*i + 1] = np.cos(x * CONST ** (4 * i / dim))
+    res[2*i + dim // 2] = np.sin(y * CONST ** (4 * i / dim))
+    res[2*i + dim // 2 + 1] = np.cos(y * CONST ** (4 * i / dim))
+    return res
+
+
+def _parse_point(location: str) -> Tuple[int, int]:
+    # "(row, column)" -> (row, column)
+    x = int(re.search(r"\(([0-9]+),", location).groups()[0])
+    y = int(re.search(r",\s([0-9]+)\)", location).groups()[0])
+    return x, y
+
+
+def node_id_text(node_id: str) -> str:
+    if ' | ' not in node_id:
+        return ''
+    text = node_id.split(' | ')[1]
+    match = _ID_SUFFIX.match(text)
+    return match.groups()[0] if match else text
+
+
+def node_id_type(node_id: str) -> str:
+    return node_id[:node_id.rfind('_')] if ' | ' not in node_id else node_id.split(' | ')[0]
+
+
+def locations_to_embed(points: np.ndarray, dim: int) -> np.ndarray:
+    # location_to_embed for every row of an (n, 2) array of points
+    points = np.asarray(points, dtype = np.float64).reshape(-1, 2)
+    i = np.arange(dim // 4)
+    scale = CONST ** (4 * i / dim)
+    res = np.zeros((len(points), dim))
+    res[:, 2*i] = np.sin(points[:, :1] * scale)
+    res[:, 2*i + 1] = np.cos(points[:, :1] * scale)
+    res[:, 2*i + dim // 2] = np.sin(points[:, 1:] * scale)
+    res[:, 2*i + dim // 2 + 1] = np.cos(points[:, 1:] * scale)
+    return res
+
+
+def embed_nodes(ids: Sequence[str],
+                starts: Sequence[Tuple[int, int]],
+                ends: Sequence[Tuple[int, int]],
+                embedder: Embedder,
+                dim: int,
+               ) -> np.ndarray:
+    # start and end location, type and text of every node, dim // 4 values each
+    # every distinct type and text is embedded once
+    words = [node_id_type(node_id) for node_id in ids] + [node_id_text(node_id) for node_id in ids]
+    unique, inverse = np.unique(np.array(words, dtype = object), return_inverse = True)
+    vectors = embedder.embed(unique.tolist())[inverse].reshape(2, len(ids), dim // 4)
+    return np.concatenate([
+        locations_to_embed(starts, dim // 4),
+        locations_to_embed(ends, dim // 4),
+        vectors[0],
+        vectors[1],
+    ], axis = 1).reshape(-1, dim)
+
+
+def save_adjacency(adj: str, edges: EdgeBuffer, num_nodes: int) -> None:
+    import scipy.sparse
+    # one matrix per relation type plus the combined adjacency
+    relations = edges.to_sparse(num_nodes)
+    adj_sparse = sum(m.astype(np.int8) for m in relations.values()).astype(np.bool_)
+    scipy.sparse.save_npz(adj, adj_sparse)
+    print(f'Saved adjacency matrix to {adj}.npz')
+    for name, matrix in relations.items():
+        scipy.sparse.save_npz(f'{adj}_{name}', matrix)
+    print(f'Saved {len(relations)} relation adjacency matrices to {adj}_<relation>.npz')
+
+
+def save_order(adj: str, order: np.ndarray) -> None:
+    # the permutation applied by reorder, row i of the matrices and features was node order[i]
+    np.save(f'{adj}_order.npy', order)
+    print(f'Saved node order to {adj}_order.npy')
+
+
+def feature_frame(ids: Sequence[str],
+                  starts: Sequence[Tuple[int, int]],
+                  ends: Sequence[Tuple[int, int]],
+                  files: Sequence[str],
+                  embedder: Embedder,
+                  dim: int,
+                  ) -> 'pd.DataFrame':
+    # node features in the csv layout: one column per dimension, then start, end and file
+    import pandas as pd
+    feats = pd.DataFrame(embed_nodes(ids, starts, ends, embedder, dim))
+    feats['start'] = [str(p) for p in starts]
+    feats['end'] = [str(p) for p in ends]
+    feats['file'] = list(files)
+    feats.index = pd.Index(ids, name = 'node')
+    return feats
+
+
+def save_feature_frame(nf: str, feats: 'pd.DataFrame', precision: Optional[str] = None) -> None:
+    if precision is None:
+        feats.to_csv(f"{nf}.csv")
+    else:
+        from feature_store import save_features
+        path = save_features(nf, feats, precision)
+        if os.path.exists(f"{nf}.csv"):
+            # binary storage replaces the intermediate csv
+            os.remove(f"{nf}.csv")
+        print(f'Saved {precision} node features to {path}')
 
 
 class ASTFileParser():
 
-    BUILTINS = dir(__builtins__)
+    BUILTINS = frozenset(dir(builtins))
+
+    # extract symbols with SYMBOL_QUERY, set to False to use the per node checks
+    USE_QUERIES = True
 
-    def __init__(self, filepath: str) -> None:
+    # stage timings and counters, collected when set
+    _stats : Optional[Stats] = None
+
+    # node i of the exported graph was node _order[i] before reorder()
+    _order : Optional[np.ndarray] = None
+
+    def __init__(self, filepath: str, dim: Optional[int] = None, embedder: str = 'fasttext') -> None:
         super().__init__()
 
+        # dimension of the node features and the embedder for their type and text,
+        # only needed for csv_features_to_vectors
+        self._dim = dim
+        self._embedder = embedder
+
         self._parser = Parser()
         self._parser.set_language(PYTHON)
 
@@ -69,36 +215,95 @@ class ASTFileParser():
 
         # track edges to be added at the end
         # don't add edges right away b/c ruins tree structure and traversal
-        # (node_id_to, node_id_from)
-        self._edges_to_add : List[Tuple[str, str]] = []
+        # (node_index_from, node_index_to, relation)
+        self._edges_to_add : EdgeBuffer = EdgeBuffer()
+
+        # the same edges once, from the use to what it resolved to, for the symbol index
+        self._links : EdgeBuffer = EdgeBuffer()
+
+        # (file, name, node id) of every function and class definition
+        self._definition_sites : List[Tuple[str, str, str]] = []
+
+        # (file, name, import path, node id) of every imported name
+        self._import_sites : List[Tuple[str, str, str, str]] = []
+
+        # import node id -> files the import resolved to
+        self._import_targets : Dict[str, Set[str]] = {}
 
         # track assignments
         # key: file name
         # value: dict of {variable name: (variable type, node name)}
         self._assignments : Dict[str, Dict[str, Tuple[str, str]]] = {}
 
-        # track classes and their attributes
-        # key: file name
-        # value: dict of (class name, dict of (attribute name, node name))
-        self._classes : Dict[str, Dict[str, Dict[str, str]]] = {}
+        # track classes, their bases and members (methods, class assignments, self attributes)
+        # filled in while the nodes are built so no second walk over class bodies is needed
+        self._class_index : ClassIndex = ClassIndex(self._resolve_class)
 
         # track edges for imports from files that have not been read yet
         # value: (node_from_id, file_imported_from, function_imported)
         self._delayed_assignment_edges_to_add : List[Tuple[str, str, str]] = []
 
         self._delayed_call_edges_to_add : List[Tuple[str, str, str]] = []
-        
-        # (node_from_id, imported_file, class_type, attribute_name)
+
+        # (node_from_id, file_of_class, class_type, attribute_name)
+        # resolved against the class index once the file of the class has been read
         self._delayed_class_attributes_to_add : List[Tuple[str, str, str, str]] = []
+
+        # files read completely, together with the import cycle they belong to
+        # references into them are resolved right away instead of queued
+        self._read_files : Set[str] = set()
+        # queued entries resolved before the last file was read
+        self._resolved_early = 0
+
+        # assignment types waiting for their first identifier to be built
+        # key: tree-sitter node id of the identifier
+        self._pending_assignments : Dict[int, str] = {}
+
+        # saved definitions and assignments of the enclosing scopes
+        self._scopes : List[List[Optional[Dict]]] = []
     
-    def _copy_for_scope(self) -> List[Dict]:
+    def _add_edge_later(self, from_: str, to_: str, rel: int, bi: bool = False) -> None:
+        from_, to_ = self._AST.index_of(from_), self._AST.index_of(to_)
+        self._edges_to_add.add(from_, to_, rel, bi)
+        self._links.add(from_, to_, rel)
+
+    def _add_edges(self, parent: G) -> None:
+        # deduplicate the buffered edges and add them to the graph
+        from_, to_, rel = self._edges_to_add.unique()
+        parent.add_edges(from_.tolist(), to_.tolist(), rel.tolist())
+        self._edges_to_add.clear()
+
+    def _copy_for_scope(self, file: str) -> List[Optional[Dict]]:
+        # only the current file changes inside a scope, and the values are immutable
         return [
-            copy.deepcopy(self._function_calls),
-            copy.deepcopy(self._function_definitions),
-            copy.deepcopy(self._assignments),
-            copy.deepcopy(self._classes),
+            dict(self._function_definitions[file]) if file in self._function_definitions else None,
+            dict(self._assignments[file]) if file in self._assignments else None,
         ]
 
+    def _restore_scope(self, file: str, saved: List[Optional[Dict]]) -> None:
+        for tracked, values in zip([self._function_definitions, self._assignments], saved):
+            if values is None:
+                tracked.pop(file, None)
+            else:
+                tracked[file] = values
+
+    @property
+    def stats(self) -> Optional[Stats]:
+        return self._stats
+
+    def _stage(self, name: str) -> ContextManager:
+        return self._stats.stage(name) if self._stats else nullcontext()
+
+    @property
+    def symbols(self) -> SymbolIndex:
+        # definitions, call sites, references and imports, built once the edges are resolved
+        if not hasattr(self, '_symbols'):
+            raise Exception("No symbol index. Use parse() first.")
+        return self._symbols
+
+    def _build_symbol_index(self) -> None:
+        self._symbols = SymbolIndex(self._AST, self._links, self._definition_sites, self._import_sites, self._import_targets, self._class_index)
+
     @property
     def AST(self) -> Dict[str, Any]:
         return self._AST
@@ -112,23 +317,23 @@ class ASTFileParser():
             raise Exception("AST is empty. Use parse() first.")
         return str(self._AST)
     
-    def _get_syntax_tree(self, filepath: str) -> Tree:
-        with open (filepath, "r") as myfile:
-            file = myfile.read()
-        return self._parser.parse(bytes(file, "utf8"))
+    def _get_syntax_tree(self, filepath: str, source: Optional[SourceBuffer] = None) -> Tree:
+        # keep the bytes so node text can be sliced out of them
+        # the tree does not need its own copy of the text
+        self._source = source if source is not None else self._load_source(filepath)
+        return self._parser.parse(self._source.data, keep_text = False)
     
+    def _load_source(self, filepath: str) -> SourceBuffer:
+        return load_source(filepath)
+
     def parse(self) -> str:
+        symbols = self._query_symbols(self._root) if self.USE_QUERIES else None
     
         def _parse_node(node: Node, parent: G, last_node: Union[N, None], filename: str) -> str:
-            # add text if node is terminal
-            text = None
-            if node.is_named and len(node.children) == 0:
-                text = node.text.decode("utf-8")
-            if node.type == 'binary_operator':
-                text = node.children[1].text.decode("utf-8")
-            # add text to attribute nodes
-            if node.type == 'attribute':
-                text = node.text.decode("utf-8")            
+            span = self._text_span(node)
+            # node ids embed the text, so every node with a span is decoded here while
+            # parsing, through the span cache so repeated names are decoded once
+            text = self._source.text(*span) if span else None
             
             name = node.type if not text else node.type + ' | ' + text
 
@@ -149,9 +354,8 @@ class ASTFileParser():
                     self._counts[name] += 1
                     name = name + '_' + str(self._counts[name])
             
-            n_ = N(name, node.start_point, node.end_point, filename, type = node.type, parent = last_node)
-            if text:
-                n_.text = text
+            n_ = N(name, node.start_point, node.end_point, filename, type = node.type, parent = last_node,
+                   source = self._source, span = span)
 
             # if node.type == 'attribute':
             #     n_.type = 'identifier'
@@ -161,22 +365,12 @@ class ASTFileParser():
             # add the node to the graph
             id = parent.add_vertex(n_)
 
-            # track variable name for identifier nodes
-            if node.type == 'identifier':
-                n_.var_name = node.text.decode("utf-8")
-
-            # handle function calls
-            if node.type == 'call' and node.children[0].text.decode("utf-8") not in self.BUILTINS:
-                self._handle_call(node, parent, name)
+            # handle function calls, imports, definitions and assignments
+            symbol = symbols.get(node.id) if symbols is not None else self._node_symbol(node)
+            if symbol:
+                self._handle_symbol(symbol, parent, name)
 
-            # handle imports
-            if node.type == "aliased_import" or \
-                (node.type == "dotted_name" and node.parent.type.startswith("import")):
-                self._handle_import(node, parent, name)
-
-            # handle function definitions
-            if node.type == 'function_definition' or node.type == 'class_definition':
-                self._handle_definition(node, parent, name)
+            self._enter_node(node, n_, parent)
             
             for child in node.children:
                 # only use named nodes
@@ -184,20 +378,161 @@ class ASTFileParser():
                     continue
                 to_id_ = _parse_node(child, parent, last_node = n_, filename=filename)
                 parent.add_edge(n_.id, to_id_)
+
+            self._leave_node(node, n_, parent)
             
             return id
     
         root_id = _parse_node(self._root, self._AST, last_node = None, filename = self._filepath)
+        # nodes decode their text from the buffer again if it is needed later
+        self._source.release()
 
         # check if this is a file or dir parser
         if type(self) == ASTFileParser:
             self._resolve_imports(self._AST)
+            self._build_symbol_index()
 
         return root_id
 
-    def _handle_call(self, node: Node, parent: G, id: str) -> None:
-        # get function name
-        function_name = node.children[0].text.decode("utf-8")
+    def _text_span(self, node: Node) -> Optional[Tuple[int, int]]:
+        # byte offsets of the text kept for a node, None if it has no text
+        span = None
+        # add text if node is terminal
+        if node.is_named and node.child_count == 0:
+            span = (node.start_byte, node.end_byte)
+        if node.type == 'binary_operator':
+            operator = node.children[1]
+            span = (operator.start_byte, operator.end_byte)
+        # add text to attribute nodes
+        if node.type == 'attribute':
+            span = (node.start_byte, node.end_byte)
+        return span
+
+    def _text_of(self, node: Node) -> str:
+        return self._source.node_text(node)
+
+    def _enter_node(self, node: Node, current_vertex: N, parent: G) -> None:
+        # called once a node is in the graph, before its children are built
+        pass
+
+    def _leave_node(self, node: Node, current_vertex: N, parent: G) -> None:
+        # called after all children of a node are built
+        pass
+
+    def _query_symbols(self, root: Node) -> Dict[int, Tuple]:
+        # map tree-sitter node ids to the symbol they define or use
+        symbols : Dict[int, Tuple] = {}
+        modules : Dict[int, str] = {}
+        for node, capture in SYMBOL_QUERY.captures(root):
+            text = self._text_of(node)
+            if capture == 'call':
+                if text not in self.BUILTINS:
+                    symbols[node.parent.id] = ('call', text)
+            elif capture == 'import.module':
+                # captured before the names of the same statement
+                modules[node.parent.id] = text
+            elif capture == 'import.dotted':
+                symbols[node.id] = ('import', text, modules.get(node.parent.id, ""))
+            elif capture == 'import.aliased':
+                aliased = node.parent
+                alias = self._text_of(aliased.child_by_field_name('alias'))
+                if aliased.parent.type == 'import_from_statement':
+                    symbols[aliased.id] = ('import', alias, modules[aliased.parent.id] + '.' + text)
+                else:
+                    symbols[aliased.id] = ('import', alias, text)
+            elif capture == 'definition':
+                symbols[node.parent.id] = ('definition', text, self._owner_class(node.parent), self._class_bases(node.parent))
+            elif capture == 'assignment':
+                symbols[node.id] = ('assignment', text, self._assignment_type(node.parent), self._owner_class(node.parent))
+            elif capture == 'member.attribute':
+                owner = self._self_attribute_owner(node)
+                if owner:
+                    symbols[node.id] = ('attribute', self._text_of(node.child_by_field_name('attribute')), owner)
+        return symbols
+
+    def _node_symbol(self, node: Node) -> Optional[Tuple]:
+        # per node checks, same result as a lookup in _query_symbols
+        if node.type == 'call' and self._text_of(node.children[0]) not in self.BUILTINS:
+            return ('call', self._text_of(node.children[0]))
+        if node.type == 'aliased_import':
+            if node.parent.type == 'import_from_statement':
+                import_path = self._text_of(node.parent.children[1]) + '.' + self._text_of(node.children[0])
+            elif node.parent.type == 'import_statement':
+                import_path = self._text_of(node.children[0])
+            return ('import', self._text_of(node.children[2]), import_path)
+        if node.type == 'dotted_name' and node.parent.type.startswith("import"):
+            # skip the first dotted name of the import from
+            if node.parent.type == 'import_from_statement' and node.parent.children[1] == node:
+                return None
+            if node.parent.type == 'import_from_statement':
+                import_path = self._text_of(node.parent.children[1])
+            elif node.parent.type == 'import_statement':
+                import_path = ""
+            return ('import', self._text_of(node), import_path)
+        if node.type == 'function_definition' or node.type == 'class_definition':
+            return ('definition', self._text_of(node.child_by_field_name('name')), self._owner_class(node), self._class_bases(node))
+        if node.type == 'identifier' and node.parent.type == 'assignment' and node.parent.children[0] == node:
+            return ('assignment', self._text_of(node), self._assignment_type(node.parent), self._owner_class(node.parent))
+        if node.type == 'attribute' and node.parent.type == 'assignment' and node.parent.children[0] == node \
+            and node.child_by_field_name('object').type == 'identifier' and self._self_attribute_owner(node):
+            return ('attribute', self._text_of(node.child_by_field_name('attribute')), self._self_attribute_owner(node))
+        return None
+
+    def _owner_class(self, node: Node) -> Optional[str]:
+        # name of the class whose body directly holds this definition or assignment
+        if node.parent.type in ['decorated_definition', 'expression_statement']:
+            node = node.parent
+        if node.parent and node.parent.type == 'block' and node.parent.parent.type == 'class_definition':
+            return self._text_of(node.parent.parent.child_by_field_name('name'))
+        return None
+
+    def _class_bases(self, node: Node) -> Optional[List[str]]:
+        # base class names for class definitions, None for functions
+        if node.type != 'class_definition':
+            return None
+        superclasses = node.child_by_field_name('superclasses')
+        if not superclasses:
+            return []
+        return [self._text_of(b) for b in superclasses.named_children if b.type in ['identifier', 'attribute']]
+
+    def _self_attribute_owner(self, attribute: Node) -> Optional[str]:
+        # class of the method assigning <first parameter>.<name>, None for other objects
+        function = attribute.parent
+        while function and function.type not in ['function_definition', 'class_definition', 'module']:
+            function = function.parent
+        if not function or function.type != 'function_definition':
+            return None
+        parameters = function.child_by_field_name('parameters').named_children
+        if not parameters or parameters[0].type != 'identifier':
+            return None
+        if self._text_of(parameters[0]) != self._text_of(attribute.child_by_field_name('object')):
+            return None
+        return self._owner_class(function)
+
+    def _assignment_type(self, node: Node) -> str:
+        # type of the assigned value, or the called function for calls
+        value = node.child_by_field_name('right')
+        if not value:
+            return ""
+        if value.type == 'call':
+            function = value.child_by_field_name('function')
+            return self._text_of(function) if function.type in ['identifier', 'attribute'] else ""
+        return value.type
+
+    def _handle_symbol(self, symbol: Tuple, parent: G, id: str) -> None:
+        kind = symbol[0]
+        if kind == 'call':
+            self._handle_call(symbol[1], parent, id)
+        elif kind == 'import':
+            self._handle_import(symbol[1], symbol[2], parent, id)
+        elif kind == 'definition':
+            self._handle_definition(symbol[1], symbol[2], symbol[3], parent, id)
+        elif kind == 'assignment':
+            self._handle_assignment(symbol[1], symbol[2], symbol[3], parent, id)
+        elif kind == 'attribute':
+            self._handle_attribute(symbol[1], symbol[2], parent, id)
+
+    def _handle_call(self, function_name: str, parent: G, id: str) -> None:
         # add function call to dict
         if self._filepath not in self._function_calls:
             self._function_calls[self._filepath] = {function_name: id}
@@ -210,7 +545,7 @@ class ASTFileParser():
     def _call_to_import(self, function_call: str, parent: G, id: str) -> None:
         if self._filepath in self._imports and function_call in self._imports[self._filepath]:
             # parent.add_edge(id, self._imports[self._filepath][function_call])
-            self._edges_to_add.append((id, self._imports[self._filepath][function_call][0]))
+            self._add_edge_later(id, self._imports[self._filepath][function_call][0], IMPORT)
             return
         if '.' in function_call:
             # function_name = function_name if len(function_name.split('.')) <= 1 else function_name.split('.')[0]
@@ -218,42 +553,47 @@ class ASTFileParser():
             function_call = function_call[:function_call.rfind('.')]
             self._call_to_import(function_call, parent, id)
         
-    def _handle_import(self, node: Node, parent: G, id: str) -> None:
-        if node.type == 'aliased_import':
-            if node.parent.type == 'import_from_statement':
-                import_path = node.parent.children[1].text.decode("utf-8") + '.' + node.children[0].text.decode("utf-8")
-            elif node.parent.type == 'import_statement':
-                import_path = node.children[0].text.decode("utf-8")
-            import_name = [(node.children[2].text.decode("utf-8"), id, import_path)]
-        elif node.type == 'dotted_name':
-            # skip the first dotted name of the import from
-            if node.parent.type == 'import_from_statement' and node.parent.children[1] == node:
-                return
-            if node.parent.type == 'import_from_statement':
-                import_path = node.parent.children[1].text.decode("utf-8")
-            elif node.parent.type == 'import_statement':
-                # import_path = node.text.decode("utf-8")
-                import_path = ""
-            import_name = [(node.text.decode("utf-8"), id, import_path)]
-            
+    def _handle_import(self, import_: str, import_path: str, parent: G, id: str) -> None:
+        self._import_sites.append((self._filepath, import_, import_path, id))
         # add import to dict
-        for import_, id_, import_path_ in import_name:
-            # get import location
-            if self._filepath not in self._imports:
-                self._imports[self._filepath] = {import_: (id_, import_path_)}
-            else:
-                self._imports[self._filepath][import_] = (id_, import_path_)
+        if self._filepath not in self._imports:
+            self._imports[self._filepath] = {import_: (id, import_path)}
+        else:
+            self._imports[self._filepath][import_] = (id, import_path)
 
-    def _handle_definition(self, node: Node, parent: G, id: str) -> None:
-        # get function name
-        function_name = node.children[1].text.decode("utf-8")
+    def _handle_definition(self, function_name: str, owner: Optional[str], bases: Optional[List[str]], parent: G, id: str) -> None:
+        self._definition_sites.append((self._filepath, function_name, id))
         # add function definition to dict
         if self._filepath not in self._function_definitions:
             self._function_definitions[self._filepath] = {function_name: id}
         else:
             self._function_definitions[self._filepath][function_name] = id
-
-    # TODO: make this work with single files again
+        # classes are indexed before their bodies are visited
+        if bases is not None:
+            self._class_index.add_class(self._filepath, function_name, id, bases)
+        if owner:
+            self._class_index.add_member(self._filepath, owner, function_name, id)
+
+    def _handle_assignment(self, variable_name: str, type_: str, owner: Optional[str], parent: G, id: str) -> None:
+        # add assignment to dict
+        if self._filepath not in self._assignments:
+            self._assignments[self._filepath] = {}
+        self._assignments[self._filepath][variable_name] = (type_, id)
+        if owner:
+            self._class_index.add_member(self._filepath, owner, variable_name, id)
+
+    def _handle_attribute(self, attribute_name: str, owner: str, parent: G, id: str) -> None:
+        # the first assignment to self.<name> (usually in __init__) defines the attribute
+        self._class_index.add_member(self._filepath, owner, attribute_name, id, overwrite = False)
+
+    def _resolve_class(self, file: str, class_name: str) -> Optional[Tuple[str, str]]:
+        # only classes of the same file can be resolved for a single file
+        if self._class_index.get(file, class_name):
+            return (file, class_name)
+        return None
+
+    # only connects calls to definitions, single_file.ASTSingleFileParser
+    # applies the full codebase resolution to one file
     def _resolve_imports(self, parent: G) -> None:
         # connect all function calls to their definitions
         if not self._function_calls:
@@ -265,50 +605,90 @@ class ASTFileParser():
                 # for call_function_name, call_node_name in self._function_calls[self._filepath].items():
                 #     for definition_location, definition_node_name in self._function_definitions[function_name]:
                 #         if call_location == definition_location:
-                parent.add_edge(self._function_calls[self._filepath][function_name], self._function_definitions[self._filepath][function_name])
-                parent.add_edge(self._function_definitions[self._filepath][function_name], self._function_calls[self._filepath][function_name])
+                self._add_edge_later(self._function_calls[self._filepath][function_name], self._function_definitions[self._filepath][function_name], CALL, bi = True)
 
         # add import edges at the end
-        for edge_from, edge_to in self._edges_to_add:
-            parent.add_edge(edge_from, edge_to)
+        self._add_edges(parent)
 
-    def save_dot_format(self, filepath: str = 'tree.gv') -> str:
+    def condense(self, **options: Any) -> float:
+        # options are passed to condense.condense: fold, merge_attributes, drop_literals
+        # returns the fraction of nodes removed
         if not self._AST:
             raise Exception("AST is empty. Use parse() first.")
-        return self._get_dot_format(filepath)
-    
-    def _get_dot_format(self, filepath: str) -> str:
-        edges = []
-        nodes_ : List[str] = self._AST.get_vertices()
-        nodes = []
-
-        for node in nodes_:
-            n_ : N = self._AST.get_vertex(node)
-            nodes.append((n_.id, n_._start, n_._end))
-            
-            for child in n_.get_connections():
-                edges.append((n_.id, child.id))
-
-        real_stdout = sys.stdout
-        sys.stdout = open(filepath, 'w')
+        before = self._AST.num_vertices
+        with self._stage('condense'):
+            graph = self._AST
+            self._AST, self._condensed_index = condense_graph(graph, **options)
+            self._remap_symbols(graph)
+        ratio = 1 - self._AST.num_vertices / before if before else 0.
+        print(f'Condensed {before} nodes to {self._AST.num_vertices} ({ratio:.1%} fewer)')
+        return ratio
+
+    def _remap_symbols(self, graph: G) -> None:
+        # the links and symbol sites still refer to the nodes of graph, the graph before
+        # condensing, move them to the nodes that represent them and rebuild the symbol index
+        position = self._condensed_index
+        from_, to_, rel = self._links.arrays()
+        from_, to_ = position[from_], position[to_]
+        keep = from_ != to_
+        self._links = EdgeBuffer.from_arrays(from_[keep], to_[keep], rel[keep])
+
+        def remap(id: str) -> str:
+            return self._AST.get_vertex_at(position[graph.index_of(id)]).id
+
+        self._definition_sites = [(file, name, remap(id)) for file, name, id in self._definition_sites]
+        self._import_sites = [(file, name, path, remap(id)) for file, name, path, id in self._import_sites]
+        targets : Dict[str, Set[str]] = {}
+        for id, files in self._import_targets.items():
+            targets.setdefault(remap(id), set()).update(files)
+        self._import_targets = targets
+        if hasattr(self, '_symbols'):
+            self._build_symbol_index()
+
+    def reorder(self, method: str = 'rcm') -> np.ndarray:
+        # renumber the nodes so connected nodes get close indices, which keeps sparse products
+        # over the exported matrices cache friendly. method is one of reorder.METHODS
+        # returns the permutation, node i was node order[i] before
+        if not self._AST:
+            raise Exception("AST is empty. Use parse() first.")
+        with self._stage('reorder'):
+            before = bandwidth(self._AST.edges)
+            self._order = ordering(self._AST.edges, self._AST.num_vertices, method)
+            position = self._AST.permute(self._order)
+            after = bandwidth(self._AST.edges)
+        if hasattr(self, '_condensed_index'):
+            self._condensed_index = position[self._condensed_index]
+        from_, to_, rel = self._links.arrays()
+        self._links = EdgeBuffer.from_arrays(position[from_], position[to_], rel)
+        if self._stats:
+            self._stats.counts('bandwidth', {'before': before[0], 'after': after[0]})
+        print(f'Reordered {self._AST.num_vertices} nodes ({method}): bandwidth {before[0]} -> {after[0]}, mean edge span {before[1]:.1f} -> {after[1]:.1f}')
+        return self._order
 
-        # Dump edge list in Graphviz DOT format
-        print('strict digraph tree {')
-        for row in edges:
-            print('    "{0}" -> "{1}";'.format(*row))
-        for node in nodes:
-            print('    "{0}" [xlabel="{1}->{2}"];'.format(*node))
-        print('}')
+    @property
+    def order(self) -> Optional[np.ndarray]:
+        return self._order
 
-        sys.stdout.close()
-        sys.stdout = real_stdout
+    def save_dot_format(self, filepath: str = 'tree.gv', **options: Any) -> str:
+        # options are passed to dot_writer.write_dot: clusters, node_types, edge_types, files, max_nodes, sample
+        if not self._AST:
+            raise Exception("AST is empty. Use parse() first.")
+        return self._get_dot_format(filepath, **options)
     
-    def convert_to_graphviz(self) -> pgv.AGraph:
+    def _get_dot_format(self, filepath: str, **options: Any) -> str:
+        with self._stage('graphviz'):
+            nodes, edges = write_dot(self._AST, filepath, **options)
+        print(f'Saved {nodes} nodes and {edges} edges to {filepath}')
+        return filepath
+    
+    def convert_to_graphviz(self) -> 'pgv.AGraph':
         if not self._AST:
             raise Exception("AST is empty. Use parse() first.")
-        return self._convert_to_graphviz()
+        with self._stage('graphviz'):
+            return self._convert_to_graphviz()
     
-    def _convert_to_graphviz(self) -> pgv.AGraph:
+    def _convert_to_graphviz(self) -> 'pgv.AGraph':
+        import pygraphviz as pgv
         nodes = self._AST.get_vertices()
         edges = []
         # g = Digraph('G', filename='tree.gv')
@@ -330,40 +710,70 @@ class ASTFileParser():
     def to_csv(self, nf: str, adj: str) -> None:
         if not self._AST:
             raise Exception("AST is empty. Use parse() first.")
-        self._to_csv(nf, adj)
+        with self._stage('export'):
+            self._to_csv(nf, adj)
 
     def _to_csv(self, nf: str, adj: str) -> None:
-        g : pgv.AGraph = self.convert_to_graphviz()
-        g : nx.DiGraph = nx.nx_agraph.from_agraph(g)
-
-        nodes = [n for n in g.nodes()]
-        feats = [feat['xlabel'] for node, feat in dict(g.nodes(data=True)).items()]
-        files = [feat['label'] for node, feat in dict(g.nodes(data=True)).items()]
-        node_feats = pd.DataFrame({'node': nodes, 'feat': feats, 'file': files})
+        import pandas as pd
+        # rows follow the node index so they line up with the adjacency matrices
+        nodes : List[N] = list(self._AST)
+        node_feats = pd.DataFrame({
+            'node': [n.id for n in nodes],
+            'feat': [f'{n._start}->{n._end}' for n in nodes],
+            'file': [n.file for n in nodes],
+        })
         node_feats.to_csv(f"{nf}.csv", index = False)
         print(f'Saved node features to {nf}.csv')
         del node_feats
         del nodes
-        del feats
-        adj_sparse = nx.to_scipy_sparse_array(g, dtype = np.bool_, weight = None)
-        scipy.sparse.save_npz(adj, adj_sparse)
-        print(f'Saved adjacency matrix to {adj}.npz')
+        save_adjacency(adj, self._AST.edges, self._AST.num_vertices)
+        if self._order is not None:
+            save_order(adj, self._order)
+
+    def hierarchy(self) -> Dict[str, Any]:
+        # definition and module level graphs with the maps between the levels, see hierarchy.build_hierarchy
+        if not self._AST:
+            raise Exception("AST is empty. Use parse() first.")
+        imports = [(id, file) for id, files in self._import_targets.items() for file in sorted(files)]
+        return build_hierarchy(self._AST, imports)
 
-    def _to_networkx(self) -> nx.DiGraph:
-        g : pgv.AGraph = self.convert_to_graphviz()
+    def to_hierarchy(self, adj: str) -> None:
+        with self._stage('export'):
+            save_hierarchy(adj, self.hierarchy())
+
+    def subtrees(self) -> Dict[str, Any]:
+        # every distinct syntax subtree once with its number of occurrences, see subtrees.hash_cons
+        if not self._AST:
+            raise Exception("AST is empty. Use parse() first.")
+        with self._stage('dedup'):
+            table = hash_cons(self._AST)
+        nodes, distinct = len(table['canonical']), len(table['types'])
+        if self._stats:
+            self._stats.counts('subtrees', {'nodes': nodes, 'distinct': distinct, 'repeated': int((table['refcount'] > 1).sum())})
+        print(f'{nodes} nodes are {distinct} distinct subtrees ({dedup_ratio(table):.1%} repeated)')
+        return table
+
+    def to_subtrees(self, adj: str) -> None:
+        path = save_subtrees(f'{adj}_subtrees', self.subtrees())
+        print(f'Saved subtrees to {path}')
+
+    def _to_networkx(self) -> 'nx.DiGraph':
+        import networkx as nx
+        g : 'pgv.AGraph' = self.convert_to_graphviz()
         return nx.nx_agraph.from_agraph(g)
 
     def view_k_neighbors(self,
                          node_id: str,
                          k: int = 10
                         ) -> None:
-        g : nx.DiGraph = self._to_networkx()
+        import pygraphviz as pgv
+        g : 'nx.DiGraph' = self._to_networkx()
         g_k = pgv.AGraph(strict=True, directed=True)
         g_k.add_node(node_id)
 
         depth = 0
 
-        def neighbors(g: nx.DiGraph, node_id: str, depth: int) -> None:
+        def neighbors(g: 'nx.DiGraph', node_id: str, depth: int) -> None:
             if depth >= k:
                 return
             depth += 1
@@ -375,85 +785,78 @@ class ASTFileParser():
 
         g_k.write('tree.gv')
 
-    def csv_features_to_vectors(self, nf: str) -> None:
+    def csv_features_to_vectors(self, nf: str, precision: Optional[str] = None) -> None:
         # check that the files exist
         if not os.path.exists(f"{nf}.csv"):
             raise Exception(f'File {nf}.csv does not exist.')
         else:
-            self._csv_features_to_vectors(nf)
+            with self._stage('featurize'):
+                self._csv_features_to_vectors(nf, precision)
         
-    def _csv_features_to_vectors(self, nf: str) -> None:
+    def _csv_features_to_vectors(self, nf: str, precision: Optional[str] = None) -> None:
+        if not self._dim:
+            raise Exception("dim is not set. Pass it to the parser to compute node features.")
+        import pandas as pd
         df = pd.read_csv(f"{nf}.csv", header = 0)
-        if os.path.exists(f'cc.en.{self._dim // 4}.bin'):
-            ft = fasttext.load_model(f'cc.en.{self._dim // 4}.bin')
-        else:
-            fasttext.util.download_model('en', if_exists='ignore')
-            ft = fasttext.load_model('cc.en.300.bin')
-            fasttext.util.reduce_model(ft, self._dim // 4)
-            ft.save_model(f'cc.en.{self._dim // 4}.bin')
-        self._ft = ft
-
-        # define the embedding functions
-        def location_to_embed(location: str) -> np.ndarray:
-            dim = self._dim // 4
-            # get number between first parentheses and comma
-            x = int(re.search(r"\(([0-9]+),", location).groups()[0])
-            y = int(re.search(r",\s([0-9]+)\)", location).groups()[0])
-            res = np.zeros(dim)
-            i = np.arange(dim // 4)
-            res[2*i] = np.sin(x * CONST ** (4 * i / dim))
-            res[2*i + 1] = np.cos(x * CONST ** (4 * i / dim))
-            res[2*i + dim // 2] = np.sin(y * CONST ** (4 * i / dim))
-            res[2*i + dim // 2 + 1] = np.cos(y * CONST ** (4 * i / dim))
-            return res
-
-        def type_to_embed(type_: str, ft: fasttext.FastText._FastText) -> np.ndarray:
-            return ft.get_word_vector(type_)
-        
-        def text_to_embed(text: str, ft: fasttext.FastText._FastText) -> np.ndarray:
-            return ft.get_word_vector(text)
-        
-        def embed(start: str, end: str, type_: str, text: str, ft: fasttext.FastText._FastText) -> np.ndarray:
-            return np.concatenate([location_to_embed(start), location_to_embed(end), type_to_embed(type_, ft), text_to_embed(text, ft)], axis = 0)
+        embedder = get_embedder(self._embedder, self._dim)
 
-        def get_node_text(node_id: str) -> str:
-            return '' if ' | ' not in node_id else (node_id.split(' | ')[1] if not re.match(r"(.*)(_[0-9]+$)", node_id.split(' | ')[1]) else re.match(r"(.*)(_[0-9]+$)", node_id.split(' | ')[1]).groups()[0])
-        
-        def get_node_type(node_id: str) -> str:
-            return node_id[:node_id.rfind('_')] if ' | ' not in node_id else node_id.split(' | ')[0]
-        
         # extract features to columns
-        df['start'] = df['feat'].apply(lambda x: x.split('->')[0])
-        df['end'] = df['feat'].apply(lambda x: x.split('->')[1])
-        df['text'] = df['node'].apply(lambda x: get_node_text(x))
-        df['type'] = df['node'].apply(lambda x: get_node_type(x))
-
-        feats = df.apply(
-            lambda row: embed(row.start, row.end, row.type, row.text, self._ft),
-            axis = 1,
-            result_type = "expand"
+        feats = feature_frame(
+            df['node'],
+            [_parse_point(p.split('->')[0]) for p in df['feat']],
+            [_parse_point(p.split('->')[1]) for p in df['feat']],
+            df['file'],
+            embedder,
+            self._dim,
         )
-        feats['start'] = df['start']
-        feats['end'] = df['end']
-        feats['file'] = df['file']
-        feats.index = df['node']
-        feats.to_csv(f"{nf}.csv")
+        save_feature_frame(nf, feats, precision)
+
+    def to_tokens(self, nf: str, vocab: Optional[str] = None, grow: bool = True) -> None:
+        if not self._AST:
+            raise Exception("AST is empty. Use parse() first.")
+        with self._stage('featurize'):
+            self._to_tokens(nf, vocab, grow)
+
+    def _to_tokens(self, nf: str, vocab: Optional[str], grow: bool) -> None:
+        # type and subtoken ids straight from the graph, in node order
+        from feature_store import save_tokens
+        from vocabulary import Vocabularies
+        nodes : List[N] = list(self._AST)
+        vocabularies = Vocabularies(vocab)
+        type_ids, tokens, offsets = vocabularies.encode(
+            [n.type for n in nodes],
+            [node_id_text(n.id) for n in nodes],
+            grow,
+        )
+        path = save_tokens(
+            nf, type_ids, tokens, offsets,
+            np.array([n._start for n in nodes]),
+            np.array([n._end for n in nodes]),
+            [n.file for n in nodes],
+        )
+        if vocab and grow:
+            vocabularies.save()
+        print(f'Saved token ids to {path} ({len(vocabularies.types)} types, {len(vocabularies.subtokens)} subtokens)')
 
 def main():
     arg_parser = argparse.ArgumentParser()
     arg_parser.add_argument("--file", type=str, required=True, help="Path to file to parse")
+    arg_parser.add_argument("--nf", metavar = "Node features", type = str, help = "File to save node features to")
+    arg_parser.add_argument("--adj", metavar = "Adjacency matrix", type = str, help = "File to save adjacency matrix to")
+    arg_parser.add_argument("--dim", metavar = "Dimension", type = int, help = "Dimension of the node features")
+    arg_parser.add_argument("--embedder", choices = list(EMBEDDERS), default = "fasttext", help = "Embedding of node types and text")
     args = arg_parser.parse_args()
 
-    ast = ASTFileParser(args.file)
+    ast = ASTFileParser(args.file, args.dim, args.embedder)
     ast.parse()
-    ast.convert_to_graphviz()
+    print(f'{ast.AST.num_vertices} nodes, {len(ast.AST.edges)} edges')
     print(ast._imports)
     print(ast._function_calls)
     print(ast._function_definitions)
-    # ast.to_csv()
-
-    # import ast
-    # print(ast.dump(ast.parse(file), indent = 5))
+    if args.nf and args.adj:
+        ast.to_csv(args.nf, args.adj)
+        if args.dim:
+            ast.csv_features_to_vectors(args.nf)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,5 +1,10 @@
 from typing import *
 
+import numpy as np
+
+from edges import CHILD, EdgeBuffer
+from source import SourceBuffer
+
 class Node:
     def __init__(self, 
                  id: str,
@@ -9,7 +14,9 @@ class Node:
                  text: Optional[str] = None,
                  type: Optional[str] = None,
                  var_name: Optional[str] = None,
-                 parent: Optional[Union['Node', None]] = None) -> None:
+                 parent: Optional[Union['Node', None]] = None,
+                 source: Optional[SourceBuffer] = None,
+                 span: Optional[Tuple[int, int]] = None) -> None:
         self._id = id
         self._start = start
         self._end = end
@@ -19,6 +26,11 @@ class Node:
         self._var_name = var_name
         self._adjacent : Dict[Node, int] = {}
         self._parent = parent
+        self._index : int = -1
+        # (start byte, end byte) of the text in the source, the decoded text is shared
+        # through the span cache of the source buffer
+        self._source = source
+        self._span = span
 
     @property
     def id(self) -> str:
@@ -28,6 +40,16 @@ class Node:
     def id(self, value: str) -> None:
         raise Exception("id is read-only.")
 
+    @property
+    def index(self) -> int:
+        return self._index
+
+    @index.setter
+    def index(self, value: int) -> None:
+        if self._index != -1:
+            raise Exception("index is read-only once the node is in a graph.")
+        self._index = value
+
     @property
     def file(self) -> str:
         return self._file
@@ -38,12 +60,18 @@ class Node:
 
     @property
     def text(self) -> str:
+        if self._text is None and self._span is not None:
+            self._text = self._source.text(*self._span)
         return self._text if self._text else ""
 
     @text.setter
     def text(self, value: str) -> None:
         self._text = value
 
+    @property
+    def span(self) -> Optional[Tuple[int, int]]:
+        return self._span
+
     @property
     def type(self) -> str:
         return self._type if self._type else ""
@@ -54,6 +82,9 @@ class Node:
 
     @property
     def var_name(self) -> str:
+        # identifiers are named by their text
+        if self._var_name is None and self._type == 'identifier':
+            return self.text
         return self._var_name if self._var_name else ""
 
     @var_name.setter
@@ -93,6 +124,10 @@ class Graph:
     def __init__(self) -> None:
         self.vert_dict : Dict[str: Node]= {}
         self.num_vertices : int = 0
+        # nodes in insertion order, position is the node index
+        self._nodes : List[Node] = []
+        # every edge in the graph as typed (from index, to index, relation) triples
+        self.edges : EdgeBuffer = EdgeBuffer()
     
     def __iter__(self) -> Iterator[Node]:
         return iter(self.vert_dict.values())
@@ -107,8 +142,10 @@ class Graph:
         if node.parent:
             if node.parent.id not in self.vert_dict:
                 raise Exception(f"Parent {node.parent.id} not in graph.")
+        node.index = self.num_vertices
         self.num_vertices = self.num_vertices + 1
         self.vert_dict[node.id] = node
+        self._nodes.append(node)
 
         return node.id
 
@@ -118,15 +155,49 @@ class Graph:
         else:
             return None
         
-    def add_edge(self, from_: str, to_: str, weight: float = 1, bi: bool = False) -> None:
+    def get_vertex_at(self, index: int) -> Node:
+        return self._nodes[index]
+
+    def index_of(self, id: str) -> int:
+        if id not in self.vert_dict:
+            raise Exception(f"Vertex {id} not in graph.")
+        return self.vert_dict[id].index
+
+    def add_edge(self, from_: str, to_: str, weight: float = 1, bi: bool = False, rel: int = CHILD) -> None:
         if from_ not in self.vert_dict:
             raise Exception(f"Vertex {from_} not in graph.")
         if to_ not in self.vert_dict:
             raise Exception(f"Vertex {to_} not in graph.")
-        self.vert_dict[from_].add_neighbor(self.vert_dict[to_], weight)
+        self._add_edge(self.vert_dict[from_], self.vert_dict[to_], weight, bi, rel)
+
+    def add_edges(self, from_: Iterable[int], to_: Iterable[int], rel: Iterable[int]) -> None:
+        # add edges given as node indices, e.g. from an EdgeBuffer
+        for f, t, r in zip(from_, to_, rel):
+            self._add_edge(self._nodes[f], self._nodes[t], 1, False, int(r))
+
+    def _add_edge(self, from_: Node, to_: Node, weight: float, bi: bool, rel: int) -> None:
+        from_.add_neighbor(to_, weight)
+        self.edges.add(from_.index, to_.index, rel, bi)
         if bi:
-            self.vert_dict[to_].add_neighbor(self.vert_dict[from_], weight)
+            to_.add_neighbor(from_, weight)
     
+    def permute(self, order: Sequence[int]) -> np.ndarray:
+        # move node order[i] to index i, edges follow their endpoints
+        # returns the new index of every node
+        order = np.asarray(order, dtype = np.int64)
+        if len(order) != self.num_vertices:
+            raise Exception(f"Permutation of {len(order)} nodes for a graph with {self.num_vertices}.")
+        position = np.empty(len(order), dtype = np.int64)
+        position[order] = np.arange(len(order))
+        self._nodes = [self._nodes[i] for i in order.tolist()]
+        for i, node in enumerate(self._nodes):
+            # the graph owns the indices of its nodes
+            node._index = i
+        self.vert_dict = {node.id: node for node in self._nodes}
+        from_, to_, rel = self.edges.arrays()
+        self.edges = EdgeBuffer.from_arrays(position[from_], position[to_], rel)
+        return position
+
     def get_vertices(self) -> List[str]:
         return list(self.vert_dict.keys())
     
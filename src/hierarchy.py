@@ -0,0 +1,98 @@
+from typing import *
+
+import numpy as np
+
+from edges import IMPORT, EdgeBuffer
+from graph import Graph as G
+
+# syntax nodes that become a node of the definition level, together with the module roots
+# which stand for the top level code of their file
+DEFINITIONS = frozenset(['function_definition', 'class_definition'])
+
+
+def _owner(parent: np.ndarray, keep: np.ndarray) -> np.ndarray:
+    # closest ancestor-or-self of every node where keep is set, by pointer jumping
+    # roots must be kept
+    owner = np.where(keep, np.arange(len(parent)), parent)
+    while True:
+        jumped = owner[owner]
+        if np.array_equal(jumped, owner):
+            return owner
+        owner = jumped
+
+
+def _project(from_: np.ndarray, to_: np.ndarray, rel: np.ndarray, mapping: np.ndarray) -> EdgeBuffer:
+    # edges between the groups of their endpoints, edges inside a group disappear
+    from_, to_ = mapping[from_], mapping[to_]
+    keep = from_ != to_
+    return EdgeBuffer.from_arrays(from_[keep], to_[keep], rel[keep])
+
+
+def build_hierarchy(graph: G, imports: Iterable[Tuple[str, str]] = ()) -> Dict[str, Any]:
+    # coarsened graphs over the syntax graph:
+    #   definitions: functions, classes and module roots, nested definitions are children
+    #   of the enclosing one and every other edge connects the definitions of its endpoints
+    #   modules: one node per file, with the edges between their definitions and an import
+    #   edge for every (import node id, imported file) pair in imports
+    # definition_of maps every syntax node to its definition, module_of every definition
+    # to its module, both as positions in definitions and modules, which hold syntax node indices
+    n = graph.num_vertices
+    nodes = [graph.get_vertex_at(i) for i in range(n)]
+    parent = np.array([node.parent.index if node.parent else -1 for node in nodes], dtype = np.int64)
+    roots = parent == -1
+    is_definition = roots | np.array([node.type in DEFINITIONS for node in nodes], dtype = np.bool_)
+
+    definitions = np.flatnonzero(is_definition)
+    modules = np.flatnonzero(roots)
+    position = np.full(n, -1, dtype = np.int64)
+    position[definitions] = np.arange(len(definitions))
+    definition_of = position[_owner(parent, is_definition)]
+    position[modules] = np.arange(len(modules))
+    module_of = position[_owner(parent, roots)[definitions]]
+
+    from_, to_, rel = graph.edges.unique()
+    definition_edges = _project(from_, to_, rel, definition_of)
+    from_, to_, rel = definition_edges.arrays()
+    module_edges = _project(from_, to_, rel, module_of)
+
+    module_index = {nodes[i].file: m for m, i in enumerate(modules.tolist())}
+    for import_id, file in imports:
+        node = graph.get_vertex(import_id)
+        if node is None or file not in module_index:
+            continue
+        source = module_of[definition_of[node.index]]
+        if source != module_index[file]:
+            module_edges.add(source, module_index[file], IMPORT)
+
+    return {
+        'definitions': definitions,
+        'modules': modules,
+        'definition_of': definition_of,
+        'module_of': module_of,
+        'definition_edges': definition_edges,
+        'module_edges': module_edges,
+    }
+
+
+def pooling(assignment: np.ndarray, groups: int) -> 'scipy.sparse.csr_array':
+    import scipy.sparse
+    # one row per member with a single 1 in the column of its group
+    return scipy.sparse.csr_array(
+        (np.ones(len(assignment), dtype = np.bool_), (np.arange(len(assignment)), assignment)),
+        shape = (len(assignment), groups),
+    )
+
+
+def save_hierarchy(adj: str, hierarchy: Dict[str, Any]) -> None:
+    import scipy.sparse
+    from file_parser import save_adjacency
+    definitions, modules = hierarchy['definitions'], hierarchy['modules']
+    save_adjacency(f'{adj}_definitions', hierarchy['definition_edges'], len(definitions))
+    save_adjacency(f'{adj}_modules', hierarchy['module_edges'], len(modules))
+    scipy.sparse.save_npz(f'{adj}_pool_definitions', pooling(hierarchy['definition_of'], len(definitions)))
+    scipy.sparse.save_npz(f'{adj}_pool_modules', pooling(hierarchy['module_of'], len(modules)))
+    # syntax node index of the node every coarse node stands for
+    np.save(f'{adj}_definitions_nodes.npy', definitions)
+    np.save(f'{adj}_modules_nodes.npy', modules)
+    print(f'Saved {len(definitions)} definitions ({len(hierarchy["definition_edges"].unique()[0])} edges) and '
+          f'{len(modules)} modules ({len(hierarchy["module_edges"].unique()[0])} edges) to {adj}_definitions, {adj}_modules and {adj}_pool_*')
@@ -0,0 +1,89 @@
+from typing import *
+import re
+
+# import statements at the start of a line, only the first line of a
+# parenthesized name list is seen, which is enough to order the files
+_IMPORT = re.compile(rb'^[ \t]*(?:from[ \t]+([\w.]+)[ \t]+import[ \t]+([^\n#;]*)|import[ \t]+([^\n#;]*))', re.M)
+
+
+def scan_imports(data: bytes) -> List[str]:
+    # module paths a file imports, including module.name for from imports
+    # since name can be a submodule
+    modules = []
+    for from_module, names, plain in _IMPORT.findall(data):
+        if from_module:
+            module = from_module.decode('utf-8', 'replace')
+            for name in names.decode('utf-8', 'replace').strip('()\\ \t\r').split(','):
+                name = name.split(' as ')[0].strip(' ()\t\r')
+                if name and name != '*':
+                    modules.append(module + name if module.endswith('.') else f'{module}.{name}')
+            modules.append(module)
+        else:
+            for name in plain.decode('utf-8', 'replace').split(','):
+                name = name.split(' as ')[0].strip(' ()\\\t\r')
+                if name:
+                    modules.append(name)
+    return modules
+
+
+def build_import_graph(files: Sequence[str],
+                       read: Callable[[str], bytes],
+                       resolve: Callable[[str, str], Optional[str]],
+                       ) -> Dict[str, List[str]]:
+    # file -> files it imports, in first import order
+    graph = {}
+    for file in files:
+        deps : Dict[str, None] = {}
+        for module in scan_imports(read(file)):
+            target = resolve(file, module)
+            if target and target != file:
+                deps[target] = None
+        graph[file] = list(deps)
+    return graph
+
+
+def dependency_order(files: Sequence[str], graph: Mapping[str, Sequence[str]]) -> List[List[str]]:
+    # strongly connected components (import cycles) with every component after
+    # the components it imports from, files of a component keep their given order
+    # iterative tarjan, which emits a component once everything it reaches is emitted
+    position = {f: i for i, f in enumerate(files)}
+    index : Dict[str, int] = {}
+    low : Dict[str, int] = {}
+    on_stack : Set[str] = set()
+    stack : List[str] = []
+    components : List[List[str]] = []
+    for root in files:
+        if root in index:
+            continue
+        work = [(root, iter(graph.get(root, ())))]
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            file, deps = work[-1]
+            for dep in deps:
+                if dep not in position:
+                    continue
+                if dep not in index:
+                    index[dep] = low[dep] = len(index)
+                    stack.append(dep)
+                    on_stack.add(dep)
+                    work.append((dep, iter(graph.get(dep, ()))))
+                    break
+                if dep in on_stack:
+                    low[file] = min(low[file], index[dep])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[file])
+                if low[file] == index[file]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == file:
+                            break
+                    components.append(sorted(component, key = position.__getitem__))
+    return components
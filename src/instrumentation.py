@@ -0,0 +1,123 @@
+from typing import *
+from contextlib import contextmanager
+import cProfile
+import json
+import resource
+import statistics
+import sys
+import time
+
+# stages timed by the parsers, in pipeline order
+STAGES = ['discovery', 'order', 'parse', 'delayed_edges', 'symbol_index', 'condense', 'reorder', 'dedup', 'export', 'featurize', 'graphviz']
+
+# hook(event, name, data) is called with event 'stage' after every stage and 'file' after every parsed file
+Hook = Callable[[str, str, Dict[str, Any]], None]
+
+# files slower than the mean plus this many standard deviations are reported as outliers
+OUTLIER_STDEVS = 3
+SLOWEST_FILES = 10
+
+
+def peak_rss() -> int:
+    # peak resident set size of the process in kilobytes
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+class Stats:
+    def __init__(self, name: Optional[str] = None, profile_stage: Optional[str] = None, profile_path: Optional[str] = None) -> None:
+        # name of the parsed codebase, stored with the record
+        self.name = name
+        # stage name -> seconds, summed if a stage runs more than once
+        self._stages : Dict[str, float] = {}
+        # stage name -> peak rss in kilobytes once the stage finished
+        self._memory : Dict[str, int] = {}
+        # (file, seconds) in parse order
+        self._files : List[Tuple[str, float]] = []
+        # cache name -> [hits, misses]
+        self._caches : Dict[str, List[int]] = {}
+        self._counts : Dict[str, Dict[str, int]] = {}
+        self._hooks : List[Hook] = []
+        # cProfile one stage and dump it to profile_path, e.g. for snakeviz
+        self._profile_stage = profile_stage
+        self._profile_path = profile_path or f'{profile_stage}.prof'
+
+    def add_hook(self, hook: Hook) -> None:
+        self._hooks.append(hook)
+
+    def _emit(self, event: str, name: str, data: Dict[str, Any]) -> None:
+        for hook in self._hooks:
+            hook(event, name, data)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        profiler = cProfile.Profile() if name == self._profile_stage else None
+        start = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(self._profile_path)
+            seconds = time.perf_counter() - start
+            self._stages[name] = self._stages.get(name, 0.) + seconds
+            self._memory[name] = peak_rss()
+            self._emit('stage', name, {'seconds': seconds, 'peak_rss_kb': self._memory[name]})
+
+    def file(self, name: str, seconds: float) -> None:
+        self._files.append((name, seconds))
+        self._emit('file', name, {'seconds': seconds})
+
+    def cache(self, name: str, hits: int, misses: int) -> None:
+        if name not in self._caches:
+            self._caches[name] = [0, 0]
+        self._caches[name][0] += hits
+        self._caches[name][1] += misses
+
+    def counts(self, name: str, counts: Mapping[str, int]) -> None:
+        self._counts[name] = dict(sorted(counts.items(), key = lambda x: -x[1]))
+
+    def _file_summary(self) -> Dict[str, Any]:
+        times = [seconds for _, seconds in self._files]
+        if not times:
+            return {'count': 0}
+        mean = statistics.fmean(times)
+        stdev = statistics.pstdev(times)
+        slowest = sorted(self._files, key = lambda x: -x[1])
+        return {
+            'count': len(times),
+            'total': sum(times),
+            'mean': mean,
+            'median': statistics.median(times),
+            'max': slowest[0][1],
+            'slowest': [{'file': f, 'seconds': s} for f, s in slowest[:SLOWEST_FILES]],
+            'outliers': [{'file': f, 'seconds': s} for f, s in slowest if stdev and s > mean + OUTLIER_STDEVS * stdev],
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'stages': self._stages,
+            'peak_rss_kb': {'stages': self._memory, 'total': peak_rss()},
+            'files': self._file_summary(),
+            'counts': self._counts,
+            'caches': {
+                name: {'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses) if hits + misses else 0.}
+                for name, (hits, misses) in self._caches.items()
+            },
+            'profile': self._profile_path if self._profile_stage in self._stages else None,
+        }
+
+    def save(self, path: str) -> None:
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent = 2)
+
+    def __str__(self) -> str:
+        lines = [f'{name:>14}: {seconds:.3f}s' for name, seconds in self._stages.items()]
+        files = self._file_summary()
+        if files['count']:
+            lines.append(f'{files["count"]} files, median {files["median"]:.3f}s, slowest {files["slowest"][0]["file"]} ({files["max"]:.3f}s)')
+        lines.append(f'peak RSS {peak_rss() / 1024:.1f}MB')
+        return '\n'.join(lines)
@@ -0,0 +1,53 @@
+from typing import *
+
+import numpy as np
+
+from edges import EdgeBuffer
+
+# rcm: reverse cuthill-mckee, small bandwidth
+# bfs: breadth first from the first node of every connected component
+METHODS = ['rcm', 'bfs']
+
+
+def _symmetric(edges: EdgeBuffer, num_nodes: int) -> 'scipy.sparse.csr_array':
+    import scipy.sparse
+    # every relation in both directions, the orderings only need the structure
+    from_, to_, _ = edges.unique()
+    rows = np.concatenate([from_, to_])
+    cols = np.concatenate([to_, from_])
+    return scipy.sparse.csr_array((np.ones(len(rows), dtype = np.int8), (rows, cols)), shape = (num_nodes, num_nodes))
+
+
+def bandwidth(edges: EdgeBuffer) -> Tuple[int, float]:
+    # largest and mean distance between the indices of connected nodes
+    from_, to_, _ = edges.unique()
+    if not len(from_):
+        return 0, 0.
+    span = np.abs(from_ - to_)
+    return int(span.max()), float(span.mean())
+
+
+def ordering(edges: EdgeBuffer, num_nodes: int, method: str = 'rcm') -> np.ndarray:
+    # order[i] is the node placed at index i
+    import scipy.sparse
+    from scipy.sparse.csgraph import breadth_first_order, connected_components, reverse_cuthill_mckee
+    if method not in METHODS:
+        raise Exception(f"Unknown reordering {method}, use one of {METHODS}.")
+    if num_nodes < 2:
+        return np.arange(num_nodes, dtype = np.int64)
+    adjacency = _symmetric(edges, num_nodes)
+    if method == 'rcm':
+        return reverse_cuthill_mckee(adjacency, symmetric_mode = True).astype(np.int64)
+
+    # a single search from an extra node linked to the first node of every component, which
+    # is dropped again. each component comes out in the order of a search from its first node,
+    # interleaved with the others, so a stable sort puts the components after each other
+    _, labels = connected_components(adjacency, directed = False)
+    _, roots = np.unique(labels, return_index = True)
+    rank = np.empty(len(roots), dtype = np.int64)
+    rank[np.argsort(roots)] = np.arange(len(roots))
+    roots = np.sort(roots)
+    link = scipy.sparse.csr_array((np.ones(len(roots), dtype = np.int8), (np.zeros(len(roots), dtype = np.int64), roots)), shape = (1, num_nodes))
+    extended = scipy.sparse.bmat([[adjacency, link.T], [link, None]], format = 'csr')
+    order = breadth_first_order(extended, num_nodes, directed = False, return_predecessors = False)[1:]
+    return order[np.argsort(rank[labels[order]], kind = 'stable')].astype(np.int64)
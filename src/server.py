@@ -0,0 +1,169 @@
+import argparse
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import socket
+import socketserver
+import time
+from typing import *
+
+from codebase_parser import ASTCodebaseParser
+from embedders import EMBEDDERS, get_embedder
+from file_parser import ASTFileParser, embed_nodes
+
+
+def _init_worker(embedders: Sequence[Tuple[str, int]]) -> None:
+    # load the models once per worker so requests only pay for parsing
+    for name, dim in embedders:
+        get_embedder(name, dim)
+
+
+def parse_request(request: Dict[str, Any]) -> Dict[str, Any]:
+    # request: {"path": file or directory, "dim": feature dimension, "features": bool, "embedder": name}
+    start = time.perf_counter()
+    path = request['path']
+    dim = int(request.get('dim', 64))
+    embedder = request.get('embedder', 'fasttext')
+    if os.path.isdir(path):
+        ast = ASTCodebaseParser(path, dim, embedder = embedder)
+        ast.parse_dir()
+    elif os.path.isfile(path):
+        ast = ASTFileParser(path, dim, embedder = embedder)
+        ast.parse()
+    else:
+        raise Exception(f'{path} does not exist.')
+
+    nodes = list(ast.AST)
+    from_, to_, rel = ast.AST.edges.unique()
+    response = {
+        'nodes': [n.id for n in nodes],
+        'files': [n.file for n in nodes],
+        # adjacency in coordinate format, rel is the relation index of every edge
+        'edges': {'from': from_.tolist(), 'to': to_.tolist(), 'rel': rel.tolist()},
+    }
+    if request.get('features', True):
+        feats = embed_nodes(response['nodes'], [n._start for n in nodes], [n._end for n in nodes], get_embedder(embedder, dim), dim)
+        response['features'] = feats.tolist()
+    response['seconds'] = time.perf_counter() - start
+    return response
+
+
+class ParseServer:
+    def __init__(self, workers: int = 4, dims: Sequence[int] = (64,), processes: bool = True, embedders: Sequence[str] = ('fasttext',)) -> None:
+        preload = [(name, dim) for name in embedders for dim in dims]
+        # parsing holds the GIL, so requests are spread over worker processes by default
+        if processes:
+            self._pool : Executor = ProcessPoolExecutor(workers, initializer = _init_worker, initargs = (preload,))
+        else:
+            _init_worker(preload)
+            self._pool = ThreadPoolExecutor(workers)
+        # start the workers now instead of on the first request
+        self._pool.submit(len, []).result()
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            return self._pool.submit(parse_request, request).result()
+        except Exception as e:
+            return {'error': str(e)}
+
+    def handle_json(self, data: bytes) -> Dict[str, Any]:
+        # malformed requests are answered with an error instead of dropping the connection
+        try:
+            request = json.loads(data)
+        except ValueError as e:
+            return {'error': f'invalid json: {e}'}
+        if not isinstance(request, dict):
+            return {'error': 'request must be a json object'}
+        return self.handle(request)
+
+    def serve_unix(self, path: str) -> None:
+        # one json request per line, answered with one json line
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    response = server.handle_json(line)
+                    self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+                    self.wfile.flush()
+
+        if os.path.exists(path):
+            os.remove(path)
+        with socketserver.ThreadingUnixStreamServer(path, Handler) as unix_server:
+            print(f'Listening on {path}')
+            unix_server.serve_forever()
+
+    def serve_http(self, host: str, port: int) -> None:
+        # POST /parse with a json request, GET /health
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, code: int, body: Dict[str, Any]) -> None:
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self) -> None:
+                if self.path == '/health':
+                    self._reply(200, {'status': 'ok'})
+                else:
+                    self._reply(404, {'error': 'not found'})
+
+            def do_POST(self) -> None:
+                if self.path != '/parse':
+                    self._reply(404, {'error': 'not found'})
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                except ValueError:
+                    self._reply(400, {'error': 'invalid Content-Length'})
+                    return
+                response = server.handle_json(self.rfile.read(length))
+                self._reply(400 if 'error' in response else 200, response)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        with ThreadingHTTPServer((host, port), Handler) as http_server:
+            print(f'Listening on http://{host}:{port}')
+            http_server.serve_forever()
+
+
+def query(socket_path: str, request: Dict[str, Any]) -> Dict[str, Any]:
+    # send one request to a server listening on a unix socket
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socket_path)
+        s.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with s.makefile('rb') as f:
+            return json.loads(f.readline())
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--socket", metavar = "Socket", type = str, help = "Unix socket to listen on")
+    arg_parser.add_argument("--port", metavar = "Port", type = int, help = "HTTP port to listen on")
+    arg_parser.add_argument("--host", metavar = "Host", type = str, default = "127.0.0.1", help = "HTTP host to bind to")
+    arg_parser.add_argument("--workers", metavar = "Workers", type = int, default = 4, help = "Number of worker processes")
+    arg_parser.add_argument("--dim", metavar = "Dimension", type = int, nargs = "+", default = [64], help = "Feature dimensions to load models for at startup")
+    arg_parser.add_argument("--embedder", choices = list(EMBEDDERS), nargs = "+", default = ["fasttext"], help = "Embedders to load at startup")
+    arg_parser.add_argument("--threads", action = "store_true", help = "Use worker threads instead of processes")
+    args = arg_parser.parse_args()
+
+    if bool(args.socket) == bool(args.port):
+        arg_parser.error("use one of --socket or --port")
+
+    server = ParseServer(args.workers, args.dim, processes = not args.threads, embedders = args.embedder)
+    if args.socket:
+        server.serve_unix(args.socket)
+    else:
+        server.serve_http(args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
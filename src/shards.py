@@ -0,0 +1,342 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import os
+import shutil
+import time
+from typing import *
+from urllib.parse import quote
+
+import numpy as np
+
+from codebase_parser import ASTCodebaseParser
+from edges import EdgeBuffer
+from embedders import EMBEDDERS, get_embedder
+from feature_store import PRECISIONS
+from file_parser import feature_frame, save_adjacency, save_feature_frame
+from instrumentation import Stats
+
+# nodes of other shards are referred to as @<shard>:<index>, no node type starts with @
+EXTERNAL = '@'
+
+# seconds between checks for another shard's summaries, and how long to wait for them
+WAIT = 0.5
+TIMEOUT = 3600.
+
+
+def external_id(shard: int, index: int) -> str:
+    return f'{EXTERNAL}{shard}:{index}'
+
+
+def parse_external_id(id: str) -> Optional[Tuple[int, int]]:
+    if not id.startswith(EXTERNAL):
+        return None
+    shard, index = id[1:].split(':')
+    return int(shard), int(index)
+
+
+def split_files(files: Sequence[str], shards: int) -> List[List[str]]:
+    # contiguous runs of the discovery order with about the same number of bytes each,
+    # so the modules of a package, which mostly import each other, share a shard
+    sizes = np.cumsum([os.path.getsize(f) for f in files])
+    total = sizes[-1] if len(sizes) else 0
+    parts : List[List[str]] = [[] for _ in range(shards)]
+    for file, size in zip(files, sizes):
+        parts[min(shards * max(int(size) - 1, 0) // total, shards - 1) if total else 0].append(file)
+    return parts
+
+
+def summary_path(work: str, file: str) -> str:
+    return os.path.join(work, 'interfaces', quote(file, safe = '') + '.json')
+
+
+def done_path(work: str, shard: int) -> str:
+    # written once every summary of the shard is saved
+    return os.path.join(work, f'shard-{shard}.done')
+
+
+def failed_path(work: str, shard: int) -> str:
+    # written instead when the shard fails, so shards waiting for its summaries stop
+    return os.path.join(work, f'shard-{shard}.failed')
+
+
+def run_path(work: str, run: str) -> str:
+    # summaries, markers and shard graphs of one run, so files left in the work
+    # directory by an earlier run are never mistaken for this one's
+    return os.path.join(work, run)
+
+
+def graph_path(work: str, shard: int) -> str:
+    # arrays in <path>.npz, node ids, types and files in <path>.json
+    return os.path.join(work, f'shard-{shard}')
+
+
+def _write_json(path: str, data: Any) -> None:
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(f'{path}.tmp', path)
+
+
+class ShardParser(ASTCodebaseParser):
+    # parses one shard of a repository. every worker discovers all files so imports resolve
+    # to the same paths, but only parses its own. once parsed, the module level names of
+    # every file (assignments, functions, classes with their bases and members, imports)
+    # go to a summary file in the shared work directory. references into other shards are
+    # then resolved against the summaries of just the modules they point to and kept as
+    # edges to (shard, node index), which merge_shards turns into one graph
+    def __init__(self,
+                 dir: str,
+                 dim: Optional[int],
+                 work: str,
+                 shard: int,
+                 shards: int,
+                 **kwargs: Any,
+                ) -> None:
+        super().__init__(dir, dim, **kwargs)
+        self._work = work
+        self._shard = shard
+        self._shards = shards
+        parts = split_files(self._relative_files, shards)
+        self._shard_files = parts[shard]
+        # file -> shard that parses it
+        self._owners = {f: i for i, part in enumerate(parts) for f in part}
+        # files of other shards whose summaries are loaded
+        self._loaded : Set[str] = set()
+        # (from index, shard, node index, relation, bi) of edges into other shards
+        self._external : List[Tuple[int, int, int, int, bool]] = []
+
+    def parse_dir(self) -> None:
+        for path in [done_path(self._work, self._shard), failed_path(self._work, self._shard)]:
+            if os.path.exists(path):
+                os.remove(path)
+        with self._stage('order'):
+            components = self._order_files(self._shard_files)
+        with self._stage('parse'):
+            self._parse_files(components)
+        with self._stage('export'):
+            self._write_summaries()
+        with self._stage('delayed_edges'):
+            self._load_targets()
+            self._resolve_delayed_edges()
+        if self._stats:
+            self._record_counts()
+            self._stats.counts('shard', {'files': len(self._shard_files), 'summaries_loaded': len(self._loaded), 'external_edges': len(self._external)})
+
+    def _ready_queues(self) -> List[Tuple[List[tuple], Callable]]:
+        # attribute lookups wait for the summaries, a base class can live in another shard
+        return super()._ready_queues()[:2]
+
+    def _queue_attribute_edge(self, node_id: str, file: str, class_name: str, attribute_name: str) -> None:
+        self._delayed_class_attributes_to_add.append((node_id, file, class_name, attribute_name))
+
+    def _add_edge_later(self, from_: str, to_: str, rel: int, bi: bool = False) -> None:
+        target = parse_external_id(to_)
+        if target is None:
+            super()._add_edge_later(from_, to_, rel, bi)
+        else:
+            self._external.append((self._AST.index_of(from_), *target, rel, bi))
+
+    def summary(self, file: str) -> Dict[str, Any]:
+        # module level names of a parsed file, with node indices into this shard's graph
+        index = self._AST.index_of
+        return {
+            'file': os.path.relpath(file, self._dir),
+            'shard': self._shard,
+            'assignments': {n: [type_, index(id)] for n, (type_, id) in self._assignments.get(file, {}).items()},
+            'functions': {n: index(id) for n, id in self._function_definitions.get(file, {}).items()},
+            # import ids are only checked for aliased_import, they never become edge targets
+            'imports': {n: [id, path] for n, (id, path) in self._imports.get(file, {}).items()},
+            'classes': {
+                n: {'id': index(c.id), 'bases': c.bases, 'members': {m: index(id) for m, id in c.members.items()}}
+                for n, c in self._class_index.classes(file).items()
+            },
+        }
+
+    def _write_summaries(self) -> None:
+        os.makedirs(os.path.join(self._work, 'interfaces'), exist_ok = True)
+        for file in self._shard_files:
+            if file in self._read_files:
+                _write_json(summary_path(self._work, os.path.relpath(file, self._dir)), self.summary(file))
+        _write_json(done_path(self._work, self._shard), sorted(os.path.relpath(f, self._dir) for f in self._read_files))
+
+    def _load_targets(self) -> None:
+        # summaries of the files the queued references point into, and of the files
+        # holding the bases of the classes whose attributes are looked up
+        for queue, _ in super()._ready_queues():
+            for entry in queue:
+                self._load_summary(entry[1])
+        files = list(dict.fromkeys(entry[1] for entry in self._delayed_class_attributes_to_add))
+        seen = set(files)
+        while files:
+            file = files.pop()
+            for info in list(self._class_index.classes(file).values()):
+                for base in info.bases:
+                    target = self._class_module(file, base)
+                    if target and target[0] not in seen:
+                        seen.add(target[0])
+                        self._load_summary(target[0])
+                        files.append(target[0])
+
+    def _load_summary(self, file: str) -> None:
+        owner = self._owners.get(file)
+        if owner is None or owner == self._shard or file in self._loaded:
+            return
+        self._loaded.add(file)
+        self._wait_for(owner)
+        path = summary_path(self._work, os.path.relpath(file, self._dir))
+        if not os.path.exists(path):
+            # the owner skipped the file
+            return
+        with open(path) as f:
+            summary = json.load(f)
+        shard = summary['shard']
+        if summary['assignments']:
+            self._assignments[file] = {n: (type_, external_id(shard, i)) for n, (type_, i) in summary['assignments'].items()}
+        if summary['functions']:
+            self._function_definitions[file] = {n: external_id(shard, i) for n, i in summary['functions'].items()}
+        if summary['imports']:
+            self._imports[file] = {n: (id, path) for n, (id, path) in summary['imports'].items()}
+        for name, info in summary['classes'].items():
+            self._class_index.add_class(file, name, external_id(shard, info['id']), info['bases'])
+            for member, i in info['members'].items():
+                self._class_index.add_member(file, name, member, external_id(shard, i))
+        self._read_files.add(file)
+
+    def _wait_for(self, shard: int) -> None:
+        start = time.perf_counter()
+        while not os.path.exists(done_path(self._work, shard)):
+            if os.path.exists(failed_path(self._work, shard)):
+                raise Exception(f"Shard {shard} failed, its summaries will not be written.")
+            if time.perf_counter() - start > TIMEOUT:
+                raise Exception(f"Timed out waiting for the summaries of shard {shard}.")
+            time.sleep(WAIT)
+
+    def save(self, path: Optional[str] = None) -> None:
+        # nodes, edges within the shard and edges into other shards
+        nodes = list(self._AST)
+        from_, to_, rel = self._AST.edges.arrays()
+        # a reference can resolve to the same target more than once, like the local edges in _add_edges
+        external = np.unique(np.array(self._external, dtype = np.int64).reshape(-1, 5), axis = 0)
+        path = path or graph_path(self._work, self._shard)
+        _write_json(f'{path}.json', {
+            'ids': [n.id for n in nodes],
+            'types': [n.type for n in nodes],
+            'files': [n.file for n in nodes],
+        })
+        np.savez_compressed(
+            f'{path}.npz',
+            starts = np.array([n._start for n in nodes], dtype = np.int64).reshape(-1, 2),
+            ends = np.array([n._end for n in nodes], dtype = np.int64).reshape(-1, 2),
+            edges = np.stack([from_, to_, rel.astype(np.int64)]),
+            external = external,
+        )
+
+
+def mark_failed(work: str, shard: int, error: str) -> None:
+    _write_json(failed_path(work, shard), {'error': error})
+
+
+def parse_shard(dir: str, work: str, shard: int, shards: int, stats: bool = False, **kwargs: Any) -> Dict[str, Any]:
+    try:
+        ast = ShardParser(dir, None, work, shard, shards, stats = Stats(dir) if stats else None, **kwargs)
+        ast.parse_dir()
+        ast.save()
+    except Exception as e:
+        mark_failed(work, shard, str(e))
+        raise
+    return {
+        'files': len(ast._shard_files),
+        'nodes': ast.AST.num_vertices,
+        'external_edges': len(ast._external),
+        'summaries_loaded': len(ast._loaded),
+        'stats': ast.stats.to_dict() if ast.stats else None,
+    }
+
+
+def merge_shards(work: str, shards: int) -> Dict[str, Any]:
+    # concatenate the shard graphs in shard order and connect the edges between them
+    graphs = []
+    for i in range(shards):
+        with open(f'{graph_path(work, i)}.json') as f:
+            graph = json.load(f)
+        graph.update(np.load(f'{graph_path(work, i)}.npz'))
+        graphs.append(graph)
+    offsets = np.cumsum([0] + [len(g['ids']) for g in graphs])
+    edges = EdgeBuffer()
+    for i, g in enumerate(graphs):
+        for f, t, r in (g['edges'].T + [offsets[i], offsets[i], 0]).tolist():
+            edges.add(f, t, r)
+        for f, shard, t, r, bi in g['external'].tolist():
+            edges.add(f + offsets[i], t + offsets[shard], r, bool(bi))
+    return {
+        'ids': [id for g in graphs for id in g['ids']],
+        'types': [t for g in graphs for t in g['types']],
+        'files': [f for g in graphs for f in g['files']],
+        'starts': [tuple(p) for g in graphs for p in g['starts'].tolist()],
+        'ends': [tuple(p) for g in graphs for p in g['ends'].tolist()],
+        'edges': edges,
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--dir", metavar = "Directory", type = str, required = True, help = "Repository to parse")
+    arg_parser.add_argument("--work", metavar = "Directory", type = str, required = True, help = "Directory shared by all workers for summaries and shard graphs")
+    arg_parser.add_argument("--run", metavar = "Run", type = str, help = "Name of this run, its files go to <work>/<run>. Required with --shard and --merge, use a new one for every run")
+    arg_parser.add_argument("--shards", metavar = "Shards", type = int, required = True, help = "Number of shards the files are split into")
+    arg_parser.add_argument("--shard", metavar = "Shard", type = int, help = "Only parse and link this shard, e.g. on another host")
+    arg_parser.add_argument("--merge", action = "store_true", help = "Only merge the saved shard graphs into --nf and --adj")
+    arg_parser.add_argument("--nf", metavar = "Node features", type = str, help = "File to save node features to")
+    arg_parser.add_argument("--adj", metavar = "Adjacency matrix", type = str, help = "File to save adjacency matrix to")
+    arg_parser.add_argument("--dim", metavar = "Dimension", type = int, default = 64, help = "Dimension of the node features")
+    arg_parser.add_argument("--embedder", choices = list(EMBEDDERS), default = "fasttext", help = "Embedding of node types and text")
+    arg_parser.add_argument("--precision", choices = PRECISIONS, help = "Store node features in binary with this precision instead of csv")
+    arg_parser.add_argument("--discovery-order", action = "store_true", help = "Parse the files of a shard in discovery order instead of after the files they import")
+    args = arg_parser.parse_args()
+
+    if args.shard is not None and not 0 <= args.shard < args.shards:
+        arg_parser.error("--shard must be between 0 and --shards - 1")
+    if args.shard is None and not (args.nf and args.adj):
+        arg_parser.error("--nf and --adj are required unless --shard is given")
+    local = args.shard is None and not args.merge
+    if not local and not args.run:
+        arg_parser.error("--run is required with --shard and --merge, every host and the merge use the same")
+    work = run_path(args.work, args.run or f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}')
+    if local and os.path.exists(work):
+        # nothing else writes to the run of a local parse
+        shutil.rmtree(work)
+    os.makedirs(work, exist_ok = True)
+    start = time.perf_counter()
+
+    if not args.merge:
+        shards = [args.shard] if args.shard is not None else list(range(args.shards))
+        options = {'dependency_order': not args.discovery_order}
+        # every shard waits for the summaries it needs, so all of them have to run at once
+        with ProcessPoolExecutor(len(shards)) as pool:
+            futures = {pool.submit(parse_shard, args.dir, work, s, args.shards, **options): s for s in shards}
+            for future in as_completed(futures):
+                shard = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # stop the shards still running at their next wait instead of after TIMEOUT,
+                    # a crashed process could not mark itself
+                    for s in shards:
+                        if not os.path.exists(done_path(work, s)) and not os.path.exists(failed_path(work, s)):
+                            mark_failed(work, s, f'shard {shard} failed')
+                    raise Exception(f"Shard {shard} failed: {e}")
+                print(f'shard {shard}: {result["files"]} files, {result["nodes"]} nodes, {result["external_edges"]} edges into other shards from {result["summaries_loaded"]} summaries')
+        if args.shard is not None:
+            return
+
+    graph = merge_shards(work, args.shards)
+    save_adjacency(args.adj, graph['edges'], len(graph['ids']))
+    feats = feature_frame(graph['ids'], graph['starts'], graph['ends'], graph['files'], get_embedder(args.embedder, args.dim), args.dim)
+    save_feature_frame(args.nf, feats, args.precision)
+    print(f'{len(graph["ids"])} nodes, {len(graph["edges"])} edges from {args.shards} shards in {time.perf_counter() - start:.1f}s')
+    if local:
+        shutil.rmtree(work)
+
+
+if __name__ == "__main__":
+    main()
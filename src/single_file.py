@@ -0,0 +1,67 @@
+import argparse
+import os
+import time
+from typing import *
+
+import numpy as np
+from tree_sitter import Parser
+
+from codebase_parser import ASTCodebaseParser
+from embedders import EMBEDDERS, get_embedder
+from file_parser import embed_nodes
+
+
+class ASTSingleFileParser(ASTCodebaseParser):
+    # the codebase resolution rules on one file: calls, assignments, imports
+    # and class attributes resolve within the file, nothing is discovered on disk
+    # and the file is parsed even if it looks minified
+    MAX_LINE_LENGTH = None
+
+    def __init__(self, filepath: str, dim: Optional[int] = None, parser: Optional[Parser] = None, embedder: str = 'fasttext') -> None:
+        self._single_file = filepath
+        super().__init__(os.path.dirname(filepath), dim, embedder = embedder, parser = parser)
+
+    def get_files(self) -> List[str]:
+        return [self._single_file]
+
+    def arrays(self, features: bool = False) -> Dict[str, Any]:
+        # the graph as arrays in node index order, edges as (from, to, relation) triples
+        nodes = list(self._AST)
+        from_, to_, rel = self._AST.edges.unique()
+        arrays = {
+            'nodes': [n.id for n in nodes],
+            'types': [n.type for n in nodes],
+            'start': np.array([n._start for n in nodes], dtype = np.int32).reshape(-1, 2),
+            'end': np.array([n._end for n in nodes], dtype = np.int32).reshape(-1, 2),
+            'from': from_,
+            'to': to_,
+            'rel': rel,
+        }
+        if features:
+            if not self._dim:
+                raise Exception("dim is needed for node features.")
+            arrays['features'] = embed_nodes(arrays['nodes'], [n._start for n in nodes], [n._end for n in nodes], get_embedder(self._embedder, self._dim), self._dim)
+        return arrays
+
+
+def parse_file(filepath: str, dim: Optional[int] = None, embedder: str = 'fasttext') -> Dict[str, Any]:
+    # parse one file and return its arrays, with node features if dim is given
+    ast = ASTSingleFileParser(filepath, dim, embedder = embedder)
+    ast.parse_dir()
+    return ast.arrays(features = dim is not None)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--file", metavar = "File", type = str, required = True, help = "Path to file to parse")
+    arg_parser.add_argument("--dim", metavar = "Dimension", type = int, help = "Also compute node features of this dimension")
+    arg_parser.add_argument("--embedder", choices = list(EMBEDDERS), default = "fasttext", help = "Embedding of node types and text")
+    args = arg_parser.parse_args()
+
+    start = time.perf_counter()
+    arrays = parse_file(args.file, args.dim, args.embedder)
+    print(f'{len(arrays["nodes"])} nodes, {len(arrays["rel"])} edges in {(time.perf_counter() - start) * 1000:.1f}ms')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+from typing import *
+import codecs
+import mmap
+import os
+import re
+import sys
+
+# files at least this large are memory mapped instead of read
+MMAP_THRESHOLD = 4 * 1024 * 1024
+# files with a line longer than this in their first block count as minified
+MAX_LINE_LENGTH = 1000
+# PEP 263 coding cookie, only valid on the first two lines
+_CODING = re.compile(rb'^[ \t\f]*#.*?coding[:=][ \t]*([-\w.]+)')
+_CHUNK = 64 * 1024
+
+
+class SourceSkipped(Exception):
+    # a file left out of the parse, listed as '<reason> (<message>)'
+    reason = 'skipped'
+
+
+class SourceDecodeError(SourceSkipped):
+    reason = 'undecodable'
+
+
+class MinifiedSourceError(SourceSkipped):
+    reason = 'minified'
+
+
+class SourceBuffer:
+    def __init__(self, data: Union[bytes, mmap.mmap], encoding: str = 'utf-8') -> None:
+        # the utf-8 source handed to tree-sitter, kept once per file
+        # node text is sliced out of it by byte offsets instead of copied per node
+        self._data = data
+        self._view = memoryview(data)
+        # encoding of the file on disk
+        self.encoding = encoding
+        # (start byte, end byte) -> decoded text
+        self._spans : Dict[Tuple[int, int], str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def data(self) -> Union[bytes, mmap.mmap]:
+        return self._data
+
+    def text(self, start: int, end: int) -> str:
+        # decode a span once, repeated names share a single interned string
+        key = (start, end)
+        text = self._spans.get(key)
+        if text is None:
+            self.misses += 1
+            text = sys.intern(str(self._view[start:end], 'utf-8'))
+            self._spans[key] = text
+        else:
+            self.hits += 1
+        return text
+
+    def node_text(self, node: Any) -> str:
+        return self.text(node.start_byte, node.end_byte)
+
+    def release(self) -> None:
+        # drop the decoded spans, text is decoded again on demand
+        self._spans = {}
+
+
+def detect_encoding(head: bytes) -> str:
+    # utf-8 unless a bom or a coding cookie says otherwise
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    for line in head.split(b'\n', 2)[:2]:
+        match = _CODING.match(line)
+        if match:
+            return match.group(1).decode('ascii')
+        # the second line only counts if the first is blank or a comment
+        if line.strip() and not line.lstrip().startswith(b'#'):
+            break
+    return 'utf-8'
+
+
+def _check_utf8(data: Union[bytes, mmap.mmap]) -> None:
+    # validate in chunks so no decoded copy of the whole file is built
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    view = memoryview(data)
+    for i in range(0, len(view), _CHUNK):
+        try:
+            decoder.decode(view[i:i + _CHUNK], final = i + _CHUNK >= len(view))
+        except UnicodeDecodeError as e:
+            raise SourceDecodeError(f'invalid utf-8 at byte {i + e.start}')
+    view.release()
+
+
+def _check_minified(data: Union[bytes, mmap.mmap], max_line_length: int) -> None:
+    # only the first block is looked at, minified files are long lines throughout
+    for line in data[:_CHUNK].split(b'\n'):
+        if len(line) > max_line_length:
+            raise MinifiedSourceError(f'a line of {len(line)} bytes')
+
+
+def load_source(path: str,
+                mmap_threshold: Optional[int] = MMAP_THRESHOLD,
+                max_line_length: Optional[int] = None,
+                ) -> SourceBuffer:
+    # read the raw bytes, only re-encode when a coding cookie asks for another encoding
+    # with max_line_length, files with a longer line are rejected as minified
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if mmap_threshold is not None and size >= mmap_threshold and size > 0:
+            data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        else:
+            data = f.read()
+    if max_line_length is not None and size > max_line_length:
+        _check_minified(data, max_line_length)
+    return decode_source(data)
+
+
+def decode_source(data: Union[bytes, mmap.mmap]) -> SourceBuffer:
+    # source held in memory, same encoding rules as a file on disk
+    encoding = detect_encoding(data[:_CHUNK])
+    try:
+        codec = codecs.lookup(encoding).name
+    except LookupError:
+        raise SourceDecodeError(f'unknown encoding {encoding}')
+
+    if codec in ['utf-8', 'utf-8-sig']:
+        _check_utf8(data)
+        return SourceBuffer(data, codec)
+    try:
+        text = str(data, codec)
+    except UnicodeDecodeError as e:
+        raise SourceDecodeError(f'invalid {codec} at byte {e.start}')
+    return SourceBuffer(text.encode('utf-8'), codec)
@@ -0,0 +1,180 @@
+from typing import *
+
+import numpy as np
+
+from edges import CHILD, EdgeBuffer
+from feature_store import _pack_strings, _unpack_strings
+from graph import Graph as G
+
+
+def _children(parent: np.ndarray, starts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # children of every node in source order as (offsets, indices)
+    n = len(parent)
+    index = np.arange(n)
+    has_parent = parent >= 0
+    order = np.lexsort((index[has_parent], starts[has_parent, 1], starts[has_parent, 0], parent[has_parent]))
+    children = index[has_parent][order]
+    offsets = np.zeros(n + 1, dtype = np.int64)
+    np.cumsum(np.bincount(parent[has_parent], minlength = n), out = offsets[1:])
+    return offsets, children
+
+
+def _id_text(type_: str, id: str) -> str:
+    # the text between the type and the counter of a node id, node_id_text keeps
+    # the counter of multi-line texts
+    if type_ == 'module':
+        return id[len(type_) + 3:]
+    return id[len(type_) + 3:id.rfind('_')] if id.startswith(type_ + ' | ') else ''
+
+
+def hash_cons(graph: G) -> Dict[str, Any]:
+    # every distinct subtree once: two nodes share a class when they have the same type,
+    # text and children classes in the same order, positions and files are ignored.
+    # returns the classes (type, text, children classes, occurrences and subtree size),
+    # the class of every node, and what is needed to expand the classes back into the
+    # graph: the root classes, start and end points, files and the edges that are not
+    # part of the tree, all in expansion order (depth first from the roots in index order)
+    n = graph.num_vertices
+    nodes = [graph.get_vertex_at(i) for i in range(n)]
+    parent = np.array([node.parent.index if node.parent else -1 for node in nodes], dtype = np.int64)
+    starts = np.array([node._start for node in nodes], dtype = np.int64).reshape(-1, 2)
+    offsets, children = _children(parent, starts)
+    roots = np.flatnonzero(parent == -1)
+
+    # depth first order, children after their parent
+    expansion = np.empty(n, dtype = np.int64)
+    stack = roots[::-1].tolist()
+    for k in range(n):
+        i = stack.pop()
+        expansion[k] = i
+        stack.extend(children[offsets[i]:offsets[i + 1]][::-1].tolist())
+
+    types : List[str] = []
+    texts : List[str] = []
+    child_classes : List[int] = []
+    child_offsets = [0]
+    classes : Dict[Tuple, int] = {}
+    canonical = np.empty(n, dtype = np.int64)
+    # children before their parent, so the classes of the children are known
+    for i in expansion[::-1].tolist():
+        node = nodes[i]
+        text = _id_text(node.type, node.id)
+        members = tuple(canonical[children[offsets[i]:offsets[i + 1]]].tolist())
+        key = (node.type, text, members)
+        c = classes.get(key)
+        if c is None:
+            c = classes[key] = len(types)
+            types.append(node.type)
+            texts.append(text)
+            child_classes.extend(members)
+            child_offsets.append(len(child_classes))
+        canonical[i] = c
+
+    child_offsets = np.array(child_offsets, dtype = np.int64)
+    child_classes = np.array(child_classes, dtype = np.int64)
+    refcount = np.bincount(canonical, minlength = len(types))
+    # classes are numbered children first, so sizes can be summed in class order
+    size = np.ones(len(types), dtype = np.int64)
+    for c in range(len(types)):
+        size[c] += size[child_classes[child_offsets[c]:child_offsets[c + 1]]].sum()
+
+    position = np.empty(n, dtype = np.int64)
+    position[expansion] = np.arange(n)
+    from_, to_, rel = graph.edges.unique()
+    semantic = rel != CHILD
+    return {
+        'canonical': canonical,
+        'types': types,
+        'texts': texts,
+        'child_offsets': child_offsets,
+        'child_classes': child_classes,
+        'refcount': refcount,
+        'size': size,
+        'roots': canonical[roots],
+        'files': [nodes[i].file for i in roots.tolist()],
+        'expansion': expansion,
+        'starts': starts[expansion],
+        'ends': np.array([node._end for node in nodes], dtype = np.int64).reshape(-1, 2)[expansion],
+        'edges': np.stack([position[from_[semantic]], position[to_[semantic]], rel[semantic].astype(np.int64)]),
+    }
+
+
+def dedup_ratio(table: Mapping[str, Any]) -> float:
+    # fraction of the nodes that are repeats of a subtree stored elsewhere
+    nodes = len(table['canonical'])
+    return 1 - len(table['types']) / nodes if nodes else 0.
+
+
+def save_subtrees(path: str, table: Mapping[str, Any]) -> str:
+    # the classes plus the per node points, files and non-tree edges, see load_subtrees
+    types, type_codes = np.unique(np.array(table['types'], dtype = object), return_inverse = True)
+    type_names, type_offsets = _pack_strings(types.tolist())
+    texts, text_offsets = _pack_strings(table['texts'])
+    files, file_offsets = _pack_strings(table['files'])
+    np.savez_compressed(
+        path,
+        type_names = type_names,
+        type_offsets = type_offsets,
+        type_codes = type_codes.astype(np.int32),
+        texts = texts,
+        text_offsets = text_offsets,
+        child_offsets = table['child_offsets'],
+        child_classes = table['child_classes'].astype(np.int32),
+        refcount = table['refcount'],
+        roots = table['roots'],
+        files = files,
+        file_offsets = file_offsets,
+        start = table['starts'].astype(np.int32),
+        end = table['ends'].astype(np.int32),
+        edges = table['edges'],
+    )
+    return path if path.endswith('.npz') else f'{path}.npz'
+
+
+def load_subtrees(path: str) -> Dict[str, Any]:
+    # expand the stored classes into one node per occurrence, in the same layout as
+    # dataset.parse_repo: ids, types, starts, ends, files and edges. node i is node
+    # expansion[i] of the saved graph, ids are numbered again in expansion order
+    with np.load(path if path.endswith('.npz') else f'{path}.npz') as data:
+        type_names = _unpack_strings(data['type_names'], data['type_offsets'])
+        types = [type_names[t] for t in data['type_codes'].tolist()]
+        texts = _unpack_strings(data['texts'], data['text_offsets'])
+        child_offsets = data['child_offsets'].tolist()
+        child_classes = data['child_classes'].tolist()
+        roots = data['roots'].tolist()
+        files = _unpack_strings(data['files'], data['file_offsets'])
+        starts, ends, semantic = data['start'], data['end'], data['edges']
+
+    node_types : List[str] = []
+    ids : List[str] = []
+    node_files : List[str] = []
+    edges = EdgeBuffer()
+    counts : Dict[str, int] = {}
+    for root, file in zip(roots, files):
+        # (class, parent index)
+        stack = [(root, -1)]
+        while stack:
+            c, p = stack.pop()
+            i = len(ids)
+            if p >= 0:
+                edges.add(p, i, CHILD)
+            type_, text = types[c], texts[c]
+            if type_ == 'module':
+                ids.append(f'{type_} | {text}')
+            else:
+                name = f'{type_} | {text}' if text else type_
+                counts[name] = counts.get(name, -1) + 1
+                ids.append(f'{name}_{counts[name]}')
+            node_types.append(type_)
+            node_files.append(file)
+            stack.extend((child, i) for child in reversed(child_classes[child_offsets[c]:child_offsets[c + 1]]))
+    for f, t, r in semantic.T.tolist():
+        edges.add(f, t, r)
+    return {
+        'ids': ids,
+        'types': node_types,
+        'starts': [tuple(p) for p in starts.tolist()],
+        'ends': [tuple(p) for p in ends.tolist()],
+        'files': node_files,
+        'edges': edges,
+    }
@@ -0,0 +1,100 @@
+from typing import *
+
+from class_index import ClassIndex
+from edges import ASSIGNMENT, ATTRIBUTE, CALL, IMPORT, EdgeBuffer
+from graph import Graph as G
+
+
+class SymbolIndex:
+    def __init__(self,
+                 graph: G,
+                 links: EdgeBuffer,
+                 definitions: Iterable[Tuple[str, str, str]],
+                 imports: Iterable[Tuple[str, str, str, str]],
+                 import_targets: Mapping[str, Set[str]],
+                 class_index: ClassIndex,
+                ) -> None:
+        # links: (use, target, relation) as node indices, from the use site to what it resolved to
+        # definitions: (file, name, node id) of every function and class definition
+        # imports: (file, name, import path, node id) of every imported name
+        # import_targets: import node id -> files the import resolved to
+        self._graph = graph
+        self._class_index = class_index
+
+        # name -> definition node ids
+        self._definitions : Dict[str, List[str]] = {}
+        for file, name, id in definitions:
+            self._definitions.setdefault(name, []).append(id)
+
+        # file -> (name, import path, node id)
+        self._imports : Dict[str, List[Tuple[str, str, str]]] = {}
+        for file, name, path, id in imports:
+            self._imports.setdefault(file, []).append((name, path, id))
+        self._import_targets = {id: sorted(files) for id, files in import_targets.items()}
+
+        # target node id -> node ids of the uses, per relation
+        self._uses : Dict[int, Dict[str, List[str]]] = {rel: {} for rel in [CALL, IMPORT, ASSIGNMENT, ATTRIBUTE]}
+        from_, to_, rel = links.unique()
+        for f, t, r in zip(from_.tolist(), to_.tolist(), rel.tolist()):
+            if r in self._uses:
+                self._uses[r].setdefault(graph.get_vertex_at(t).id, []).append(graph.get_vertex_at(f).id)
+
+    def definitions(self, name: str) -> List[str]:
+        return self._definitions.get(name, [])
+
+    def callers(self, symbol: str) -> List[str]:
+        # call sites of a definition node id, or of every definition with this name
+        if symbol in self._uses[CALL]:
+            return self._uses[CALL][symbol]
+        callers = []
+        for id in self.definitions(symbol):
+            callers.extend(self._uses[CALL].get(id, []))
+        return callers
+
+    def references(self, id: str) -> List[str]:
+        # uses of an assignment
+        return self._uses[ASSIGNMENT].get(id, [])
+
+    def import_uses(self, id: str) -> List[str]:
+        # identifiers and calls that resolved to an import
+        return self._uses[IMPORT].get(id, [])
+
+    def attribute_uses(self, id: str) -> List[str]:
+        # attribute accesses that resolved to a class member or class definition
+        return self._uses[ATTRIBUTE].get(id, [])
+
+    def members(self, file: str, class_name: str) -> Dict[str, str]:
+        # methods, class assignments and self attributes of a class, including inherited ones
+        return self._class_index.members(file, class_name)
+
+    def imports(self, file: str) -> List[Tuple[str, str, str]]:
+        return self._imports.get(file, [])
+
+    def import_targets(self, id: str) -> List[str]:
+        return self._import_targets.get(id, [])
+
+    def dependents(self, file: str, module: str) -> List[str]:
+        # nodes of file that use a name imported from module, given as a dotted path or a file
+        dependents = []
+        for name, path, id in self.imports(file):
+            full = f'{path}.{name}' if path else name
+            if _matches(module, [path, name, full]) or module in self.import_targets(id):
+                dependents.extend(self.import_uses(id))
+        return dependents
+
+    def callers_many(self, symbols: Iterable[str]) -> Dict[str, List[str]]:
+        return {symbol: self.callers(symbol) for symbol in symbols}
+
+    def references_many(self, ids: Iterable[str]) -> Dict[str, List[str]]:
+        return {id: self.references(id) for id in ids}
+
+    def attribute_uses_many(self, ids: Iterable[str]) -> Dict[str, List[str]]:
+        return {id: self.attribute_uses(id) for id in ids}
+
+    def dependents_many(self, file: str, modules: Iterable[str]) -> Dict[str, List[str]]:
+        return {module: self.dependents(file, module) for module in modules}
+
+
+def _matches(module: str, paths: Sequence[str]) -> bool:
+    # module equals one of the paths or is a package containing it
+    return any(p and (p == module or p.startswith(module + '.')) for p in paths)
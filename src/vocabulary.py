@@ -0,0 +1,107 @@
+import json
+import os
+import re
+from typing import *
+
+import numpy as np
+
+# reserved ids, the same in every vocabulary
+PAD = '<pad>'
+UNK = '<unk>'
+
+# runs of letters and digits in any script, underscores and punctuation separate them
+_WORD = re.compile(r'[^\W_]+')
+
+
+def _split_case(word: str) -> List[str]:
+    # split before an upper case letter that follows a lower case one or starts a lower
+    # case word, and between letters and digits, so fooBar, FOOBar and bar2 give
+    # foo bar, foo bar and bar 2
+    parts = []
+    start = 0
+    for i in range(1, len(word)):
+        a, b = word[i - 1], word[i]
+        if (a.isdigit() != b.isdigit()
+                or (a.islower() and b.isupper())
+                or (a.isupper() and b.isupper() and i + 1 < len(word) and word[i + 1].islower())):
+            parts.append(word[start:i])
+            start = i
+    parts.append(word[start:])
+    return parts
+
+
+def split_subtokens(text: str) -> List[str]:
+    # snake_case, camelCase and punctuation separated parts, lower cased
+    # text without letters or digits, such as an operator, is kept as a single token
+    tokens = [t.lower() for word in _WORD.findall(text) for t in _split_case(word)]
+    return tokens if tokens or not text else [text]
+
+
+class Vocabulary:
+    # append only token -> id map, ids never change once assigned
+    def __init__(self, tokens: Iterable[str] = ()) -> None:
+        self._tokens : List[str] = [PAD, UNK]
+        self._ids : Dict[str, int] = {PAD: 0, UNK: 1}
+        for token in tokens:
+            self.add(token)
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+    def __contains__(self, token: str) -> bool:
+        return token in self._ids
+
+    @property
+    def tokens(self) -> List[str]:
+        return self._tokens
+
+    def add(self, token: str) -> int:
+        if token not in self._ids:
+            self._ids[token] = len(self._tokens)
+            self._tokens.append(token)
+        return self._ids[token]
+
+    def id(self, token: str, grow: bool = True) -> int:
+        # unknown tokens get UNK when the vocabulary is not allowed to grow
+        return self.add(token) if grow else self._ids.get(token, 1)
+
+
+class Vocabularies:
+    # node type and subtoken vocabularies shared by every repository of a dataset
+    def __init__(self, path: Optional[str] = None) -> None:
+        self._path = path
+        self.types = Vocabulary()
+        self.subtokens = Vocabulary()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.types = Vocabulary(data['types'][2:])
+            self.subtokens = Vocabulary(data['subtokens'][2:])
+
+    def encode(self,
+               types: Sequence[str],
+               texts: Sequence[str],
+               grow: bool = True,
+               ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # type id of every node and its text as subtoken ids,
+        # the subtokens of node i are tokens[offsets[i]:offsets[i + 1]]
+        seen = {t: self.types.id(t, grow) for t in dict.fromkeys(types)}
+        type_ids = np.array([seen[t] for t in types], dtype = np.int32)
+        split : Dict[str, List[int]] = {}
+        tokens : List[int] = []
+        offsets = np.zeros(len(texts) + 1, dtype = np.int64)
+        for i, text in enumerate(texts):
+            if text not in split:
+                split[text] = [self.subtokens.id(t, grow) for t in split_subtokens(text)]
+            tokens.extend(split[text])
+            offsets[i + 1] = len(tokens)
+        return type_ids, np.array(tokens, dtype = np.int32), offsets
+
+    def save(self, path: Optional[str] = None) -> None:
+        # write to a temporary file first so an interrupted run keeps the old vocabulary
+        path = path or self._path
+        if not path:
+            raise Exception("No path to save the vocabularies to.")
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump({'types': self.types.tokens, 'subtokens': self.subtokens.tokens}, f)
+        os.replace(f'{path}.tmp', path)